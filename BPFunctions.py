@@ -1,5 +1,10 @@
 
+import torch
+import torch.nn.functional as F
+from mVAE import get_vae, device
+
 def activation_fromBP(L1_activationBP, L2_activationBP, layernum):
+    vae = get_vae()
     if layernum == 1:
         l2_act_bp = F.relu(vae.fc2(L1_activationBP))
         mu_shape = (vae.fc31(l2_act_bp))
@@ -27,11 +32,11 @@ def BPTokens_storage(bpsize, bpPortion,l1_act, l2_act, shape_act, color_act, loc
     bp_in_L1_dim = l1_act.shape[1]
     bp_in_L2_dim = l2_act.shape[1]
     shape_fw = torch.randn(bp_in_shape_dim,
-                            bpsize).cuda()  # make the randomized fixed weights to the binding pool
-    color_fw = torch.randn(bp_in_color_dim, bpsize).cuda()
-    location_fw = torch.randn(bp_in_color_dim, bpsize).cuda()
-    L1_fw = torch.randn(bp_in_L1_dim, bpsize).cuda()
-    L2_fw = torch.randn(bp_in_L2_dim, bpsize).cuda()
+                            bpsize, device=device)  # make the randomized fixed weights to the binding pool
+    color_fw = torch.randn(bp_in_color_dim, bpsize, device=device)
+    location_fw = torch.randn(bp_in_color_dim, bpsize, device=device)
+    L1_fw = torch.randn(bp_in_L1_dim, bpsize, device=device)
+    L2_fw = torch.randn(bp_in_L2_dim, bpsize, device=device)
 
     # ENCODING!  Store each item in the binding pool
     for items in range(bs_testing):  # the number of images
@@ -85,25 +90,25 @@ def BPTokens_retrieveByToken( bpsize, bpPortion, BP_in_items,tokenBindings, l1_a
     bp_in_L2_dim = l2_act.shape[1]
 
     shape_out_all = torch.zeros(bs_testing,
-                                bp_in_shape_dim).cuda()  # will be used to accumulate the reconstructed shapes
+                                bp_in_shape_dim, device=device)  # will be used to accumulate the reconstructed shapes
     color_out_all = torch.zeros(bs_testing,
-                                bp_in_color_dim).cuda()  # will be used to accumulate the reconstructed colors
+                                bp_in_color_dim, device=device)  # will be used to accumulate the reconstructed colors
     location_out_all = torch.zeros(bs_testing,
-                                bp_in_location_dim).cuda()  # will be used to accumulate the reconstructed location
-    L1_out_all = torch.zeros(bs_testing, bp_in_L1_dim).cuda()
-    L2_out_all = torch.zeros(bs_testing, bp_in_L2_dim).cuda()
+                                bp_in_location_dim, device=device)  # will be used to accumulate the reconstructed location
+    L1_out_all = torch.zeros(bs_testing, bp_in_L1_dim, device=device)
+    L2_out_all = torch.zeros(bs_testing, bp_in_L2_dim, device=device)
     BP_in_items = BP_in_items.repeat(bs_testing, 1)  # repeat the matrix to the number of items to easier retrieve
     for items in range(bs_testing):  # for each item to be retrieved
         BP_in_items[items, notLink_all[items, :]] = 0  # set the BPs to zero for this token retrieval
-        L1_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1),L1_fw.t()).cuda()  # do the actual reconstruction
+        L1_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1),L1_fw.t()).to(device)  # do the actual reconstruction
         L1_out_all[items,:] = L1_out_eachimg / bpPortion  # put the reconstructions into a big tensor and then normalize by the effective # of BP nodes
 
-        L2_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1),L2_fw.t()).cuda()  # do the actual reconstruction
+        L2_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1),L2_fw.t()).to(device)  # do the actual reconstruction
         L2_out_all[items, :] = L2_out_eachimg / bpPortion  #
 
-        shape_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1),shape_fw.t()).cuda()  # do the actual reconstruction
-        color_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1), color_fw.t()).cuda()
-        location_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1), location_fw.t()).cuda()
+        shape_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1),shape_fw.t()).to(device)  # do the actual reconstruction
+        color_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1), color_fw.t()).to(device)
+        location_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1), location_fw.t()).to(device)
         shape_out_all[items, :] = shape_out_eachimg / bpPortion  # put the reconstructions into a bit tensor and then normalize by the effective # of BP nodes
         color_out_all[items, :] = color_out_eachimg / bpPortion
         location_out_all[items, :] = location_out_eachimg / bpPortion
@@ -128,26 +133,26 @@ def BPTokens_with_labels(bp_outdim, bpPortion,storeLabels, shape_coef, color_coe
         bp_in_color_dim = color_act.shape[1]
         bp_in_L1_dim = l1_act.shape[1]
         bp_in_L2_dim = l2_act.shape[1]
-        oneHotShape = oneHotShape.cuda()
+        oneHotShape = oneHotShape.to(device)
 
-        oneHotcolor = oneHotcolor.cuda()
+        oneHotcolor = oneHotcolor.to(device)
         bp_in_Slabels_dim = oneHotShape.shape[1]  # dim =20
         bp_in_Clabels_dim= oneHotcolor.shape[1]
 
 
-        shape_out_all = torch.zeros(bs_testing,bp_in_shape_dim).cuda()  # will be used to accumulate the reconstructed shapes
-        color_out_all = torch.zeros(bs_testing,bp_in_color_dim).cuda()  # will be used to accumulate the reconstructed colors
-        L1_out_all = torch.zeros(bs_testing, bp_in_L1_dim).cuda()
-        L2_out_all = torch.zeros(bs_testing, bp_in_L2_dim).cuda()
-        shape_label_out=torch.zeros(bs_testing, bp_in_Slabels_dim).cuda()
-        color_label_out = torch.zeros(bs_testing, bp_in_Clabels_dim).cuda()
+        shape_out_all = torch.zeros(bs_testing,bp_in_shape_dim, device=device)  # will be used to accumulate the reconstructed shapes
+        color_out_all = torch.zeros(bs_testing,bp_in_color_dim, device=device)  # will be used to accumulate the reconstructed colors
+        L1_out_all = torch.zeros(bs_testing, bp_in_L1_dim, device=device)
+        L2_out_all = torch.zeros(bs_testing, bp_in_L2_dim, device=device)
+        shape_label_out=torch.zeros(bs_testing, bp_in_Slabels_dim, device=device)
+        color_label_out = torch.zeros(bs_testing, bp_in_Clabels_dim, device=device)
 
-        shape_fw = torch.randn(bp_in_shape_dim, bp_outdim).cuda()  # make the randomized fixed weights to the binding pool
-        color_fw = torch.randn(bp_in_color_dim, bp_outdim).cuda()
-        L1_fw = torch.randn(bp_in_L1_dim, bp_outdim).cuda()
-        L2_fw = torch.randn(bp_in_L2_dim, bp_outdim).cuda()
-        shape_label_fw=torch.randn(bp_in_Slabels_dim, bp_outdim).cuda()
-        color_label_fw = torch.randn(bp_in_Clabels_dim, bp_outdim).cuda()
+        shape_fw = torch.randn(bp_in_shape_dim, bp_outdim, device=device)  # make the randomized fixed weights to the binding pool
+        color_fw = torch.randn(bp_in_color_dim, bp_outdim, device=device)
+        L1_fw = torch.randn(bp_in_L1_dim, bp_outdim, device=device)
+        L2_fw = torch.randn(bp_in_L2_dim, bp_outdim, device=device)
+        shape_label_fw=torch.randn(bp_in_Slabels_dim, bp_outdim, device=device)
+        color_label_fw = torch.randn(bp_in_Clabels_dim, bp_outdim, device=device)
 
         # ENCODING!  Store each item in the binding pool
         for items in range(bs_testing):  # the number of images
@@ -190,17 +195,17 @@ def BPTokens_with_labels(bp_outdim, bpPortion,storeLabels, shape_coef, color_coe
         for items in range(bs_testing):  # for each item to be retrieved
             BP_in_items[items, notLink_all[items, :]] = 0  # set the BPs to zero for this token retrieval
             if layernum == 1:
-                L1_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1),L1_fw.t()).cuda()  # do the actual reconstruction
+                L1_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1),L1_fw.t()).to(device)  # do the actual reconstruction
                 L1_out_all[items,:] = (L1_out_eachimg / bpPortion ) * normalize_fact # put the reconstructions into a bit tensor and then normalize by the effective # of BP nodes
             if layernum==2:
 
-                L2_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1),L2_fw.t()).cuda()  # do the actual reconstruction
+                L2_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1),L2_fw.t()).to(device)  # do the actual reconstruction
                 L2_out_all[items, :] = L2_out_eachimg / bpPortion  #
             else:
-                shape_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1),shape_fw.t()).cuda()  # do the actual reconstruction
-                color_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1), color_fw.t()).cuda()
-                shapelabel_out_each=torch.mm(BP_in_items[items, :].view(1, -1),shape_label_fw.t()).cuda()
-                colorlabel_out_each = torch.mm(BP_in_items[items, :].view(1, -1), color_label_fw.t()).cuda()
+                shape_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1),shape_fw.t()).to(device)  # do the actual reconstruction
+                color_out_eachimg = torch.mm(BP_in_items[items, :].view(1, -1), color_fw.t()).to(device)
+                shapelabel_out_each=torch.mm(BP_in_items[items, :].view(1, -1),shape_label_fw.t()).to(device)
+                colorlabel_out_each = torch.mm(BP_in_items[items, :].view(1, -1), color_label_fw.t()).to(device)
 
                 shape_out_all[items, :] = shape_out_eachimg / bpPortion  # put the reconstructions into a bit tensor and then normalize by the effective # of BP nodes
                 color_out_all[items, :] = color_out_eachimg / bpPortion
@@ -229,15 +234,15 @@ def BPTokens_binding_all(bp_outdim,  bpPortion, shape_coef,color_coef,shape_act,
         bp_in_L1_dim = l1_act.shape[1]  # neurons in the Bottleneck
         tokenactivation = torch.zeros(bs_testing)  # used for finding max token
         shape_out = torch.zeros(bs_testing,
-                                    bp_in_shape_dim).cuda()  # will be used to accumulate the reconstructed shapes
+                                    bp_in_shape_dim, device=device)  # will be used to accumulate the reconstructed shapes
         color_out= torch.zeros(bs_testing,
-                                    bp_in_color_dim).cuda()  # will be used to accumulate the reconstructed colors
-        l1_out= torch.zeros(bs_testing, bp_in_L1_dim).cuda()
+                                    bp_in_color_dim, device=device)  # will be used to accumulate the reconstructed colors
+        l1_out= torch.zeros(bs_testing, bp_in_L1_dim, device=device)
 
 
-        shape_fw = torch.randn(bp_in_shape_dim, bp_outdim).cuda()  #make the randomized fixed weights to the binding pool
-        color_fw = torch.randn(bp_in_color_dim, bp_outdim).cuda()
-        L1_fw = torch.randn(bp_in_L1_dim, bp_outdim).cuda()
+        shape_fw = torch.randn(bp_in_shape_dim, bp_outdim, device=device)  #make the randomized fixed weights to the binding pool
+        color_fw = torch.randn(bp_in_color_dim, bp_outdim, device=device)
+        L1_fw = torch.randn(bp_in_L1_dim, bp_outdim, device=device)
 
         #ENCODING!  Store each item in the binding pool
         for items in range (bs_testing):   # the number of images
@@ -280,10 +285,10 @@ def BPTokens_binding_all(bp_outdim,  bpPortion, shape_coef,color_coef,shape_act,
         BP_in_items[0, notLink_all[maxtoken, :]] = 0  #now reconstruct color from that one token
         if layernum==1:
 
-            l1_out = torch.mm(BP_in_items.view(1, -1), L1_fw.t()).cuda() / bpPortion  # do the actual reconstruction
+            l1_out = torch.mm(BP_in_items.view(1, -1), L1_fw.t()).to(device) / bpPortion  # do the actual reconstruction
         else:
 
-            shape_out = torch.mm(BP_in_items.view(1, -1), shape_fw.t()).cuda() / bpPortion  # do the actual reconstruction of the BP
-            color_out = torch.mm(BP_in_items.view(1, -1), color_fw.t()).cuda() / bpPortion
+            shape_out = torch.mm(BP_in_items.view(1, -1), shape_fw.t()).to(device) / bpPortion  # do the actual reconstruction of the BP
+            color_out = torch.mm(BP_in_items.view(1, -1), color_fw.t()).to(device) / bpPortion
 
     return tokenactivation, maxtoken, shape_out,color_out, l1_out
\ No newline at end of file
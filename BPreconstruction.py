@@ -57,13 +57,13 @@ from PIL import Image, ImageOps, ImageEnhance, __version__ as PILLOW_VERSION
 
 #print('twoloss singlegrad 75')
 for outs in range(1,2):
-    load_checkpoint('output{num}/checkpoint_threeloss_singlegrad200.pth'.format(num=outs))
-    zc=torch.randn(64,8).cuda()*1
-    zs=torch.randn(64,8).cuda()*1
+    vae = load_checkpoint('output{num}/checkpoint_threeloss_singlegrad200.pth'.format(num=outs), frozen=True)
+    zc=torch.randn(64,8, device=device)*1
+    zs=torch.randn(64,8, device=device)*1
     with torch.no_grad():        
-        sample = vae.decoder_noskip(zs,zc,0).cuda()
-        sample_c= vae.decoder_noskip(zs*0,zc,0).cuda()
-        sample_s = vae.decoder_noskip(zs, zc*0, 0).cuda()
+        sample = vae.decoder_noskip(zs,zc,0).to(device)
+        sample_c= vae.decoder_noskip(zs*0,zc,0).to(device)
+        sample_s = vae.decoder_noskip(zs, zc*0, 0).to(device)
     sample=sample.view(64, 3, 28, 28)
     sample_c=sample_c.view(64, 3, 28, 28)
     sample_s=sample_s.view(64, 3, 28, 28)
@@ -117,7 +117,7 @@ for outs in range(1,2):
            image=trans2(img_new)
            all_imgs.append(image)
         all_imgs=torch.stack(all_imgs)
-        imgs = all_imgs.view(-1, 3 * 28 * 28).cuda()
+        imgs = all_imgs.view(-1, 3 * 28 * 28).to(device)
     else:
         ftest_dataset = datasets.FashionMNIST(root='./fashionmnist_data/', train=False,
                                               transform=transforms.Compose([Colorize_func, transforms.ToTensor()]),
@@ -130,11 +130,11 @@ for outs in range(1,2):
         test_loader_smaller = torch.utils.data.DataLoader(dataset=test_dataset, batch_size=bs, shuffle=True,
                                                           num_workers=nw)
         images, labels = next(iter(test_loader_smaller))
-        imgs = images.view(-1, 3 * 28 * 28).cuda()
+        imgs = images.view(-1, 3 * 28 * 28).to(device)
 
     if trns:
         print('generating encoder and latent activations')
-        l1_act, l2_act, shape_act, color_act = activations(imgs)
+        l1_act, l2_act, shape_act, color_act = tap_activations(imgs, ['fc2', 'conv2', 'shape', 'color']).values()
         #l1_act = l1_act + 1
         #l1_act=torch.log(l1_act)
         #l1_act =torch.pow(l1_act,1/ n_root)
@@ -150,7 +150,7 @@ for outs in range(1,2):
     else:
         if layernum==1:
 
-           l1_act, l2_act, shape_act, color_act = activations(imgs)
+           l1_act, l2_act, shape_act, color_act = tap_activations(imgs, ['fc2', 'conv2', 'shape', 'color']).values()
            l1_act_tr= l1_act.clone()
            l1_act_tr=l1_act_tr+1
            l1_act_tr=torch.log10(l1_act_tr)
@@ -161,7 +161,7 @@ for outs in range(1,2):
            BP_layerI_out = torch.pow(10, BP_layerI_out)-1
            BP_layerI_out[BP_layerI_out <0]=0
         else:
-            l1_act, l2_act, shape_act, color_act = activations(imgs)
+            l1_act, l2_act, shape_act, color_act = tap_activations(imgs, ['fc2', 'conv2', 'shape', 'color']).values()
             BP_in, shape_out_BP, color_out_BP, BP_layerI_out, BP_layer2_out = BP(bpsize, l1_act, l2_act, shape_act,
                                                                                  color_act, shape_coeff, color_coeff)
    # print(shape_out_BP)
@@ -208,10 +208,10 @@ for outs in range(1,2):
     print('saving images to folder')
 
     # reconstruct activations from layer 1
-    sampleVAE = vae.decoder_noskip(shape_act, color_act, 0).cuda()  # reconstruction directly from the latents
-    sampleBP = vae.decoder_noskip(shape_out_BP, color_out_BP, 0).cuda()  # reconstruction of the image after BP memory retrieval
-    sampleBP_s = vae.decoder_noskip(shape_out_BP, color_out_BP * 0, 0).cuda()
-    sampleBP_c = vae.decoder_noskip(shape_out_BP * 0, color_out_BP, 0).cuda()
+    sampleVAE = vae.decoder_noskip(shape_act, color_act, 0).to(device)  # reconstruction directly from the latents
+    sampleBP = vae.decoder_noskip(shape_out_BP, color_out_BP, 0).to(device)  # reconstruction of the image after BP memory retrieval
+    sampleBP_s = vae.decoder_noskip(shape_out_BP, color_out_BP * 0, 0).to(device)
+    sampleBP_c = vae.decoder_noskip(shape_out_BP * 0, color_out_BP, 0).to(device)
     if layernum == 1:
 
         recon_layer1_skip, mu_color, log_var_color, mu_shape, log_var_shape = vae.forward_layers(l1_act, l2_act,layernum, 'skip')
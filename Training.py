@@ -11,11 +11,11 @@ import os
 
 import matplotlib.pyplot as plt
 if d >=2:
-    from mVAE_rec3rd import train, test, vae, optimizer, load_checkpoint
+    from mVAE_rec3rd import train, test, vae, optimizer, load_checkpoint, device
 else:
-    from mVAE import train, test, vae, optimizer, load_checkpoint
-from torch.utils.data import DataLoader, ConcatDataset
-from dataset_builder import Dataset
+    from mVAE import train, test, vae, optimizer, load_checkpoint, device
+from mVAE import save_checkpoint_shards
+from dataset_builder import Dataset, Stream
 
 checkpoint_folder_path = f'output_mnist_2drecurr{d}' # the output folder for the trained model versions
 
@@ -28,24 +28,28 @@ else:
     d=1
 print(f'Device: {d}')
 
-if torch.cuda.is_available():
-    device = torch.device(f'cuda:{d}')
+# the device is configured in mVAE (MLR_DEVICE), d picks the gpu when it has no index
+if device.type == 'cuda' and device.index is None:
     torch.cuda.set_device(d)
     print('CUDA')
-else:
-    device = 'cpu'
+pin_memory = device.type == 'cuda'
+nw = min(4, os.cpu_count()) # loader workers for the training and skip streams, samples are seeded by (seed, epoch, index) so batches do not depend on it
 
-# to resume training an existing model checkpoint, uncomment the following line with the checkpoints filename
-load_checkpoint(f'{checkpoint_folder_path}/checkpoint_most_recent.pth', d)
+# to resume training an existing model checkpoint, uncomment the following lines with the checkpoints filename
+# the sharded folder saved below, or the checkpoint_most_recent.pth file of runs from before the sharded checkpoints
+if os.path.isdir(f'{checkpoint_folder_path}/checkpoint_most_recent'):
+    load_checkpoint(f'{checkpoint_folder_path}/checkpoint_most_recent', d)
+else:
+    load_checkpoint(f'{checkpoint_folder_path}/checkpoint_most_recent.pth', d)
 print('checkpoint loaded')
 
 bs=200
 
-# trainging datasets, the return loaders flag is False so the datasets can be concated in the dataloader
+# trainging datasets
 #emnist_transforms = {'retina':True, 'colorize':True}
-mnist_transforms = {'retina':True, 'colorize':True, 'scale':False, 'location_targets':{'left':[0,1,2,3,4],'right':[5,6,7,8,9]}}
-mnist_test_transforms = {'retina':True, 'colorize':True, 'scale':False, 'location_targets':{'right':[0,1,2,3,4],'left':[5,6,7,8,9]}}
-skip_transforms = {'skip':True, 'colorize':True}
+mnist_transforms = {'retina':True, 'colorize':True, 'scale':False, 'batched_retina':True, 'location_targets':{'left':[0,1,2,3,4],'right':[5,6,7,8,9]}}
+mnist_test_transforms = {'retina':True, 'colorize':True, 'scale':False, 'batched_retina':True, 'location_targets':{'right':[0,1,2,3,4],'left':[5,6,7,8,9]}}
+skip_transforms = {'skip':True, 'colorize':True, 'batched_skip':True}
 
 #emnist_dataset = Dataset('emnist', emnist_transforms)
 mnist_dataset = Dataset('mnist', mnist_transforms)
@@ -56,18 +60,18 @@ mnist_test_dataset = Dataset('mnist', mnist_test_transforms, train= False)
 #emnist_skip = Dataset('emnist', skip_transforms)
 mnist_skip = Dataset('mnist', skip_transforms)
 
-#concat datasets and init dataloaders
-train_loader_noSkip = mnist_dataset.get_loader(bs)
-sample_loader_noSkip = mnist_dataset.get_loader(25)
-test_loader_noSkip = mnist_test_dataset.get_loader(bs)
-mnist_skip = mnist_skip.get_loader(bs)
+#init the data streams, they are endless and kept across epochs; mix datasets by weight, e.g. Stream([mnist_dataset, emnist_dataset], bs, weights=[2,1])
+train_stream_noSkip = Stream([mnist_dataset], bs, num_workers=nw, pin_memory=pin_memory)
+sample_stream_noSkip = Stream([mnist_dataset], 25, pin_memory=pin_memory)
+test_stream_noSkip = Stream([mnist_test_dataset], bs, pin_memory=pin_memory)
+mnist_skip = Stream([mnist_skip], bs, num_workers=nw, pin_memory=pin_memory)
 
 vae.to(device)
 
 loss_dict = torch.load(f'mvae_loss_data_recurr{d}.pt') # {'retinal_train':[], 'retinal_test':[], 'cropped_train':[], 'cropped_test':[]} #  # #
 seen_labels = {}
 for epoch in range(327, 1001):
-    loss_lst, seen_labels = train(epoch, train_loader_noSkip, None, mnist_skip, test_loader_noSkip, sample_loader_noSkip, True, seen_labels)
+    loss_lst, seen_labels = train(epoch, train_stream_noSkip, None, mnist_skip, test_stream_noSkip, sample_stream_noSkip, True, seen_labels)
     
     # save error quantities
     loss_dict['retinal_train'] += [loss_lst[0]]
@@ -77,17 +81,8 @@ for epoch in range(327, 1001):
     torch.save(loss_dict, f'mvae_loss_data_recurr{d}.pt')
 
     torch.cuda.empty_cache()
+    # sharded checkpoints, one file per model component (mVAE.checkpoint_components) plus optimizer.pt and labels.pt
     if epoch in [50,80,100,150,200,250,300,350,400,450,500,550,600,650,700,750,800,850,900,950,1000]:
-        checkpoint =  {
-                 'state_dict': vae.state_dict(),
-                 'optimizer' : optimizer.state_dict(),
-                 'labels': seen_labels
-                      }
-        torch.save(checkpoint,f'{checkpoint_folder_path}/checkpoint_{str(epoch)}.pth')
+        save_checkpoint_shards(f'{checkpoint_folder_path}/checkpoint_{str(epoch)}', vae, optimizer, labels=seen_labels)
     else:
-        checkpoint =  {
-            'state_dict': vae.state_dict(),
-            'optimizer' : optimizer.state_dict(),
-            'labels': seen_labels
-                }
-        torch.save(checkpoint,f'{checkpoint_folder_path}/checkpoint_most_recent.pth')
+        save_checkpoint_shards(f'{checkpoint_folder_path}/checkpoint_most_recent', vae, optimizer, labels=seen_labels)
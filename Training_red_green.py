@@ -3,7 +3,7 @@ import torch
 import os
 import matplotlib.pyplot as plt
 from mVAE import train, test, vae, optimizer, load_checkpoint
-from dataset_builder import Dataset
+from dataset_builder import Dataset, Stream
 
 checkpoint_folder_path = 'output_red_green' # the output folder for the trained model versions
 
@@ -26,14 +26,15 @@ mnist_test_dataset= Dataset('mnist', transforms_test, train=False)
 
 print(mnist_dataset.all_possible_labels())
 
-#concat datasets and init dataloaders
-train_loader_noSkip = mnist_dataset.get_loader(100)
-test_loader_noSkip = mnist_test_dataset.get_loader(100)
+#init the data streams
+train_stream_noSkip = Stream([mnist_dataset], 100)
+sample_stream_noSkip = Stream([mnist_dataset], 25)
+test_stream_noSkip = Stream([mnist_test_dataset], 100)
 
 loss_dict = {'retinal_train':[], 'retinal_test':[], 'cropped_train':[], 'cropped_test':[]}
 
 for epoch in range(1, 301):
-    loss_lst = train(epoch, train_loader_noSkip,None, None, test_loader_noSkip, True)
+    loss_lst = train(epoch, train_stream_noSkip, None, None, test_stream_noSkip, sample_stream_noSkip, True)
     
     # save error quantities
     loss_dict['retinal_train'] += [loss_lst[0]]
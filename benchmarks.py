@@ -0,0 +1,480 @@
+# performance benchmarks for the data pipeline and the model
+# run all of them with: python benchmarks.py
+# or a subset by name:  python benchmarks.py retina
+import sys
+import os
+import time
+import subprocess
+import resource
+import tempfile
+import random
+import torch
+from PIL import Image
+from torchvision import transforms as torch_transforms
+from dataset_builder import Dataset, ShardDataset, Colorize_specific, PadAndPosition, Translate, colorize_batch, render_shards, compose_retina, extract_crops, label_column
+
+bs = 200 # batch size used by Training.py
+n_batches = 20
+
+mnist_transforms = {'retina':True, 'colorize':True, 'scale':False, 'location_targets':{'left':[0,1,2,3,4],'right':[5,6,7,8,9]}}
+
+def time_loader(loader, n_batches = n_batches):
+    # returns samples/sec for pulling n_batches from a dataloader
+    data_iter = iter(loader)
+    next(data_iter) # warm up
+    start = time.perf_counter()
+    for i in range(n_batches):
+        next(data_iter)
+    return (n_batches * loader.batch_size) / (time.perf_counter() - start)
+
+# per-item PIL padding (PadAndPosition) vs batched retina composition in the collate_fn (RetinaCollate)
+def bench_retina():
+    per_item = Dataset('mnist', mnist_transforms)
+    batched = Dataset('mnist', dict(mnist_transforms, batched_retina=True))
+
+    per_item_rate = time_loader(per_item.get_loader(bs))
+    batched_rate = time_loader(batched.get_loader(bs))
+    print(f'retina composition, bs={bs}:')
+    print(f'  per-item PadAndPosition: {per_item_rate:.0f} samples/sec')
+    print(f'  batched RetinaCollate:   {batched_rate:.0f} samples/sec ({batched_rate / per_item_rate:.2f}x)')
+
+# per-image PIL Colorize_specific vs one colorize_batch call on a uint8 batch
+def bench_colorize():
+    images = torch.randint(0, 256, (bs, 1, 28, 28), dtype=torch.uint8)
+    cols = torch.randint(0, 10, (bs,))
+    pil_images = [Image.fromarray(img[0].numpy()) for img in images]
+
+    start = time.perf_counter()
+    for i in range(n_batches):
+        [Colorize_specific(col)(img) for img, col in zip(pil_images, cols.tolist())]
+    per_image_rate = (n_batches * bs) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(n_batches):
+        colorize_batch(images, cols)
+    batched_rate = (n_batches * bs) / (time.perf_counter() - start)
+    print(f'colorization, bs={bs}:')
+    print(f'  per-image Colorize_specific: {per_image_rate:.0f} samples/sec')
+    print(f'  colorize_batch:              {batched_rate:.0f} samples/sec ({batched_rate / per_image_rate:.2f}x)')
+
+# on-the-fly rendering vs reading pre-rendered shards through np.memmap
+def bench_shards():
+    dataset = Dataset('mnist', mnist_transforms, train=False)
+    with tempfile.TemporaryDirectory() as root:
+        start = time.perf_counter()
+        render_shards(dataset, root, epochs=1)
+        render_time = time.perf_counter() - start
+        shards = ShardDataset(root)
+
+        render_rate = time_loader(dataset.get_loader(bs))
+        shard_rate = time_loader(shards.get_loader(bs))
+    print(f'pre-rendered shards, bs={bs} (rendering {len(dataset)} samples took {render_time:.1f}s):')
+    print(f'  Dataset (renders per item): {render_rate:.0f} samples/sec')
+    print(f'  ShardDataset (np.memmap):   {shard_rate:.0f} samples/sec ({shard_rate / render_rate:.2f}x)')
+
+# building the transforms for every item vs the prebuilt Dataset.transform_plan, and loader worker scaling
+def bench_transform_plan(n_items = 2000, num_workers = 4):
+    dataset = Dataset('mnist', mnist_transforms)
+    items = [dataset.dataset[i][0] for i in range(n_items)]
+    keys = [(random.randint(0,9), -1, random.randint(1,2)) for i in range(n_items)]
+
+    start = time.perf_counter()
+    for image, (col, scale, translation) in zip(items, keys):
+        torch_transforms.Compose([Colorize_specific(col), PadAndPosition(Translate(scale, translation, dataset.retina_size))])(image)
+    per_item_rate = n_items / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for image, key in zip(items, keys):
+        dataset.transform_plan[key](image)
+    plan_rate = n_items / (time.perf_counter() - start)
+
+    loader_rate = time_loader(dataset.get_loader(bs))
+    worker_rate = time_loader(dataset.get_loader(bs, num_workers=num_workers))
+    print('transform construction:')
+    print(f'  per-item Compose:   {per_item_rate:.0f} samples/sec')
+    print(f'  prebuilt plan:      {plan_rate:.0f} samples/sec ({plan_rate / per_item_rate:.2f}x)')
+    print(f'  loader, 0 workers:  {loader_rate:.0f} samples/sec')
+    print(f'  loader, {num_workers} workers:  {worker_rate:.0f} samples/sec ({worker_rate / loader_rate:.2f}x)')
+
+# per-item PIL RotateAndCrop vs one affine_grid/grid_sample warp per batch in the collate_fn (SkipCollate)
+def bench_skip():
+    skip_transforms = {'skip':True, 'colorize':True}
+    per_item = Dataset('mnist', skip_transforms)
+    batched = Dataset('mnist', dict(skip_transforms, batched_skip=True))
+
+    per_item_rate = time_loader(per_item.get_loader(bs))
+    batched_rate = time_loader(batched.get_loader(bs))
+    print(f'skip augmentation, bs={bs}:')
+    print(f'  per-item RotateAndCrop: {per_item_rate:.0f} samples/sec')
+    print(f'  batched SkipCollate:    {batched_rate:.0f} samples/sec ({batched_rate / per_item_rate:.2f}x)')
+
+# per-sample slicing (the old mVAE.place_crop loop) vs one scatter with compose_retina, and the extract_crops gather
+def bench_place_crop(retina_size = 64, imgsize = 28):
+    crops = torch.rand(bs, 3, imgsize, imgsize)
+    x = torch.randint(0, retina_size - imgsize + 1, (bs,))
+    y = torch.randint(0, retina_size - imgsize + 1, (bs,))
+    loc = torch.zeros(bs, 2, retina_size)
+    loc[torch.arange(bs), 0, x] = 1
+    loc[torch.arange(bs), 1, y] = 1
+
+    start = time.perf_counter()
+    for i in range(n_batches):
+        out_retina = torch.zeros(bs, 3, retina_size, retina_size)
+        for j in range(bs):
+            x_j = torch.max(loc[j][0], dim=0)[1]
+            y_j = torch.max(loc[j][1], dim=0)[1]
+            out_retina[j, :, (retina_size - y_j) - imgsize:retina_size - y_j, x_j:x_j + imgsize] = crops[j]
+    loop_rate = (n_batches * bs) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(n_batches):
+        x_b, y_b = loc.argmax(2).unbind(1)
+        retina = compose_retina(crops, x_b, y_b, retina_size)[0]
+    batched_rate = (n_batches * bs) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(n_batches):
+        extract_crops(retina, x_b, y_b, imgsize)
+    extract_rate = (n_batches * bs) / (time.perf_counter() - start)
+    print(f'crop placement, bs={bs}:')
+    print(f'  per-sample loop: {loop_rate:.0f} samples/sec')
+    print(f'  compose_retina:  {batched_rate:.0f} samples/sec ({batched_rate / loop_rate:.2f}x)')
+    print(f'  extract_crops:   {extract_rate:.0f} samples/sec')
+
+# one forward() per decoder (as progress_out did) vs a single encode() and one stacked decode()
+def bench_decode(modes = ['location', 'retinal', 'cropped', 'color', 'shape']):
+    from mVAE import vae
+    data, labels = next(iter(Dataset('mnist', dict(mnist_transforms, batched_retina=True)).get_loader(bs)))
+    vae.eval()
+    with torch.no_grad():
+        start = time.perf_counter()
+        for i in range(n_batches):
+            for mode in modes:
+                vae(data, mode)
+        forward_rate = (n_batches * bs) / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for i in range(n_batches):
+            vae.decode(vae.encode(data), modes)
+        decode_rate = (n_batches * bs) / (time.perf_counter() - start)
+    print(f'decoding {len(modes)} modes, bs={bs}:')
+    print(f'  forward per mode: {forward_rate:.0f} samples/sec')
+    print(f'  encode + decode:  {decode_rate:.0f} samples/sec ({decode_rate / forward_rate:.2f}x)')
+
+# eval model vs the same model frozen for inference (batchnorms folded), encode + decode of every mode
+def bench_freeze(modes = ['location', 'retinal', 'cropped', 'color', 'shape', 'skip_cropped']):
+    from mVAE import vae
+    data, labels = next(iter(Dataset('mnist', dict(mnist_transforms, batched_retina=True)).get_loader(bs)))
+    rates = {}
+    for frozen in [False, True]:
+        if frozen:
+            vae.freeze_for_inference()
+        else:
+            vae.eval()
+        with torch.no_grad():
+            vae.decode(vae.encode(data), modes) # warm up
+            start = time.perf_counter()
+            for i in range(n_batches):
+                vae.decode(vae.encode(data), modes)
+            rates[frozen] = (n_batches * bs) / (time.perf_counter() - start)
+    vae.thaw()
+    print(f'inference, {len(modes)} modes, bs={bs}:')
+    print(f'  eval:   {rates[False]:.0f} samples/sec')
+    print(f'  frozen: {rates[True]:.0f} samples/sec ({rates[True] / rates[False]:.2f}x)')
+
+# float vs int8 inference (dynamic fc layers, and static convs on top), bce and classifier accuracy deltas, size and latency
+def bench_quantize(n_train = 1000, n_test = 500, n_calibration = 300):
+    from sklearn import svm
+    import mVAE
+    dataset = Dataset('mnist', dict(mnist_transforms, batched_retina=True))
+    train_data, train_labels = next(iter(dataset.get_loader(n_train)))
+    test_data, test_labels = next(iter(dataset.get_loader(n_test)))
+    calibration_data = next(iter(dataset.get_loader(n_calibration)))[0]
+    mVAE.vae.freeze_for_inference()
+    with torch.no_grad():
+        bundle = mVAE.vae.encode(train_data)
+    clf_ss = svm.SVC(C=10, gamma='scale', kernel='rbf').fit(bundle['z_shape'].cpu().numpy(), label_column(train_labels, 'shape'))
+    clf_cc = svm.SVC(C=10, gamma='scale', kernel='rbf').fit(bundle['z_color'].cpu().numpy(), label_column(train_labels, 'color'))
+    for quantize in ['dynamic', 'static']:
+        mVAE.quantization_report(test_data, test_labels, clf_ss, clf_cc, quantize, calibration_data)
+    mVAE.vae.thaw()
+
+# eager forward vs the compiled per mode inference entries (mVAE.compile_inference) of the frozen model
+def bench_compile(modes = ['cropped', 'retinal', 'shape']):
+    import mVAE
+    data, labels = next(iter(Dataset('mnist', dict(mnist_transforms, batched_retina=True)).get_loader(bs)))
+    x, l = data[1], data[2].view(bs, -1)
+    mVAE.vae.freeze_for_inference()
+    print(f'compiled inference, bs={bs}:')
+    with torch.no_grad():
+        for mode in modes:
+            eager_input = data if mode == 'retinal' else x
+            compiled_input = (x, l) if mode == 'retinal' else (x,)
+            compiled = mVAE.compile_inference(mVAE.vae, mode)
+            start = time.perf_counter()
+            compiled(*compiled_input)
+            compile_time = time.perf_counter() - start
+
+            mVAE.vae(eager_input, mode) # warm up
+            start = time.perf_counter()
+            for i in range(n_batches):
+                mVAE.vae(eager_input, mode)
+            eager_rate = (n_batches * bs) / (time.perf_counter() - start)
+            start = time.perf_counter()
+            for i in range(n_batches):
+                compiled(*compiled_input)
+            compiled_rate = (n_batches * bs) / (time.perf_counter() - start)
+            print(f'  {mode:>8}: eager {eager_rate:6.0f} samples/sec, compiled {compiled_rate:6.0f} samples/sec ({compiled_rate / eager_rate:.2f}x, compiled in {compile_time:.0f}s)')
+    mVAE.vae.thaw()
+
+# the fc retinal decoder vs the spatial transformer one: parameters, flops, retinal step latency and retinal bce
+def bench_retinal_decoder(n_steps = 20):
+    from torch.utils.flop_counter import FlopCounterMode
+    import mVAE
+    stream = iter(Dataset('mnist', dict(mnist_transforms, batched_retina=True)).get_loader(bs))
+    test_data, labels = next(stream)
+    models = {}
+    for retinal_decoder in ['fc', 'stn']:
+        models[retinal_decoder] = mVAE.VAE_CNN(mVAE.x_dim, mVAE.h_dim1, mVAE.h_dim2, mVAE.z_dim, mVAE.l_dim, mVAE.sc_dim, retinal_decoder).to(mVAE.device, mVAE.dtype)
+    models['stn'].load_state_dict(models['fc'].state_dict(), strict=False) # same encoder and crop decoder
+
+    print(f'retinal decoders, bs={bs}, bce after {n_steps} retinal steps:')
+    for retinal_decoder, model in models.items():
+        head = [p for name, p in model.named_parameters() if name.startswith(('fc6', 'fc65', 'fc7', 'fc_place', 'retina_refine'))]
+        optimizer = torch.optim.Adam(model.parameters(), lr=0.0001)
+        model.train()
+        with FlopCounterMode(display=False) as flop_counter:
+            model(test_data, 'retinal')
+        start = time.perf_counter()
+        for i in range(n_steps):
+            data, labels = next(stream)
+            optimizer.zero_grad()
+            recon = model(data, 'retinal')[0]
+            loss = mVAE.loss_function(recon['recon'], data, recon['crop'], None, None, None, None)
+            loss.backward()
+            optimizer.step()
+        step_time = (time.perf_counter() - start) / n_steps
+        model.eval()
+        with torch.no_grad():
+            recon = model(test_data, 'retinal')[0]
+            bce = mVAE.loss_function(recon['recon'], test_data, recon['crop'], None, None, None, None).item() / bs
+        print(f'  {retinal_decoder}: {sum([p.numel() for p in head]):>9} head parameters, {flop_counter.get_total_flops() / bs / 1e6:.1f} MFLOPs/sample, '
+              f'{step_time * 1000:.0f} ms/step, bce {bce:.1f}/sample')
+
+# one retinal training step per process, prints the step memory (peak above the memory before the first step) and the step time
+def retinal_scaling_step(retina_size, retinal_decoder, retina_tile, n_steps = 3):
+    import mVAE
+    data = next(iter(Dataset('mnist', dict(mnist_transforms, batched_retina=True, retina_size=retina_size)).get_loader(bs)))[0]
+    model, z_dim = mVAE.vae_builder(retinal_decoder=retinal_decoder, retina_size=retina_size, checkpoint_retinal=retina_tile is not None, retina_tile=retina_tile)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.0001)
+    model.train()
+    rss = int(open('/proc/self/statm').read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    if mVAE.device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+    start = time.perf_counter()
+    for i in range(n_steps):
+        optimizer.zero_grad()
+        if retina_tile is None:
+            recon = model(data, 'retinal')[0]
+            loss = mVAE.loss_function(recon['recon'], data, recon['crop'], None, None, None, None)
+        else:
+            bundle = model.encode(data)
+            crop = model.decode(bundle, ['cropped'])['cropped'].detach()
+            loss = model.retinal_bce(crop, bundle['z_location'], mVAE.place_crop(crop, data[2]))
+        loss.backward()
+        optimizer.step()
+    step_time = (time.perf_counter() - start) / n_steps
+    if mVAE.device.type == 'cuda':
+        peak = torch.cuda.max_memory_allocated() - base
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - rss
+    print(sum([p.numel() for p in model.parameters()]), peak, step_time)
+
+# peak memory and step time of a retinal training step versus retina size, for the fc decoder, the stn decoder,
+# and the stn decoder with checkpointing and the tiled retinal loss
+def bench_retina_scaling(sizes = [64, 128, 256], retina_tile = 16):
+    print(f'retinal step vs retina size, bs={bs}:')
+    for retinal_decoder, tile in [('fc', None), ('stn', None), ('stn', retina_tile)]:
+        for retina_size in sizes:
+            name = f'{retinal_decoder}{"" if tile is None else f" tiled {tile}"} {retina_size}x{retina_size}'
+            child = subprocess.run([sys.executable, '-c', f'import benchmarks; benchmarks.retinal_scaling_step({retina_size}, {retinal_decoder!r}, {tile})'],
+                                   capture_output=True, text=True, cwd=os.getcwd(), env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+            if child.returncode != 0:
+                print(f'  {name:>20}: failed ({"out of memory" if child.returncode < 0 else child.stderr.strip().splitlines()[-1]})')
+                continue
+            n_params, peak, step_time = child.stdout.split()[-3:]
+            print(f'  {name:>20}: {int(n_params) / 1e6:7.1f}M parameters, {int(peak) / 2**20:7.0f} MB step memory, {float(step_time) * 1000:6.0f} ms/step')
+
+# startup (import to first output, in a fresh process) and shape decode latency: the torch model vs the onnxruntime backend
+def bench_onnx(n_calls = 200):
+    import mVAE
+    import onnx_backend
+    with tempfile.TemporaryDirectory() as folder:
+        mVAE.vae.eval()
+        start = time.perf_counter()
+        onnx_backend.export_onnx(folder, mVAE.vae)
+        export_time = time.perf_counter() - start
+        first_output = {'torch': 'import torch; from mVAE import vae, device; vae.eval(); torch.no_grad().__enter__(); vae.decoder_shape(torch.zeros(1, vae.z_dim, device=device), 0, 0)',
+                        'onnx': f'import torch; from onnx_backend import ONNXBackend; vae = ONNXBackend({folder!r}); vae.decoder_shape(torch.zeros(1, {mVAE.vae.z_dim}), 0, 0)'}
+        z_shape = torch.randn(1, mVAE.vae.z_dim)
+        backend = onnx_backend.ONNXBackend(folder)
+        print(f'onnx backend (exported in {export_time:.0f}s):')
+        for name, model in [('torch', mVAE.vae), ('onnx', backend)]:
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', first_output[name]], check=True, cwd=os.getcwd(), env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+            startup = time.perf_counter() - start
+            with torch.no_grad():
+                model.decoder_shape(z_shape.to(mVAE.device), 0, 0) # warm up
+                start = time.perf_counter()
+                for i in range(n_calls):
+                    model.decoder_shape(z_shape.to(mVAE.device), 0, 0)
+                latency = (time.perf_counter() - start) / n_calls
+            print(f'  {name:>5}: startup {startup:.1f}s, decoder_shape {latency * 1000:.2f} ms/call (bs=1)')
+
+# cold start in a fresh process: importing mVAE, then getting the model (built on first use)
+def bench_import(n_runs = 3):
+    steps = {'import mVAE': 'import mVAE', 'from mVAE import vae': 'from mVAE import vae'}
+    print(f'cold start, best of {n_runs}:')
+    for name, statement in steps.items():
+        times = []
+        for i in range(n_runs):
+            child = subprocess.run([sys.executable, '-c', f'import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)'],
+                                   capture_output=True, text=True, check=True, cwd=os.getcwd(), env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+            times.append(float(child.stdout.split()[-1]))
+        print(f'  {name:>20}: {min(times):.2f}s')
+
+# loading a whole checkpoint file into a built model vs a sharded checkpoint, whole and by component; each load runs in a
+# fresh process that only imports mVAE, the peak rss (VmHWM, ru_maxrss keeps the parent's) includes the torch import (the first row)
+def bench_checkpoint():
+    import mVAE
+    load = ('import time, torch, mVAE; {build}start = time.perf_counter(); model = mVAE.load_checkpoint({path!r}, components={components!r}); '
+            'torch.no_grad().__enter__(); [parameter.sum() for parameter in model.parameters() if not parameter.is_meta]; '
+            'print(time.perf_counter() - start, [int(line.split()[1]) * 1024 for line in open("/proc/self/status") if line.startswith("VmHWM")][0])')
+    with tempfile.TemporaryDirectory() as root:
+        vae = mVAE.vae_builder()[0]
+        torch.save({'state_dict': vae.state_dict()}, f'{root}/checkpoint.pth')
+        mVAE.save_checkpoint_shards(f'{root}/checkpoint', vae)
+        del vae
+        runs = [('import mVAE only', 'import mVAE; print(0, [int(line.split()[1]) * 1024 for line in open("/proc/self/status") if line.startswith("VmHWM")][0])'),
+                ('built model, whole file', load.format(build='mVAE.get_vae(); ', path=f'{root}/checkpoint.pth', components=None)),
+                ('sharded, every component', load.format(build='', path=f'{root}/checkpoint', components=None)),
+                ('sharded, encoder + decoder', load.format(build='', path=f'{root}/checkpoint', components=['encoder', 'decoder'])),
+                ('sharded, encoder', load.format(build='', path=f'{root}/checkpoint', components=['encoder']))]
+        print('checkpoint loading, fresh process:')
+        for name, code in runs:
+            child = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=os.getcwd(),
+                                   env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+            load_time, peak = child.stdout.split()[-2:]
+            print(f'  {name:>26}: load {float(load_time) * 1000:5.0f} ms, peak rss {int(peak) / 2**20:5.0f} MB')
+
+# the plots_novel / tokens_capacity sweep pattern (every model reloaded for every set size) with load_checkpoint and joblib
+# against mVAE.checkpoint_cache, which reads each model once and swaps its weights into the same tensors
+def bench_checkpoint_cache(n_models = 4, n_set_sizes = 4):
+    import numpy as np
+    from joblib import dump, load
+    from sklearn import svm
+    import mVAE
+    with tempfile.TemporaryDirectory() as root:
+        for model_number in range(1, n_models + 1):
+            os.mkdir(f'{root}/output{model_number}')
+            torch.save({'state_dict': mVAE.vae_builder()[0].state_dict()}, f'{root}/output{model_number}/checkpoint.pth')
+            for clf in ['ss', 'sc', 'cc', 'cs']:
+                dump(svm.SVC().fit(np.random.rand(2000, 16), np.arange(2000) % 10), f'{root}/output{model_number}/{clf}{model_number}.joblib')
+        files = lambda model_number: (f'{root}/output{model_number}/checkpoint.pth',
+                                      [f'{root}/output{model_number}/{clf}{model_number}.joblib' for clf in ['ss', 'sc', 'cc', 'cs']])
+        vae = mVAE.get_vae()
+        pointers = [parameter.data_ptr() for parameter in vae.parameters()]
+        start = time.perf_counter()
+        for set_size in range(n_set_sizes):
+            for model_number in range(1, n_models + 1):
+                checkpoint, classifiers = files(model_number)
+                mVAE.load_checkpoint(checkpoint, frozen=True)
+                [load(path) for path in classifiers]
+        uncached = (time.perf_counter() - start) / (n_set_sizes * n_models)
+        print(f'model sweep, {n_models} models x {n_set_sizes} set sizes, per model swap:')
+        print(f'  {"load_checkpoint + joblib":<24}: {uncached * 1000:6.1f} ms')
+        for name, cache in [('mapped', mVAE.CheckpointCache(mmap=True)), ('in memory', mVAE.CheckpointCache())]:
+            times = []
+            for set_size in range(n_set_sizes): # the first set size reads every model, the others only swap
+                start = time.perf_counter()
+                for model_number in range(1, n_models + 1):
+                    cache.load(*files(model_number), frozen=True)
+                times += [(time.perf_counter() - start) / n_models]
+            cached, swap = sum(times) / n_set_sizes, sum(times[1:]) / (n_set_sizes - 1)
+            vae.thaw()
+            same = pointers == [parameter.data_ptr() for parameter in vae.parameters()]
+            info = cache.info()
+            print(f'  {name + " cache":<24}: {cached * 1000:6.1f} ms ({uncached / cached:.1f}x), {times[0] * 1000:.1f} ms read, '
+                  f'{swap * 1000:.1f} ms swap, weights reused in place: {same}, {info["hits"]} hits, {info["misses"]} misses, '
+                  f'{info["nbytes"] / 2**20:.0f} MB cached')
+            del cache
+
+# the models of a table evaluated one after another against mVAE.VAEEnsemble, all of them in one batched pass
+def bench_ensemble(n_models = 10, batch_sizes = [1, 10, 100], modes = ['cropped', 'shape', 'color'], n_runs = 20):
+    import mVAE
+    with tempfile.TemporaryDirectory() as root:
+        models = []
+        for model_number in range(n_models):
+            models += [mVAE.vae_builder(retinal_decoder='stn')[0]] # the small retinal head, ten fc ones take 3 GB
+            mVAE.save_checkpoint_shards(f'{root}/model{model_number}', models[-1])
+            models[-1].freeze_for_inference() # as the tables load them
+        ensemble = mVAE.VAEEnsemble([f'{root}/model{model_number}' for model_number in range(n_models)], retinal_decoder='stn')
+    print(f'{n_models} models, encode + decode {modes}:')
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            x = torch.rand(batch_size, 3, mVAE.imgsize, mVAE.imgsize, device=mVAE.device)
+            sequential = lambda: [model.decode(model.encode(x), modes) for model in models]
+            ensembled = lambda: ensemble.decode(ensemble.encode(x), modes)
+            times = []
+            for run in [sequential, ensembled]:
+                run()
+                start = time.perf_counter()
+                for i in range(n_runs):
+                    run()
+                times += [(time.perf_counter() - start) / n_runs]
+            print(f'  batch {batch_size:>4}: one by one {times[0] * 1000:7.2f} ms, ensemble {times[1] * 1000:7.2f} ms ({times[0] / times[1]:.2f}x)')
+
+# one training step (forward, loss, backward, optimizer step) of each decode mode as train runs it, with the autograd saved
+# activations (the memory that grows with the batch and is held until backward) and the step time
+def bench_train_step(batch_size = bs, n_steps = 10):
+    import mVAE
+    vae = mVAE.vae_builder()[0].train()
+    optimizer = torch.optim.Adam(vae.parameters(), lr=0.0001)
+    crop = torch.rand(batch_size, 3, mVAE.imgsize, mVAE.imgsize, device=mVAE.device)
+    loc = torch.zeros(batch_size, 2, vae.retina_size, device=mVAE.device)
+    loc[torch.arange(batch_size), 0, torch.randint(0, vae.retina_size - mVAE.imgsize, (batch_size,))] = 1
+    loc[torch.arange(batch_size), 1, torch.randint(0, vae.retina_size - mVAE.imgsize, (batch_size,))] = 1
+    data = [mVAE.place_crop(crop, loc), crop, loc]
+    losses = {'shape': lambda out: mVAE.loss_function_shape(out[0], data, out[3], out[4]),
+              'color': lambda out: mVAE.loss_function_color(out[0], data, out[1], out[2]),
+              'location': lambda out: mVAE.loss_function_location(out[0], data, out[5], out[6]),
+              'cropped': lambda out: mVAE.loss_function_crop(out[0], data[1], out[3], out[4], out[1], out[2]),
+              'retinal': lambda out: mVAE.loss_function(out[0]['recon'], data, out[0]['crop'], out[3], out[4], out[1], out[2]),
+              'skip_cropped': lambda out: mVAE.loss_function_crop(out[0], crop, out[3], out[4], out[1], out[2])}
+    steps = [('shape', ['shape'], data), ('color', ['color'], data), ('location', ['location'], data), ('cropped', ['shape', 'color'], data),
+             ('retinal', [], data), ('skip_cropped', ['skip'], crop)]
+    parameters = set([parameter.data_ptr() for parameter in vae.parameters()])
+    saved = []
+    def pack(x): # counts the activations autograd keeps, not the weights
+        if x.data_ptr() not in parameters:
+            saved.append(x.untyped_storage().nbytes())
+        return x
+    print(f'training step, batch {batch_size}:')
+    for mode, keepgrad, x in steps:
+        step = lambda: (optimizer.zero_grad(), losses[mode](vae(x, mode, keepgrad)).backward(), optimizer.step())
+        step() # warm up
+        saved.clear()
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda x: x):
+            losses[mode](vae(x, mode, keepgrad))
+        start = time.perf_counter()
+        for i in range(n_steps):
+            step()
+        print(f'  {mode:>12}: saved activations {sum(saved) / 2**20:7.1f} MB, step {(time.perf_counter() - start) / n_steps * 1000:7.1f} ms')
+
+benchmarks = {'retina': bench_retina, 'colorize': bench_colorize, 'shards': bench_shards, 'transform_plan': bench_transform_plan, 'skip': bench_skip, 'place_crop': bench_place_crop, 'decode': bench_decode, 'retinal_decoder': bench_retinal_decoder, 'retina_scaling': bench_retina_scaling, 'freeze': bench_freeze, 'quantize': bench_quantize, 'compile': bench_compile, 'onnx': bench_onnx, 'import': bench_import, 'checkpoint': bench_checkpoint, 'checkpoint_cache': bench_checkpoint_cache, 'ensemble': bench_ensemble, 'train_step': bench_train_step}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] if len(sys.argv[1:]) != 0 else list(benchmarks)
+    for name in names:
+        benchmarks[name]()
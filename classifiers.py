@@ -4,7 +4,8 @@ import numpy as np
 from sklearn import svm
 from sklearn.metrics import classification_report, confusion_matrix, accuracy_score
 from torchvision import utils
-from mVAE import vae
+from mVAE import get_vae, device, to_device
+from dataset_builder import label_column
 from PIL import Image, ImageOps, ImageEnhance, __version__ as PILLOW_VERSION
 import matplotlib.pyplot as plt
 
@@ -18,17 +19,18 @@ vals = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'A', 'B', 'C', 'D', 'E
 
 #training the shape map on shape labels and color labels
 def classifier_shape_train(whichdecode_use, train_dataset):
+    vae = get_vae()
     vae.eval()
     with torch.no_grad():
         data, labels = next(iter(train_dataset))
-        train_shapelabels=labels[0].clone()
-        train_colorlabels=labels[1].clone()
+        train_shapelabels=label_column(labels, 'shape')
+        train_colorlabels=label_column(labels, 'color')
         print(train_shapelabels[0:10])
         utils.save_image(data[0:10],'train_sample.png')
 
-        data = data.cuda()
+        data = to_device(data)
         recon_batch, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location = vae(data, whichdecode_use)
-        z_shape = vae.sampling(mu_shape, log_var_shape).cuda()
+        z_shape = vae.sampling(mu_shape, log_var_shape).to(device)
         print('training shape bottleneck against color labels sc')
         clf_sc.fit(z_shape.cpu().numpy(), train_colorlabels)
 
@@ -37,14 +39,15 @@ def classifier_shape_train(whichdecode_use, train_dataset):
 
 #testing the shape classifier (one image at a time)
 def classifier_shape_test(whichdecode_use, clf_ss, clf_sc, test_dataset, confusion_mat=0):
+    vae = get_vae()
     vae.eval()
     with torch.no_grad():
         data, labels = next(iter(test_dataset))
-        test_shapelabels=labels[0].clone()
-        test_colorlabels=labels[1].clone()
-        data = data.cuda()
+        test_shapelabels=label_column(labels, 'shape')
+        test_colorlabels=label_column(labels, 'color')
+        data = to_device(data)
         recon_batch, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location = vae(data, whichdecode_use)
-        z_shape = vae.sampling(mu_shape, log_var_shape).cuda()
+        z_shape = vae.sampling(mu_shape, log_var_shape).to(device)
         pred_ss = clf_ss.predict(z_shape.cpu())
         pred_sc = clf_sc.predict(z_shape.cpu())
 
@@ -69,15 +72,16 @@ def classifier_shape_test(whichdecode_use, clf_ss, clf_sc, test_dataset, confusi
 
 #training the color map on shape and color labels
 def classifier_color_train(whichdecode_use, train_dataset):
+    vae = get_vae()
     vae.eval()
     with torch.no_grad():
         data, labels = next(iter(train_dataset))
-        train_shapelabels=labels[0].clone()
-        train_colorlabels=labels[1].clone()
-        data = data.cuda()
+        train_shapelabels=label_column(labels, 'shape')
+        train_colorlabels=label_column(labels, 'color')
+        data = to_device(data)
 
         recon_batch, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location = vae(data, whichdecode_use)
-        z_color = vae.sampling(mu_color, log_var_color).cuda()
+        z_color = vae.sampling(mu_color, log_var_color).to(device)
         print('training color bottleneck against color labels cc')
         clf_cc.fit(z_color.cpu().numpy(), train_colorlabels)
 
@@ -86,15 +90,16 @@ def classifier_color_train(whichdecode_use, train_dataset):
 
 #testing the color classifier (one image at a time)
 def classifier_color_test(whichdecode_use, clf_cc, clf_cs, test_dataset, verbose=0):
+    vae = get_vae()
     vae.eval()
     with torch.no_grad():
         data, labels = next(iter(test_dataset))
-        test_shapelabels=labels[0].clone()
-        test_colorlabels=labels[1].clone()
-        data = data.cuda()
+        test_shapelabels=label_column(labels, 'shape')
+        test_colorlabels=label_column(labels, 'color')
+        data = to_device(data)
         recon_batch, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location = vae(data, whichdecode_use)
 
-        z_color = vae.sampling(mu_color, log_var_color).cuda()
+        z_color = vae.sampling(mu_color, log_var_color).to(device)
         pred_cc = torch.tensor(clf_cc.predict(z_color.cpu()))
         pred_cs = torch.tensor(clf_cs.predict(z_color.cpu()))
 
@@ -125,7 +130,7 @@ def classifier_shapemap_test_imgs(shape, shapelabels, colorlabels,numImg, clf_sh
     with torch.no_grad():
         predicted_labels=torch.zeros(1,numImg)
         shape = torch.squeeze(shape, dim=1)
-        shape = shape.cuda()
+        shape = shape.to(device)
         test_colorlabels = thecolorlabels(test_dataset)
         pred_ssimg = torch.tensor(clf_shapeS.predict(shape.cpu()))
 
@@ -154,7 +159,7 @@ def classifier_colormap_test_imgs(color, shapelabels, colorlabels,numImg, clf_co
     with torch.no_grad():
 
         color = torch.squeeze(color, dim=1)
-        color = color.cuda()
+        color = color.to(device)
         test_colorlabels = thecolorlabels(test_dataset)
 
 
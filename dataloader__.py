@@ -3,9 +3,9 @@ import numpy as np
 import torch
 from PIL import Image
 from torch.utils.data.dataset import Dataset
-from matplotlib.pyplot import imread
 from torch import Tensor
 from torchvision import transforms
+from concurrent.futures import ThreadPoolExecutor
 """
 Loads the train/test set. 
 Every image in the dataset is 28x28 pixels and the labels are numbered from 0-9
@@ -14,47 +14,71 @@ for A-J respectively.
 Set root to point to the Train/Test folders.
 """
 
+def _decode(img_path):
+	# returns the 28x28 uint8 image, or None for the damaged files in the dataset
+	try:
+		img = np.array(Image.open(img_path))
+	except Exception:
+		return None
+	if img.shape != (28, 28):
+		return None
+	return img
+
+def pack_notMNIST(root, num_threads = 16):
+	# One-time conversion of the PNG folders into a single contiguous uint8 image array and a label array.
+	# The PNGs are decoded in parallel by a thread pool, damaged files are listed in broken_files.txt.
+	paths, Y = [], []
+	folders = sorted(folder for folder in os.listdir(root) if os.path.isdir(os.path.join(root, folder)))
+	for folder in folders:
+		folder_path = os.path.join(root, folder)
+		for ims in sorted(os.listdir(folder_path)):
+			paths.append(os.path.join(folder_path, ims))
+			Y.append(ord(folder) - 65)  # Folders are A-J so labels will be 0-9
+
+	with ThreadPoolExecutor(num_threads) as pool:
+		decoded = list(pool.map(_decode, paths))
+
+	keep = [i for i, img in enumerate(decoded) if img is not None]
+	broken = [os.path.relpath(paths[i], root) for i, img in enumerate(decoded) if img is None]
+	for path in broken:
+		print("File {} is broken".format(path))
+
+	images = np.lib.format.open_memmap(os.path.join(root, 'packed_images.npy'), mode='w+', dtype=np.uint8, shape=(len(keep), 28, 28))
+	for j, i in enumerate(keep):
+		images[j] = decoded[i]
+	images.flush()
+	np.save(os.path.join(root, 'packed_labels.npy'), np.array([Y[i] for i in keep], dtype=np.int64))
+	with open(os.path.join(root, 'broken_files.txt'), 'w') as f:
+		f.write('\n'.join(broken))
+
 # Creating a sub class of torch.utils.data.dataset.Dataset
 class notMNIST(Dataset):
 
 	# The init method is called when this class will be instantiated.
+	# The PNGs are packed into root/packed_images.npy on first use and memory-mapped from then on.
 	def __init__(self, root, transform = None):
-		Images, Y = [], []
-		folders = os.listdir(root)
 		self.transform=transform
-
-		for folder in folders:
-			folder_path = os.path.join(root, folder)
-			for ims in os.listdir(folder_path):
-				try:
-					img_path = os.path.join(folder_path, ims)
-					Images.append(np.array(imread(img_path)))
-					Y.append(ord(folder) - 65)  # Folders are A-J so labels will be 0-9
-				except:
-					# Some images in the dataset are damaged
-					print("File {}/{} is broken".format(folder, ims))
-		data = [(x, y) for x, y in zip(Images, Y)]
-		self.data = data
+		self.root = root
+		if not os.path.exists(os.path.join(root, 'packed_images.npy')):
+			pack_notMNIST(root)
+		self.labels = np.load(os.path.join(root, 'packed_labels.npy'))
+		self.images = None # mapped lazily so that every loader worker maps the file itself
 
 	# The number of items in the dataset
 	def __len__(self):
-		return int(len(self.data)/4)
+		return int(len(self.labels)/4)
 
 	# The Dataloader is a generator that repeatedly calls the getitem method.
 	# getitem is supposed to return (X, Y) for the specified index.
 	def __getitem__(self, index):
-		img = self.data[index][0]
-
+		if self.images is None:
+			self.images = np.load(os.path.join(self.root, 'packed_images.npy'), mmap_mode='r')
 
-		# 8 bit images. Scale between [0,1]. This helps speed up our training
-		img = img.reshape(28, 28)
-		img= Image.fromarray(img*255)
+		# 8 bit images, already stored as uint8 so no float round-trip is needed
+		img = Image.fromarray(np.array(self.images[index]))
 
 		if self.transform is not None:
 			img = self.transform(img)
-		#img = img.reshape(28, 28) / 255.0
 
-		# Input for Conv2D should be Channels x Height x Width
-		#img_tensor = Tensor(img).view(1, 28, 28).float()
-		label = self.data[index][1]
+		label = int(self.labels[index])
 		return (img, label)
@@ -1,11 +1,13 @@
 # prerequisites
 import torch
+import torch.nn.functional as F
 import os
+import math
 import numpy as np
 from torchvision import datasets
 from torchvision import transforms as torch_transforms
 from torch.utils import data #.data import #DataLoader, Subset, Dataset
-import random
+from torch.utils.data.dataloader import default_collate
 from PIL import Image, ImageOps, ImageEnhance, __version__ as PILLOW_VERSION
 
 colornames = ["red", "green", "blue", "purple", "yellow", "cyan", "orange", "brown", "pink", "white"]
@@ -23,17 +25,36 @@ colorvals = [
     [1-colorrange,1-colorrange,1-colorrange]
 ]
 
+label_fields = ['shape', 'color', 'location', 'scale'] # columns of a label tensor, -1 marks a field the dataset does not use
+
+def label_column(labels, field):
+    # one field of a [4] label tensor or a collated [B, 4] batch of them, as int64 for one_hot, indexing and sklearn
+    return labels[..., label_fields.index(field)].long()
+
+def sample_rng(seed, epoch, index):
+    # counter-based (Philox) stream for one sample, the same (seed, epoch, index) always regenerates the same stimulus
+    # epoch and index sit in the high counter words so streams of different samples never overlap
+    return np.random.Generator(np.random.Philox(key=seed, counter=[0, 0, epoch, index]))
+
+def seed_worker(worker_id):
+    # worker_init_fn: give every loader worker its own global numpy state, torch already does this for random and torch
+    np.random.seed(torch.initial_seed() % 2**32)
+
 class Colorize_specific:
     def __init__(self, col):
         self.col = col
 
-    def __call__(self, img):
+    def __call__(self, img, rng = None):
         # col: an int index for which base color is being used
+        # rng: the sample's numpy Generator, a fresh one is used when None
+        if rng is None:
+            rng = np.random.default_rng()
         rgb = colorvals[self.col]  # grab the rgb for this base color
 
-        r_color = rgb[0] + np.random.uniform() * colorrange * 2 - colorrange  # generate a color randomly in the neighborhood of the base color
-        g_color = rgb[1] + np.random.uniform() * colorrange * 2 - colorrange
-        b_color = rgb[2] + np.random.uniform() * colorrange * 2 - colorrange
+        jitter = rng.uniform(size=3) * colorrange * 2 - colorrange  # generate a color randomly in the neighborhood of the base color
+        r_color = rgb[0] + jitter[0]
+        g_color = rgb[1] + jitter[1]
+        b_color = rgb[2] + jitter[2]
 
         np_img = np.array(img, dtype=np.uint8)
         np_img = np.dstack([np_img * r_color, np_img * g_color, np_img * b_color])
@@ -42,29 +63,79 @@ class Colorize_specific:
 
         return img
 
+def colorize_batch(imgs, cols, generator = None, colorvals = colorvals, colorrange = colorrange, jitter = None):
+    # batched Colorize_specific on tensors, imgs: [B, 1, H, W] uint8 grayscale, cols: [B] base color indices
+    # jitter: optional [B, 3] uniform draws in [0, 1), e.g. from per-sample generators, drawn here in one call when None
+    rgb = torch.tensor(colorvals, dtype=torch.float64)[cols]  # grab the rgb for each base color, float64 to truncate like numpy
+    if jitter is None:
+        jitter = torch.rand(len(cols), 3, generator=generator, dtype=torch.float64) # one draw for the jitter of the whole batch
+    rgb = rgb + jitter.double() * colorrange * 2 - colorrange
+    return (imgs.double() * rgb.view(-1, 3, 1, 1)).to(torch.uint8)
+
 class No_Color_3dim:
     def __init__(self):
         self.x = None
 
-    def __call__(self, img):
+    def __call__(self, img, rng = None):
         np_img = np.array(img, dtype=np.uint8)
         np_img = np.dstack([np_img, np_img, np_img])
         np_img = np_img.astype(np.uint8)
         img = Image.fromarray(np_img, 'RGB')
         return img
 
+def sample_offsets(loc, width, max_width, rng):
+    # loc: 1 = left half of the retina, 2 = right half; returns the (left, bottom) padding of a width x width crop
+    if loc == 1:
+        padding_left = int(rng.uniform(0, (max_width // 2)-(width//2))) #include center overlap region +
+        padding_bottom = int(rng.integers(0, max_width - width + 1))
+
+    elif loc == 2:
+        if width >= max_width//2:
+          x = width//2
+        else:
+          x = 0
+        padding_left = int(rng.uniform((max_width // 2)-x, max_width - width)) #include center overlap region
+        padding_bottom = int(rng.integers(0, max_width - width + 1))
+
+    return padding_left, padding_bottom
+
+def compose_retina(crops, x, y, retina_size):
+    # batched equivalent of PadAndPosition(Translate(-1, loc, retina_size)) for a batch of equally sized crops
+    # crops: [B, C, h, w], x/y: [B] integer left/bottom paddings as returned by sample_offsets
+    b_dim, c_dim, h, w = crops.size()
+    batch = torch.arange(b_dim, device=crops.device)
+    rows = (retina_size - h - y).view(-1, 1, 1) + torch.arange(h, device=crops.device).view(1, -1, 1)
+    cols = x.view(-1, 1, 1) + torch.arange(w, device=crops.device).view(1, 1, -1)
+
+    retina = crops.new_zeros(b_dim, c_dim, retina_size, retina_size)
+    retina[batch.view(-1, 1, 1), :, rows, cols] = crops.permute(0, 2, 3, 1) # one scatter for the whole batch
+    position = crops.new_zeros(b_dim, 2, retina_size)
+    position[batch, 0, x] = 1
+    position[batch, 1, y] = 1
+    return retina, position
+
+def extract_crops(retina, x, y, size):
+    # inverse of compose_retina, gathers the size x size crops at left/bottom paddings x/y out of retinas [B, C, R, R]
+    b_dim, retina_size = retina.size(0), retina.size(2)
+    batch = torch.arange(b_dim, device=retina.device)
+    rows = (retina_size - size - y).view(-1, 1, 1) + torch.arange(size, device=retina.device).view(1, -1, 1)
+    cols = x.view(-1, 1, 1) + torch.arange(size, device=retina.device).view(1, 1, -1)
+    return retina[batch.view(-1, 1, 1), :, rows, cols].permute(0, 3, 1, 2) # one gather for the whole batch
+
 class Translate:
     def __init__(self, scale, loc, max_width, min_width = 28):
         self.max_width = max_width
         self.min_width = min_width
         self.max_scale = max_width//2
-        self.pos = torch.zeros(2, max_width).cuda()
+        self.pos = torch.zeros(2, max_width) # built on the cpu so loader workers can encode locations
         self.loc = loc
         self.scale = scale
 
-    def __call__(self, img):
+    def __call__(self, img, rng = None):
+        if rng is None:
+            rng = np.random.default_rng()
         if self.scale == 0:
-            scale_val = (random.random()*4)
+            scale_val = (rng.random()*4)
             scale_dist = torch.zeros(10)
             scale_dist[int(scale_val)] = 1
             width = int(self.min_width + (self.max_width - self.min_width) * (scale_val / 10))
@@ -73,7 +144,7 @@ class Translate:
             img = resize(img)
 
         elif self.scale == 1:
-            scale_val = (random.random()*4) +4
+            scale_val = (rng.random()*4) +4
             scale_dist = torch.zeros(10)
             scale_dist[int(scale_val)] = 1
             width = int(self.min_width + (self.max_width - self.min_width) * (scale_val / 10))
@@ -84,21 +155,9 @@ class Translate:
         else:
             scale_dist = None
 
-        if self.loc == 1:
-            padding_left = int(random.uniform(0, (self.max_width // 2)-(img.size[0]//2))) #include center overlap region +
-            padding_right = self.max_width - img.size[0] - padding_left
-            padding_bottom = random.randint(0, self.max_width - img.size[0])
-            padding_top = self.max_width - img.size[0] - padding_bottom
-
-        elif self.loc == 2:
-            if img.size[0] >= self.max_width//2:
-              x = img.size[0]//2
-            else:
-              x = 0
-            padding_left = int(random.uniform((self.max_width // 2)-x, self.max_width - img.size[0])) #include center overlap region
-            padding_right = self.max_width - img.size[0] - padding_left
-            padding_bottom = random.randint(0, self.max_width - img.size[0])
-            padding_top = self.max_width - img.size[0] - padding_bottom
+        padding_left, padding_bottom = sample_offsets(self.loc, img.size[0], self.max_width, rng)
+        padding_right = self.max_width - img.size[0] - padding_left
+        padding_top = self.max_width - img.size[0] - padding_bottom
 
         padding = (padding_left, padding_top, padding_right, padding_bottom)
         pos = self.pos.clone()
@@ -111,8 +170,8 @@ class PadAndPosition:
     def __init__(self, transform):
         self.transform = transform
         self.scale = transform.scale
-    def __call__(self, img):
-        new_img, position, scale_dist = self.transform(img)
+    def __call__(self, img, rng = None):
+        new_img, position, scale_dist = self.transform(img, rng)
         if self.scale != -1:
             return torch_transforms.ToTensor()(new_img), torch_transforms.ToTensor()(img), position, scale_dist #retinal, crop, position, scale
         else:
@@ -121,11 +180,105 @@ class PadAndPosition:
 class ToTensor:
     def __init__(self):
         self.x = None
-    def __call__(self, img):
+    def __call__(self, img, rng = None):
         return torch_transforms.ToTensor()(img)
 
+class RotateAndCrop:
+    # RandomRotation(degrees) followed by RandomCrop(size, padding), drawing the angle and crop from the sample's generator
+    def __init__(self, degrees, size, padding):
+        self.degrees = degrees
+        self.size = size
+        self.padding = padding
+    def __call__(self, img, rng = None):
+        if rng is None:
+            rng = np.random.default_rng()
+        img = torch_transforms.functional.rotate(img, rng.uniform(-self.degrees, self.degrees))
+        img = torch_transforms.functional.pad(img, self.padding)
+        top = int(rng.integers(0, img.size[1] - self.size + 1))
+        left = int(rng.integers(0, img.size[0] - self.size + 1))
+        return torch_transforms.functional.crop(img, top, left, self.size, self.size)
+
+def rotate_and_shift_batch(imgs, angles, shifts):
+    # batched RotateAndCrop on float tensors as a single affine warp, imgs: [B, C, S, S] square images
+    # angles: [B] degrees (counter-clockwise), shifts: [B, 2] integer (x, y) pixel shifts that stand in for the padded random crop
+    b_dim, c_dim, h, w = imgs.size()
+    rad = angles.double() * math.pi / 180
+    cos, sin = torch.cos(rad), torch.sin(rad)
+    shift_x = shifts[:, 0].double() * 2 / w # pixels to normalized grid coordinates
+    shift_y = shifts[:, 1].double() * 2 / h
+    # affine_grid maps output to input coordinates: inverse rotation of the output location minus the shift
+    theta = torch.stack([torch.stack([cos, -sin, -(cos * shift_x - sin * shift_y)], 1),
+                         torch.stack([sin, cos, -(sin * shift_x + cos * shift_y)], 1)], 1)
+    grid = F.affine_grid(theta.to(imgs.dtype).to(imgs.device), imgs.size(), align_corners=False)
+    out = F.grid_sample(imgs, grid, mode='nearest', padding_mode='zeros', align_corners=False) # nearest like functional.rotate
+    # the rotation is clipped to the image frame before the crop shifts it, zero whatever the shift pulls in from outside
+    shifts = shifts.to(imgs.device)
+    cols = torch.arange(w, device=imgs.device).view(1, -1) - shifts[:, 0:1]
+    rows = torch.arange(h, device=imgs.device).view(1, -1) - shifts[:, 1:2]
+    mask = ((rows >= 0) & (rows < h)).view(-1, 1, h, 1) & ((cols >= 0) & (cols < w)).view(-1, 1, 1, w)
+    return out * mask
+
+class SeededCompose:
+    # Compose that hands the sample's generator to every transform
+    def __init__(self, transforms):
+        self.transforms = transforms
+    def __call__(self, img, rng = None):
+        if rng is None:
+            rng = np.random.default_rng()
+        for transform in self.transforms:
+            img = transform(img, rng)
+        return img
+
+class EpochSampler(data.Sampler):
+    # yields (epoch, index) pairs so a Dataset can derive each sample's generator from (seed, epoch, index)
+    # the epoch advances on every pass, so persistent workers and repeated iter() calls still see fresh epochs
+    def __init__(self, dataset, shuffle = True):
+        self.dataset = dataset
+        self.shuffle = shuffle
+        self.epoch = 0
+
+    def __iter__(self):
+        epoch = self.epoch
+        self.epoch += 1
+        if self.shuffle == True:
+            order = np.random.default_rng([self.dataset.seed, epoch]).permutation(len(self.dataset))
+        else:
+            order = range(len(self.dataset))
+        for index in order:
+            yield (epoch, int(index))
+
+    def __len__(self):
+        return len(self.dataset)
+
+class RetinaCollate:
+    # collate_fn for datasets built with 'batched_retina', items are ((uint8 grayscale crop, offsets, color jitter), label)
+    def __init__(self, retina_size, colorize):
+        self.retina_size = retina_size
+        self.colorize = colorize
+    def __call__(self, batch):
+        (crops, offsets, jitter), labels = default_collate(batch)
+        if self.colorize == True:
+            crops = colorize_batch(crops, label_column(labels, 'color'), jitter=jitter)
+        else:
+            crops = crops.expand(-1, 3, -1, -1)
+        crops = crops.float() / 255
+        retinal, position = compose_retina(crops, offsets[:, 0], offsets[:, 1], self.retina_size)
+        return [retinal, crops, position], labels #retinal, crop, position
+
+class SkipCollate:
+    # collate_fn for skip datasets built with 'batched_skip', items are ((uint8 grayscale crop, angle, shift, color jitter), label)
+    def __call__(self, batch):
+        (crops, angles, shifts, jitter), labels = default_collate(batch)
+        crops = colorize_batch(crops, label_column(labels, 'color'), jitter=jitter).float() / 255
+        return rotate_and_shift_batch(crops, angles, shifts), labels
+
 class Dataset(data.Dataset):
-    def __init__(self, dataset, transforms={}, train=True):
+    def __init__(self, dataset, transforms={}, train=True, seed=None):
+        # seed: key of the per-sample generators used by get_loader, a random one is drawn when None (see self.seed)
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.seed = seed
+
         # initialize base dataset
         if type(dataset) == str:
             self.name = dataset
@@ -166,6 +319,12 @@ class Dataset(data.Dataset):
             self.right_targets = []
             self.left_targets = []
 
+        # compose the retina per batch in the loader's collate_fn instead of per item
+        if 'batched_retina' in transforms and self.retina == True:
+            self.batched_retina = transforms['batched_retina']
+        else:
+            self.batched_retina = False
+
         # initialize colors
         if 'colorize' in transforms:
             self.colorize = transforms['colorize']
@@ -204,42 +363,42 @@ class Dataset(data.Dataset):
             if self.skip == True:
                 self.colorize = True
                 self.retina = False
+                self.batched_retina = False
         else:
             self.skip = False
 
+        # rotate and crop skip images per batch in the loader's collate_fn instead of per item
+        if 'batched_skip' in transforms and self.skip == True:
+            self.batched_skip = transforms['batched_skip']
+        else:
+            self.batched_skip = False
+
+        if self.batched_retina == True and self.scale == True:
+            raise ValueError('batched_retina requires equally sized crops, it cannot be combined with scale')
+
         self.no_color_3dim = No_Color_3dim()
         self.totensor = ToTensor()
         self.target_dict = {'mnist':[0,9], 'emnist':[10,35], 'fashion_mnist':[36,45], 'cifar10':[46,55]}
 
         if dataset == 'emnist':
-            self.lowercase = list(range(0,10)) + list(range(36,63))
-            if os.path.exists('uppercase_ind_train.pt'):
-                if self.train == True:
-                    self.indices = torch.load('uppercase_ind_train.pt')
-                else:
-                    self.indices = torch.load('uppercase_ind_test.pt')
-            else:
-                print('indexing emnist dataset:')
-                self.indicies, self.indices = self._filter_indices()
-                print('indexing complete')
+            self.indices = self._filter_indices()
 
-    def _filter_indices(self):
-        base_dataset = datasets.EMNIST(root='./data', split='byclass', train=False, transform=torch_transforms.Compose([lambda img: torch_transforms.functional.rotate(img, -90),
-            lambda img: torch_transforms.functional.hflip(img)]), download=True)
-        indices_test = []
-        count = {target: 0 for target in list(range(10,36))}
-        print('starting indices collection')
-        for i in range(len(base_dataset)):
-            img, target = base_dataset[i]
-            if target not in self.lowercase and count[target] <= 6000:
-                indices_test += [i]
-                count[target] += 1
-        print(count)
-        #torch.save(indices_train, 'uppercase_ind_train.pt')
-        torch.save(indices_test, 'uppercase_ind_test.pt')
-        print('saved indices')
-        indices_train = torch.load('uppercase_ind_train.pt')
-        return indices_train, indices_test
+        self.transform_plan = self._build_transform_plan()
+
+    def _filter_indices(self, split = 'byclass', cap = 6000):
+        # indices of the uppercase letters (byclass targets 10-35) with at most cap samples per class
+        # read from dataset.targets so no image is decoded, cached per split, train/test, cap and dataset size
+        index_path = f'./data/emnist_uppercase_{split}_{"train" if self.train else "test"}_cap{cap}_n{len(self.dataset)}.pt'
+        if os.path.exists(index_path):
+            return torch.load(index_path)
+
+        print('indexing emnist dataset:')
+        targets = torch.as_tensor(self.dataset.targets)
+        indices = [torch.nonzero(targets == target).flatten()[:cap] for target in range(10, 36)]
+        indices = torch.sort(torch.cat(indices))[0].tolist()
+        torch.save(indices, index_path)
+        print('indexing complete')
+        return indices
 
     def _build_dataset(self, dataset, train=True):
         if dataset == 'mnist':
@@ -269,29 +428,27 @@ class Dataset(data.Dataset):
         return len(self.dataset)
 
     def __getitem__(self, index):
+        # index: an int, or an (epoch, index) pair from EpochSampler that makes the sample reproducible
+        if type(index) == tuple:
+            epoch, index = index
+            rng = sample_rng(self.seed, epoch, index)
+        else:
+            rng = np.random.default_rng()
+
         image, target = self.dataset[index]
         if self.name == 'emnist' and self.train == True:
-            image, target = self.dataset[self.indices[random.randint(0,len(self.indices)-1)]]
+            image, target = self.dataset[self.indices[rng.integers(len(self.indices))]]
         else:
             target += self.target_dict[self.name][0]
-        col = None
-        transform_list = []
-        # append transforms according to transform attributes
+        # pick the labels, the transforms for each label combination are prebuilt in self.transform_plan
         # color
         if self.colorize == True:
             if target in self.color_dict:
                 col = self.color_dict[target]
-                transform_list += [Colorize_specific(col)]
             else:
-                col = random.randint(0,9) # any
-                transform_list += [Colorize_specific(col)]
+                col = int(rng.integers(0,10)) # any
         else:
             col = -1
-            transform_list += [self.no_color_3dim]
-
-        # skip connection dataset
-        if self.skip == True:
-            transform_list += [torch_transforms.RandomRotation(90), torch_transforms.RandomCrop(size=28, padding= 8)]
 
         # retina
         if self.retina == True:
@@ -299,7 +456,7 @@ class Dataset(data.Dataset):
                 if target in self.scale_dict:
                     scale = self.scale_dict[target]
                 else:
-                    scale = random.randint(0,1)
+                    scale = int(rng.integers(0,2))
             else:
                 scale = -1
 
@@ -308,22 +465,85 @@ class Dataset(data.Dataset):
             elif target in self.right_targets:
                 translation = 2 # right
             else:
-                translation = random.randint(1,2) #any
-
-            translate = PadAndPosition(Translate(scale, translation, self.retina_size))
-            transform_list += [translate]
+                translation = int(rng.integers(1,3)) #any
         else:
             scale = -1
             translation = -1
-            transform_list += [self.totensor]
 
-        # labels
-        out_label = (target, col, translation, scale)
-        transform = torch_transforms.Compose(transform_list)
-        return transform(image), out_label
+        # labels, collated into a [B, 4] int16 tensor, read fields with label_column
+        out_label = torch.tensor([target, col, translation, scale], dtype=torch.int16)
+
+        if self.batched_retina == True:
+            # the crop is colorized and placed onto the retina by RetinaCollate
+            # drawn in the order of the per item path, the color jitter (Colorize_specific) before the offsets (Translate)
+            crop = torch.from_numpy(np.array(image, dtype=np.uint8)).unsqueeze(0)
+            if self.colorize == True:
+                jitter = torch.from_numpy(rng.uniform(size=3))
+            else:
+                jitter = torch.zeros(3, dtype=torch.float64) # unused, No_Color_3dim draws nothing
+            offsets = torch.tensor(sample_offsets(translation, crop.size(2), self.retina_size, rng))
+            return (crop, offsets, jitter), out_label
+
+        if self.batched_skip == True:
+            # the crop is colorized, rotated and shifted by SkipCollate, same draws as RotateAndCrop(90, 28, padding=8)
+            crop = torch.from_numpy(np.array(image, dtype=np.uint8)).unsqueeze(0)
+            jitter = torch.from_numpy(rng.uniform(size=3))
+            angle = torch.tensor(rng.uniform(-90, 90))
+            top, left = rng.integers(0, 17), rng.integers(0, 17)
+            shift = torch.tensor([8 - left, 8 - top]) # padding minus the crop's offset
+            return (crop, angle, shift, jitter), out_label
+
+        transform = self.transform_plan[(col, scale, translation)]
+        return transform(image, rng), out_label
+
+    def _build_transform_plan(self):
+        # one transform pipeline per (color, scale, translation) label combination, built once per Dataset
+        if self.colorize == True:
+            colorizers = {col: Colorize_specific(col) for col in range(len(colorvals))}
+        else:
+            colorizers = {-1: self.no_color_3dim}
+
+        if self.retina == True:
+            translations = [1, 2] # left, right
+            if self.scale == True:
+                scales = [0, 1]
+            else:
+                scales = [-1]
+        else:
+            translations = [-1]
+            scales = [-1]
+
+        # skip connection dataset
+        if self.skip == True:
+            skip_transforms = [RotateAndCrop(90, size=28, padding= 8)]
+        else:
+            skip_transforms = []
+
+        transform_plan = {}
+        for col in colorizers:
+            for scale in scales:
+                for translation in translations:
+                    transform_list = [colorizers[col]] + skip_transforms
+                    if self.retina == True:
+                        transform_list += [PadAndPosition(Translate(scale, translation, self.retina_size))]
+                    else:
+                        transform_list += [self.totensor]
+                    transform_plan[(col, scale, translation)] = SeededCompose(transform_list)
+
+        return transform_plan
+
+    def collate_fn(self):
+        if self.batched_retina == True:
+            return RetinaCollate(self.retina_size, self.colorize)
+        elif self.batched_skip == True:
+            return SkipCollate()
+        else:
+            return None
 
-    def get_loader(self, batch_size):
-        loader = torch.utils.data.DataLoader(dataset=self, batch_size=batch_size, shuffle=True,  drop_last=True)
+    def get_loader(self, batch_size, num_workers = 0, pin_memory = False, persistent_workers = False):
+        # samples are drawn from (self.seed, epoch, index) streams, so any batch can be regenerated regardless of num_workers
+        loader = torch.utils.data.DataLoader(dataset=self, batch_size=batch_size, sampler=EpochSampler(self), drop_last=True, collate_fn=self.collate_fn(),
+            num_workers=num_workers, pin_memory=pin_memory, persistent_workers=persistent_workers and num_workers > 0, worker_init_fn=seed_worker)
         return loader
 
     def all_possible_labels(self):
@@ -357,4 +577,168 @@ class Dataset(data.Dataset):
             target = [col, translation]
             target_dict[i] = target
 
-        return target_dict
\ No newline at end of file
+        return target_dict
+# endless streams
+class StreamDataset(data.Dataset):
+    # several Datasets behind one index space, indexed by the (dataset id, epoch, index) triples of StreamSampler
+    def __init__(self, datasets):
+        self.datasets = datasets
+
+    def __len__(self):
+        return sum([len(dataset) for dataset in self.datasets])
+
+    def __getitem__(self, index):
+        which, epoch, index = index
+        return self.datasets[which][(epoch, index)]
+
+class StreamSampler(data.Sampler):
+    # endless sampler that picks a dataset by weight for every sample, each dataset is walked one shuffled epoch at a time
+    # the epochs and positions live on the sampler, so the stream carries on where it stopped without repeating samples
+    def __init__(self, datasets, weights = None, seed = None, block = 1024):
+        self.datasets = datasets
+        if weights is None:
+            weights = [1] * len(datasets)
+        if len(weights) != len(datasets):
+            raise ValueError('one weight per dataset is required')
+        self.weights = np.array(weights, dtype=np.float64) / sum(weights)
+        if seed is None:
+            seed = datasets[0].seed
+        self.rng = np.random.default_rng(seed)
+        self.block = block # dataset choices drawn per call
+        self.epochs = [0] * len(datasets)
+        self.positions = [0] * len(datasets)
+
+    def _order(self, which):
+        # same permutation as EpochSampler for this dataset and epoch
+        dataset = self.datasets[which]
+        return np.random.default_rng([dataset.seed, self.epochs[which]]).permutation(len(dataset))
+
+    def __iter__(self):
+        orders = [self._order(which) for which in range(len(self.datasets))]
+        while True:
+            for which in self.rng.choice(len(self.datasets), size=self.block, p=self.weights).tolist():
+                if self.positions[which] == len(orders[which]):
+                    self.epochs[which] += 1
+                    self.positions[which] = 0
+                    orders[which] = self._order(which)
+                index = int(orders[which][self.positions[which]])
+                self.positions[which] += 1
+                yield (which, self.epochs[which], index)
+
+class Stream:
+    # endless batches from one or more Datasets mixed by weight, e.g. Stream([mnist_dataset, emnist_dataset], bs, weights=[2, 1])
+    # the loader iterator (and its workers) is started on the first next() and then kept for the life of the stream,
+    # so streams that are only used by some decoders are pulled on demand and no epoch boundary tears the workers down
+    def __init__(self, datasets, batch_size, weights = None, num_workers = 0, pin_memory = False, seed = None):
+        if len(set([type(dataset.collate_fn()) for dataset in datasets])) != 1:
+            raise ValueError('datasets in a stream must produce the same batch format')
+        self.dataset = StreamDataset(datasets)
+        self.sampler = StreamSampler(datasets, weights, seed)
+        self.loader = data.DataLoader(dataset=self.dataset, batch_size=batch_size, sampler=self.sampler, drop_last=True,
+            collate_fn=datasets[0].collate_fn(), num_workers=num_workers, pin_memory=pin_memory, worker_init_fn=seed_worker)
+        self.batch_size = batch_size
+        self.data_iter = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.data_iter is None:
+            self.data_iter = iter(self.loader)
+        return next(self.data_iter)
+
+# pre-rendered stimuli
+def render_shards(dataset, root, epochs = 1, batch_size = 1000):
+    # renders epochs passes over a Dataset into uint8 .npy shards, one shard per epoch, read back by ShardDataset
+    # columns per shard: crop, labels (shape, color, location, scale) and for retinal datasets retinal, position (x, y) and scale bin
+    if not os.path.exists(root):
+        os.mkdir(root)
+
+    for epoch in range(epochs):
+        sampler = [(epoch, index) for index in range(len(dataset))] # every shard is the given epoch of dataset.seed's streams
+        loader = data.DataLoader(dataset=dataset, batch_size=batch_size, sampler=sampler, collate_fn=dataset.collate_fn())
+        shard = {}
+        start = 0
+        for batch, labels in loader:
+            columns = {'labels': labels}
+            if type(batch) == list:
+                columns['retinal'] = batch[0]
+                columns['crop'] = batch[1]
+                columns['position'] = batch[2].argmax(2) # one-hots back to (x, y)
+                if len(batch) == 4:
+                    columns['scale'] = batch[3].argmax(1)
+            else:
+                columns['crop'] = batch
+
+            for name, column in columns.items():
+                if name in ['retinal', 'crop']:
+                    column = torch.round(column * 255).to(torch.uint8)
+                else:
+                    column = column.to(torch.int16)
+
+                if name not in shard:
+                    shard[name] = np.lib.format.open_memmap(f'{root}/shard_{str(epoch).zfill(3)}_{name}.npy', mode='w+',
+                        dtype=column.numpy().dtype, shape=(len(dataset),) + tuple(column.size()[1:]))
+                shard[name][start:start + len(column)] = column.numpy()
+            start += len(columns['labels'])
+
+        for column in shard.values():
+            column.flush()
+
+class ShardCollate:
+    # converts a batch of raw shard columns into the layout the rendering Dataset's loader produced
+    def __call__(self, batch):
+        columns, labels = default_collate(batch) # labels are stored as the [B, 4] int16 label tensor
+        crop = columns['crop'].float() / 255
+        if 'retinal' not in columns:
+            return crop, labels
+
+        retinal = columns['retinal'].float() / 255
+        position = torch.zeros(len(retinal), 2, retinal.size(3))
+        position.scatter_(2, columns['position'].long().unsqueeze(2), 1)
+        out = [retinal, crop, position]
+        if 'scale' in columns:
+            out += [torch.nn.functional.one_hot(columns['scale'].long(), 10).float()]
+        return out, labels
+
+class ShardDataset(data.Dataset):
+    def __init__(self, root, epochs = None):
+        # root: folder written by render_shards, epochs: only use the first n shards
+        self.root = root
+        self.shards = sorted(set(f[:len('shard_000')] for f in os.listdir(root) if f.startswith('shard_')))
+        if epochs is not None:
+            self.shards = self.shards[:epochs]
+
+        if len(self.shards) == 0:
+            raise ValueError(f'no shards found in {root}')
+
+        lengths = [len(np.load(f'{root}/{shard}_labels.npy', mmap_mode='r')) for shard in self.shards]
+        self.offsets = np.cumsum([0] + lengths)
+        self.columns = None # memory maps are opened lazily so that every loader worker maps the files itself
+
+    def _open(self):
+        self.columns = []
+        for shard in self.shards:
+            names = [f[len(shard) + 1:-len('.npy')] for f in os.listdir(self.root) if f.startswith(shard)]
+            # copy-on-write maps are writable, so torch.from_numpy shares their memory without a copy
+            self.columns += [{name: np.load(f'{self.root}/{shard}_{name}.npy', mmap_mode='c') for name in names}]
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index):
+        if self.columns is None:
+            self._open()
+        shard = np.searchsorted(self.offsets, index, side='right') - 1
+        index = index - self.offsets[shard]
+        # as_tensor(asarray()) as the 1-d columns (scale) give numpy scalars, the other rows stay shared with the maps
+        columns = {name: torch.as_tensor(np.asarray(column[index])) for name, column in self.columns[shard].items() if name != 'labels'}
+        return columns, torch.from_numpy(self.columns[shard]['labels'][index])
+
+    def collate_fn(self):
+        return ShardCollate()
+
+    def get_loader(self, batch_size, num_workers = 0, pin_memory = False, persistent_workers = False):
+        loader = torch.utils.data.DataLoader(dataset=self, batch_size=batch_size, shuffle=True,  drop_last=True, collate_fn=self.collate_fn(),
+            num_workers=num_workers, pin_memory=pin_memory, persistent_workers=persistent_workers and num_workers > 0)
+        return loader
@@ -1,6 +1,5 @@
-from label_network import load_checkpoint_colorlabels, load_checkpoint_shapelabels, s_classes, vae_shape_labels, vae_color_labels,c_classes
+import os
 import torch
-from mVAE import vae, load_checkpoint, image_activations, activations
 from torch.utils.data import DataLoader, ConcatDataset
 from dataset_builder import dataset_builder
 import matplotlib.pyplot as plt
@@ -9,9 +8,17 @@ from torchvision import utils
 import torch.nn.functional as F
 
 v = '' # which model version to use, set to '' for the most recent
-load_checkpoint(f'output_emnist_recurr{v}/checkpoint_300.pth')
-#load_checkpoint_shapelabels(f'output_label_net{v}/checkpoint_shapelabels5.pth')
-load_checkpoint_colorlabels(f'output_label_net{v}/checkpoint_colorlabels10.pth')
+if 'MLR_ONNX' in os.environ: # the graphs written by onnx_backend.export_onnx, on onnxruntime without the training stack
+    from onnx_backend import ONNXBackend
+    vae = ONNXBackend(os.environ['MLR_ONNX'])
+    vae_shape_labels, vae_color_labels, s_classes, c_classes = vae.shape_labels, vae.color_labels, vae.shape_classes, vae.color_classes
+    image_activations, activations, device = vae.image_activations, vae.activations, 'cpu'
+else:
+    from label_network import load_checkpoint_colorlabels, load_checkpoint_shapelabels, s_classes, vae_shape_labels, vae_color_labels,c_classes
+    from mVAE import vae, load_checkpoint, image_activations, activations, device
+    load_checkpoint(f'output_emnist_recurr{v}/checkpoint_300.pth', frozen=True)
+    load_checkpoint_colorlabels(f'output_label_net{v}/checkpoint_labels10')
+#load_checkpoint_shapelabels(f'output_label_net{v}/checkpoint_labels5')
 #clf_shapeS=load(f'classifier_output{v}/ss.joblib')
 
 colornames = ["red", "green", "blue", "purple", "yellow", "cyan", "orange", "brown", "pink", "white"]
@@ -24,11 +31,11 @@ with torch.no_grad():
     for label in range(10):
         data_iter = iter(mnist_loader)
         data = data_iter.next()
-        data = data[0].view(10,3,28,28).cuda()
+        data = data[0].view(10,3,28,28).to(device)
         
         
         # build one hot vectors to be passed to the label networks
-        onehot_label = F.one_hot(torch.tensor([label]).cuda(), num_classes=c_classes).float().cuda() # shape
+        onehot_label = F.one_hot(torch.tensor([label], device=device), num_classes=c_classes).float() # shape
 
         # generate shape latents from the labels n = noise
         z_color_labels = vae_color_labels(onehot_label)
@@ -1,5 +1,7 @@
-from mVAE import vae, VAEshapelabels, VAEcolorlabels, VAElocationlabels, image_activations
+from mVAE import get_vae, VAEshapelabels, VAEcolorlabels, VAElocationlabels, image_activations, device
+from dataset_builder import label_column
 import torch
+import os
 import numpy as np
 import torch.nn as nn
 import torch.nn.functional as F
@@ -19,36 +21,40 @@ c_classes = 10
 
 vae_shape_labels= VAEshapelabels(xlabel_dim=s_classes, hlabel_dim=20,  zlabel_dim=16)
 vae_color_labels= VAEcolorlabels(xlabel_dim=10, hlabel_dim=7,  zlabel_dim=16)
-if torch.cuda.is_available():
-    vae.cuda()
-    vae_shape_labels.cuda()
-    vae_color_labels.cuda()
-    print('CUDA')
+vae_shape_labels.to(device) # vae is already on the device configured in mVAE
+vae_color_labels.to(device)
 
 def image_recon(z_labels):
+    vae = get_vae()
     with torch.no_grad():
         vae.eval()
         output=vae.decoder_noskip(z_labels)
     return output
 
 def load_checkpoint_shapelabels(filepath):
-    checkpoint = torch.load(filepath)
-    vae_shape_labels.load_state_dict(checkpoint['state_dict_shape_labels'])
+    # filepath: a checkpoint file, or a sharded checkpoint folder with shape_labels.pt (mVAE.save_checkpoint_shards)
+    if os.path.isdir(filepath):
+        vae_shape_labels.load_state_dict(torch.load(f'{filepath}/shape_labels.pt', map_location=device, mmap=True))
+    else:
+        checkpoint = torch.load(filepath, map_location=device) # the shipped label nets were saved from cuda
+        vae_shape_labels.load_state_dict(checkpoint['state_dict_shape_labels'])
     for parameter in vae_shape_labels.parameters():
         parameter.requires_grad = False
     vae_shape_labels.eval()
     return vae_shape_labels
 
 def load_checkpoint_colorlabels(filepath):
-    checkpoint = torch.load(filepath)
-    vae_color_labels.load_state_dict(checkpoint['state_dict_color_labels'])
+    # filepath: a checkpoint file, or a sharded checkpoint folder with color_labels.pt
+    if os.path.isdir(filepath):
+        vae_color_labels.load_state_dict(torch.load(f'{filepath}/color_labels.pt', map_location=device, mmap=True))
+    else:
+        checkpoint = torch.load(filepath, map_location=device) # the shipped label nets were saved from cuda
+        vae_color_labels.load_state_dict(checkpoint['state_dict_color_labels'])
     for parameter in vae_color_labels.parameters():
         parameter.requires_grad = False
     vae_color_labels.eval()
     return vae_color_labels
 
-optimizer = optim.Adam(vae.parameters())
-
 optimizer_shapelabels= optim.Adam(vae_shape_labels.parameters())
 optimizer_colorlabels= optim.Adam(vae_color_labels.parameters())
 
@@ -61,6 +67,7 @@ def loss_label(label_act,image_act):
 
 def train_labels(epoch, train_loader):
     global colorlabels, numcolors    
+    vae = get_vae()
 
     numcolors = 0
     train_loss_shapelabel = 0
@@ -78,20 +85,20 @@ def train_labels(epoch, train_loader):
         optimizer_colorlabels.zero_grad()
 
         image, labels = dataiter.next()
-        labels_for_shape=labels[0].clone()
-        labels_for_color=labels[1].clone()
+        labels_for_shape=label_column(labels, 'shape')
+        labels_for_color=label_column(labels, 'color')
               
-        image = image.cuda()
-        labels_shape = labels_for_shape.cuda()
+        image = image.to(device)
+        labels_shape = labels_for_shape.to(device)
         input_oneHot = F.one_hot(labels_shape, num_classes=s_classes) # 36 classes in emnist, 10 classes in f-mnist
         input_oneHot = input_oneHot.float()
-        input_oneHot = input_oneHot.cuda()
+        input_oneHot = input_oneHot.to(device)
 
         labels_color = labels_for_color  # get the color labels
-        labels_color = labels_color.cuda()
+        labels_color = labels_color.to(device)
         color_oneHot = F.one_hot(labels_color, num_classes=10)
         color_oneHot = color_oneHot.float()
-        color_oneHot = color_oneHot.cuda()
+        color_oneHot = color_oneHot.to(device)
         
         n = 1 # sampling noise
         z_shape_label = vae_shape_labels(input_oneHot,n)
@@ -159,26 +166,27 @@ def train_labels(epoch, train_loader):
 
 
 def test_outputs(test_loader, n = 0.5):
+        vae = get_vae()
         vae_shape_labels.eval()
         vae_color_labels.eval()
         vae.eval()
 
         dataiter = iter(test_loader)
         image, labels = dataiter.next()
-        labels_for_shape=labels[0].clone()
-        labels_for_color=labels[1].clone()
+        labels_for_shape=label_column(labels, 'shape')
+        labels_for_color=label_column(labels, 'color')
               
-        image = image.cuda()
-        labels_shape = labels_for_shape.cuda()
+        image = image.to(device)
+        labels_shape = labels_for_shape.to(device)
         input_oneHot = F.one_hot(labels_shape, num_classes=s_classes) # 47 classes in emnist, 10 classes in f-mnist
         input_oneHot = input_oneHot.float()
-        input_oneHot = input_oneHot.cuda()
+        input_oneHot = input_oneHot.to(device)
 
         labels_color = labels_for_color  # get the color labels
-        labels_color = labels_color.cuda()
+        labels_color = labels_color.to(device)
         color_oneHot = F.one_hot(labels_color, num_classes=10)
         color_oneHot = color_oneHot.float()
-        color_oneHot = color_oneHot.cuda()
+        color_oneHot = color_oneHot.to(device)
         
         n=1
         z_shape_label = vae_shape_labels(input_oneHot,n)
@@ -220,26 +228,27 @@ def test_outputs(test_loader, n = 0.5):
             )
 
 def test_opposite_colors(test_loader, n = 0.5):
+        vae = get_vae()
         vae_shape_labels.eval()
         vae_color_labels.eval()
         vae.eval()
 
         dataiter = iter(test_loader)
         image, labels = dataiter.next()
-        labels_for_shape=labels[0].clone()
-        labels_for_color=labels[1].clone()
+        labels_for_shape=label_column(labels, 'shape')
+        labels_for_color=label_column(labels, 'color')
               
-        image = image.cuda()
-        labels_shape = labels_for_shape.cuda()
+        image = image.to(device)
+        labels_shape = labels_for_shape.to(device)
         input_oneHot = F.one_hot(labels_shape, num_classes=s_classes) # 47 classes in emnist, 10 classes in f-mnist
         input_oneHot = input_oneHot.float()
-        input_oneHot = input_oneHot.cuda()
+        input_oneHot = input_oneHot.to(device)
 
         labels_color = labels_for_color  # get the color labels
-        labels_color = labels_color.cuda()
+        labels_color = labels_color.to(device)
         color_oneHot = F.one_hot(labels_color, num_classes=10)
         color_oneHot = color_oneHot.float()
-        color_oneHot = color_oneHot.cuda()
+        color_oneHot = color_oneHot.to(device)
         
         n=1
         z_shape_label = vae_shape_labels(input_oneHot,n)
@@ -1,6 +1,4 @@
-from label_network import load_checkpoint_colorlabels, load_checkpoint_shapelabels, s_classes, vae_shape_labels
 import torch
-from mVAE import vae, load_checkpoint, image_activations, activations
 from torch.utils.data import DataLoader, ConcatDataset
 from dataset_builder import dataset_builder
 import matplotlib.pyplot as plt
@@ -13,8 +11,16 @@ import matplotlib.pyplot as plt
 
 # load VAE, label network, and classifiers:
 v = '' # which model version to use, set to '' for the most recent
-load_checkpoint(f'output_emnist_recurr{v}/checkpoint_300.pth') # load VAE
-load_checkpoint_shapelabels(f'output_label_net{v}/checkpoint_shapelabels5.pth') # load shape label net
+if 'MLR_ONNX' in os.environ: # the graphs written by onnx_backend.export_onnx, on onnxruntime without the training stack
+    from onnx_backend import ONNXBackend
+    vae = ONNXBackend(os.environ['MLR_ONNX'])
+    vae_shape_labels, s_classes = vae.shape_labels, vae.shape_classes
+    image_activations, activations, device = vae.image_activations, vae.activations, 'cpu'
+else:
+    from label_network import load_checkpoint_colorlabels, load_checkpoint_shapelabels, s_classes, vae_shape_labels
+    from mVAE import vae, load_checkpoint, image_activations, activations, device
+    load_checkpoint(f'output_emnist_recurr{v}/checkpoint_300.pth', frozen=True) # load VAE
+    load_checkpoint_shapelabels(f'output_label_net{v}/checkpoint_labels5') # load shape label net
 clf_shapeS = load(f'classifier_output{v}/ss.joblib')
 
 vals = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z']
@@ -33,8 +39,8 @@ def letter_sim(char_1, char_2, l_1, l_2, noise = 1, save_img = False):
     # save_img: type: boolean, whether to save the generated images to the output folder
     with torch.no_grad():
         # build one hot vectors to be passed to the label networks
-        num_labels = F.one_hot(torch.tensor([char_1, char_2]).cuda(), num_classes=s_classes).float().cuda() # shape labels for input chars
-        loc_labels = torch.zeros((2,100)).cuda()
+        num_labels = F.one_hot(torch.tensor([char_1, char_2], device=device), num_classes=s_classes).float() # shape labels for input chars
+        loc_labels = torch.zeros((2,100), device=device)
         loc_labels[0][l_1], loc_labels[1][l_2] = 1, 1 # set locations for char1 and 2
 
         # generate shape latents from the labels, the noise param scales the added normal dist in the sampling call
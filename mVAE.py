@@ -26,39 +26,215 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 import random
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
-from torchvision import datasets, transforms, utils
-from torch.autograd import Variable
-from torchvision.utils import save_image
-from sklearn import svm
-from sklearn.metrics import classification_report, confusion_matrix
-from tqdm import tqdm
-import imageio
 import os
-from torch.utils.data import DataLoader, Subset
+import collections
+import io
+import zipfile
+import time
+from torch.utils.data import DataLoader, Subset, get_worker_info
+from torch.utils.checkpoint import checkpoint
+from torch.nn.utils.fusion import fuse_conv_bn_eval, fuse_linear_bn_eval, fuse_conv_bn_weights, fuse_linear_bn_weights
+from torch.ao.quantization import quantize_dynamic, QuantWrapper, prepare, convert, default_qconfig
 
 from PIL import Image, ImageOps, ImageEnhance, __version__ as PILLOW_VERSION
 from joblib import dump, load
 import copy
+# importing mVAE builds nothing and only pulls in torch: the model, the optimizer, the color label stream and the svm classifiers
+# are made on first use (get_vae, get_optimizer, get_colorlabels, get_classifiers or the module attributes, from mVAE import vae),
+# and torchvision (through dataset_builder), sklearn and tqdm are imported by the functions that use them
+
+# device and dtype of the model, the losses and every tensor the functions below create: cuda when available, otherwise cpu
+# override them before importing mVAE with MLR_DEVICE (cpu, cuda, cuda:1), MLR_DTYPE (float32, float64) and set the cpu intra-op threads with MLR_NUM_THREADS
+device = torch.device(os.environ.get('MLR_DEVICE', 'cuda' if torch.cuda.is_available() else 'cpu'))
+dtype = getattr(torch, os.environ.get('MLR_DTYPE', 'float32'))
+if dtype != torch.get_default_dtype():
+    torch.set_default_dtype(dtype)
+if 'MLR_NUM_THREADS' in os.environ:
+    torch.set_num_threads(int(os.environ['MLR_NUM_THREADS']))
+
+def to_device(x):
+    # moves loader data to the configured device, floating point tensors are also cast to the configured dtype
+    if x.is_floating_point():
+        return x.to(device, dtype)
+    return x.to(device)
+
+# the layers of each checkpoint component: a sharded checkpoint (save_checkpoint_shards) keeps every component in its own file,
+# and load_checkpoint reads only the components a script needs
+checkpoint_components = {
+    'encoder': ['conv1', 'bn1', 'conv2', 'bn2', 'conv3', 'bn3', 'conv4', 'bn4', 'fc2', 'fc_bn2', 'fc8', 'fc31', 'fc32', 'fc33', 'fc34',
+                'fc35', 'fc36', 'fc37', 'fc38'],
+    'decoder': ['fc4s', 'fc4c', 'fc4l', 'fc4sc', 'fc5', 'conv5', 'bn5', 'conv6', 'bn6', 'conv7', 'bn7', 'conv8', 'bn8', 'skipconv'], # crop, shape, color, location, scale
+    'retinal_head': ['fc6', 'fc65', 'fc7', 'fc_place1', 'fc_place2', 'retina_refine']}
+
+def checkpoint_component(key):
+    # the checkpoint component a state dict key belongs to
+    layer = key.split('.')[0]
+    for component, layers in checkpoint_components.items():
+        if layer in layers:
+            return component
+    raise ValueError(f'{key} is not in any checkpoint component')
+
+# save a sharded checkpoint
+def save_checkpoint_shards(folder, model = None, optimizer = None, **entries):
+    # writes model's state dict split by checkpoint_components as folder/<component>.pt, the optimizer state as folder/optimizer.pt
+    # and every other entry (seen labels, label network state dicts, their optimizers) as folder/<name>.pt
+    if model is not None and model.frozen:
+        raise ValueError('thaw the model before saving it, a frozen model has its batchnorms folded')
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    shards = {}
+    if model is not None:
+        for key, value in model.state_dict().items():
+            shards.setdefault(checkpoint_component(key), {})[key] = value
+    if optimizer is not None:
+        shards['optimizer'] = optimizer.state_dict()
+    shards.update(entries)
+    for name, shard in shards.items():
+        torch.save(shard, f'{folder}/{name}.pt')
+
+def read_checkpoint(filepath, components):
+    # the state dict of the given checkpoint_components of a checkpoint file or a sharded checkpoint folder, memory mapped on
+    # the cpu so the tensors of other components are never read
+    for component in components:
+        if component not in checkpoint_components and component != 'optimizer':
+            raise ValueError(f'{component} is not a checkpoint component')
+    if os.path.isdir(filepath):
+        state_dict = {}
+        for component in components:
+            if component != 'optimizer':
+                state_dict.update(torch.load(f'{filepath}/{component}.pt', map_location='cpu', mmap=True))
+        return state_dict
+    if 'optimizer' in components:
+        raise ValueError('only a sharded checkpoint restores the optimizer')
+    # mmap needs the zip format torch.save writes since 1.6, legacy checkpoint files are read whole
+    state_dict = torch.load(filepath, map_location='cpu', mmap=zipfile.is_zipfile(filepath))['state_dict']
+    return {key: value for key, value in state_dict.items() if checkpoint_component(key) in components}
+
+def set_checkpoint_state(state_dict, components, filepath, frozen = False):
+    # puts a read_checkpoint state dict into the model: copied into its weights, or assigned when it was built without weights
+    vae = get_vae()
+    if vae.frozen:
+        vae.thaw()
+    partial = any([parameter.is_meta for parameter in vae.parameters()])
+    keys = vae.load_state_dict(state_dict, strict=False, assign=partial)
+    missing = [key for key in keys.missing_keys if checkpoint_component(key) in components]
+    if len(missing) != 0 or len(keys.unexpected_keys) != 0:
+        raise RuntimeError(f'{filepath} does not match the model, missing {missing}, unexpected {keys.unexpected_keys}')
+    if frozen:
+        vae.freeze_for_inference()
+    return vae
 
 # load a saved vae checkpoint
-def load_checkpoint(filepath, d=0):
-    if torch.cuda.is_available():
-        device = torch.device(f'cuda:{d}')
+def load_checkpoint(filepath, d=0, frozen=False, components=None):
+    # filepath: a checkpoint file ({'state_dict': ...}) or a folder written by save_checkpoint_shards
+    # d: the cuda device to use when the configured device has no index
+    # frozen: freeze the loaded model for inference (VAE_CNN.freeze_for_inference), for the analysis scripts
+    # components: the checkpoint_components to load, all of them by default, plus 'optimizer' to restore the optimizer state of a
+    # sharded checkpoint. The files are memory mapped so the tensors of other components are never read. When the model has not
+    # been built yet it is built without weights and only the loaded components get any, the others cannot run
+    if components is None:
+        components = list(checkpoint_components)
+    if device.type == 'cuda' and device.index is None:
         torch.cuda.set_device(d)
-    else:
-        device = 'cpu'
-    checkpoint = torch.load(filepath,device)
-    vae.load_state_dict(checkpoint['state_dict'])
-    vae.to(device)
+    state_dict = read_checkpoint(filepath, components)
+    state_dict = {key: to_device(value) for key, value in state_dict.items()} # no copy for cpu float32, the tensors stay mapped
+
+    global vae
+    if 'vae' not in globals():
+        with torch.device('meta'):
+            vae = VAE_CNN(x_dim, h_dim1, h_dim2, z_dim, l_dim, sc_dim)
+    set_checkpoint_state(state_dict, components, filepath)
+    if 'optimizer' in components:
+        get_optimizer().load_state_dict(torch.load(f'{filepath}/optimizer.pt', map_location=device))
+    if frozen:
+        vae.freeze_for_inference()
     return vae
 
-global colorlabels
+def checkpoint_mtime(filepath):
+    # modification time of a checkpoint file, or of the newest file of a sharded checkpoint
+    if os.path.isdir(filepath):
+        return max([os.path.getmtime(f'{filepath}/{file}') for file in os.listdir(filepath)])
+    return os.path.getmtime(filepath)
+
+class CheckpointCache:
+    # bounded LRU cache of checkpoints and their classifiers for the model sweeps (plots_novel, tokens_capacity), keyed by the
+    # checkpoint path and modification time so a retrained model is read again. load swaps the cached weights into the model
+    # by copying them into its existing tensors, no new model is built
+    # max_models: checkpoints kept, the sweeps cycle through their models so it should cover all of them
+    # mmap: keep the cached states memory mapped, every swap copies the weights from the page cache (or disk, once evicted)
+    # again; False keeps a copy of each on the device, about 290 MB per model with the fc retinal head. By default in memory
+    # on cuda, where a swap is then a device copy instead of a host upload, and mapped on the cpu: there the mapped pages are
+    # memory already, the swap takes as long from either (about 75 ms) and the copy makes the first read 4x slower
+    def __init__(self, max_models = 10, mmap = None):
+        self.max_models = max_models
+        self.mmap = mmap if mmap is not None else device.type != 'cuda'
+        self.entries = collections.OrderedDict() # (path, mtime) -> {'state_dict': ..., 'classifiers': {(path, mtime): classifier}},
+                                                 # and 'folded_state_dict' once it has been loaded frozen
+        self.hits = 0
+        self.misses = 0
+        self.classifier_hits = 0
+        self.classifier_misses = 0
+
+    def load(self, filepath, classifiers = [], frozen = False):
+        # filepath: a checkpoint file or sharded checkpoint folder, loaded with every component
+        # classifiers: joblib files of classifiers for this model, returned in the same order
+        # returns the model and the list of classifiers
+        filepath = os.path.abspath(filepath)
+        key = (filepath, checkpoint_mtime(filepath))
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        else:
+            self.misses += 1
+            for stale in [entry for entry in self.entries if entry[0] == filepath]:
+                del self.entries[stale]
+            state_dict = read_checkpoint(filepath, list(checkpoint_components))
+            if self.mmap == False:
+                state_dict = {name: to_device(value.clone()) for name, value in state_dict.items()}
+            self.entries[key] = {'state_dict': state_dict, 'classifiers': {}}
+            if len(self.entries) > self.max_models:
+                self.entries.popitem(last=False)
+        entry = self.entries[key]
+
+        vae = get_vae()
+        if any([parameter.is_meta for parameter in vae.parameters()]):
+            vae.to_empty(device=device) # a partly loaded model gets its own weights once, the cached tensors are only copied
+        if frozen and vae.frozen and vae.quantized == None:
+            # the model stays frozen across the sweep: the folded weights are copied into its folded layers, no thaw and freeze
+            if 'folded_state_dict' not in entry:
+                entry['folded_state_dict'] = vae.fold_batchnorms(entry['state_dict'])
+            vae.load_state_dict(entry['folded_state_dict'])
+        else:
+            set_checkpoint_state(entry['state_dict'], list(checkpoint_components), filepath, frozen)
+
+        out = []
+        for path in classifiers:
+            path = os.path.abspath(path)
+            classifier_key = (path, os.path.getmtime(path))
+            if classifier_key in entry['classifiers']:
+                self.classifier_hits += 1
+            else:
+                self.classifier_misses += 1
+                entry['classifiers'] = {cached: clf for cached, clf in entry['classifiers'].items() if cached[0] != path}
+                entry['classifiers'][classifier_key] = load(path)
+            out += [entry['classifiers'][classifier_key]]
+        return vae, out
+
+    def info(self):
+        # nbytes: memory held by the cached states, mapped file pages when mmap, and the folded layers of the folded states
+        nbytes = 0
+        for entry in self.entries.values():
+            nbytes += sum([value.nbytes for value in entry['state_dict'].values()])
+            nbytes += sum([value.nbytes for key, value in entry.get('folded_state_dict', {}).items() if value is not entry['state_dict'].get(key)])
+        return {'hits': self.hits, 'misses': self.misses, 'classifier_hits': self.classifier_hits,
+                'classifier_misses': self.classifier_misses, 'models': len(self.entries), 'max_models': self.max_models,
+                'mmap': self.mmap, 'nbytes': nbytes}
+
+checkpoint_cache = CheckpointCache()
+
 numcolors = 0
 
 colornames = ["red", "blue", "green", "purple", "yellow", "cyan", "orange", "brown", "pink", "white"]
-colorlabels = np.random.randint(0, 10, 1000000)
 colorrange = .1
 colorvals = [
     [1 - colorrange, colorrange * 1, colorrange * 1],
@@ -73,12 +249,21 @@ colorvals = [
     [1-colorrange,1-colorrange,1-colorrange]
 ]
 
+def get_colorlabels():
+    # the base color of every image Colorize_func colors, drawn on first use
+    global colorlabels
+    if 'colorlabels' not in globals():
+        colorlabels = np.random.randint(0, 10, 1000000)
+    return colorlabels
+
 
 #comment this
 def Colorize_func(img):
-    global numcolors,colorlabels
+    global numcolors
+    if get_worker_info() is not None: # every worker would advance its own copy of the counter and repeat colors
+        raise RuntimeError('Colorize_func keeps a global color counter, use it with num_workers=0 or use dataset_builder.Dataset')
 
-    thiscolor = colorlabels[numcolors]  # what base color is this?
+    thiscolor = get_colorlabels()[numcolors]  # what base color is this?
 
     rgb = colorvals[thiscolor];  # grab the rgb for this base color
     numcolors += 1  # increment the index
@@ -93,6 +278,14 @@ def Colorize_func(img):
     img = Image.fromarray(np_img, 'RGB')
     return img
 
+# batched Colorize_func for uint8 tensors [B, 1, H, W], consumes the next B entries of colorlabels
+def Colorize_batch(imgs):
+    from dataset_builder import colorize_batch
+    global numcolors
+    cols = torch.from_numpy(get_colorlabels()[numcolors:numcolors + len(imgs)])
+    numcolors += len(imgs)
+    return colorize_batch(imgs, cols, colorvals=colorvals, colorrange=colorrange)
+
 #comment
 def Colorize_func_specific(col,img):
     # col: an int index for which base color is being used
@@ -131,10 +324,20 @@ sc_dim = 10
 #loss functions are: shape, color, location, retinal, cropped (shape + color combined), skip
 
 class VAE_CNN(nn.Module):
-    def __init__(self, x_dim, h_dim1, h_dim2, z_dim, l_dim, sc_dim):
+    def __init__(self, x_dim, h_dim1, h_dim2, z_dim, l_dim, sc_dim, retinal_decoder = 'fc', retina_size = retina_size, checkpoint_retinal = False, retina_tile = None):
+        # retinal_decoder: 'fc' combines crop and location through the 4000 wide fc recurrence,
+        # 'stn' places the crop with a spatial transformer driven by z_location (about 1k parameters instead of about 70M)
+        # retina_size: width of the square retina, l_dim must be 2 * retina_size; fc7 grows with its square, so large retinas want 'stn'
+        # checkpoint_retinal: recompute the retinal head in backward instead of keeping its activations
+        # retina_tile: rows per tile of the memory bounded retinal loss (retinal_bce) used by train, None scores the whole retina at once
         super(VAE_CNN, self).__init__()
+        if l_dim != 2 * retina_size:
+            raise ValueError(f'l_dim {l_dim} does not match a retina of size {retina_size}, it must be {2 * retina_size}')
         # encoder part
         self.l_dim = l_dim
+        self.retina_size = retina_size
+        self.checkpoint_retinal = checkpoint_retinal
+        self.retina_tile = retina_tile
         self.z_dim = z_dim
         self.conv1 = nn.Conv2d(3, 16, kernel_size=3, stride=1, padding=1, bias=False)
         self.bn1 = nn.BatchNorm2d(16)
@@ -174,10 +377,25 @@ class VAE_CNN(nn.Module):
         self.conv8 = nn.ConvTranspose2d(16, 3, kernel_size=3, stride=1, padding=1, bias=False)
         self.bn8 = nn.BatchNorm2d(3)
 
-        # combine recon and location into retina now using fcs 2dconv and recurrence
-        self.fc6 = nn.Linear((imgsize*imgsize*3)+z_dim, 4000)
-        self.fc65 = nn.Linear(4000,4000)#recurrence layer
-        self.fc7 = nn.Linear(4000, (retina_size**2)*3)
+        self.retinal_decoder = retinal_decoder
+        if retinal_decoder == 'fc':
+            # combine recon and location into retina now using fcs 2dconv and recurrence
+            self.fc6 = nn.Linear((imgsize*imgsize*3)+z_dim, 4000)
+            self.fc65 = nn.Linear(4000,4000)#recurrence layer
+            self.fc7 = nn.Linear(4000, (retina_size**2)*3)
+
+        elif retinal_decoder == 'stn':
+            # crop placement from the location latent, then a 3x3 conv that sharpens the placed crop
+            self.fc_place1 = nn.Linear(z_dim, 64)
+            self.fc_place2 = nn.Linear(64, 2) # left and bottom padding of the crop
+            self.retina_refine = nn.Conv2d(3, 3, kernel_size=3, stride=1, padding=1)
+            with torch.no_grad(): # start close to copying the placed crop
+                self.retina_refine.weight.zero_()
+                self.retina_refine.weight[[0, 1, 2], [0, 1, 2], 1, 1] = 12
+                self.retina_refine.bias.fill_(-6)
+
+        else:
+            raise ValueError(f'{retinal_decoder} is not a valid retinal decoder')
 
         self.relu = nn.ReLU()
         self.skipconv = nn.Conv2d(16,16,kernel_size=1,stride=1,padding =0,bias=False)
@@ -186,17 +404,130 @@ class VAE_CNN(nn.Module):
         self.shape_scale = 1 #1.9
         self.color_scale = 1.2 #2
 
-    def encoder(self, x, l):
-        l = l.view(-1,l_dim)
-        h = self.relu(self.bn1(self.conv1(x)))
-        h = self.relu(self.bn2(self.conv2(h)))
-        h = self.relu(self.bn3(self.conv3(h)))
-        h = self.relu(self.bn4(self.conv4(h)))
-        h = h.view(-1, int(imgsize / 4) * int(imgsize / 4) * 16)
-        h = self.relu(self.fc_bn2(self.fc2(h)))
-        hskip = self.fc8(h) # skip con fc2 to fc5
+        self.frozen = False # set by freeze_for_inference
+        self.thawed = {}
+        self.thawed_training = True # train or eval mode before freeze_for_inference, restored by thaw
+        self.quantized = None # the quantize of freeze_for_inference
+
+    # (layer, batchnorm after it) pairs folded by freeze_for_inference
+    folded_layers = [('conv1', 'bn1'), ('conv2', 'bn2'), ('conv3', 'bn3'), ('conv4', 'bn4'), ('fc2', 'fc_bn2'),
+                     ('conv5', 'bn5'), ('conv6', 'bn6'), ('conv7', 'bn7')]
+    # layers quantized by freeze_for_inference: int8 dynamic linears and, for quantize='static', int8 convs
+    quantized_linears = ['fc2', 'fc5', 'fc6', 'fc65', 'fc7']
+    quantized_convs = ['conv1', 'conv2', 'conv3', 'conv4', 'conv5', 'conv6', 'conv7', 'conv8']
+
+    def freeze_for_inference(self, channels_last = None, quantize = None, calibration_data = None):
+        # in place, for eval only use: folds every batchnorm into the conv or linear layer before it, stops tracking gradients
+        # and skips the keepgrad detaches; outputs match the eval model within float rounding. The original layers are kept,
+        # thaw (and load_checkpoint) puts them back. channels_last: conv weight layout, by default only on cuda where it is faster
+        # quantize: None, 'dynamic' (int8 weights for the fc layers, cpu only) or 'static' (also int8 convs, with activation
+        # ranges calibrated on calibration_data, a batch in the format forward takes, a few hundred samples are enough)
+        if self.frozen:
+            return self
+        if quantize not in [None, 'dynamic', 'static']:
+            raise ValueError(f'{quantize} is not a valid quantization')
+        if quantize != None and self.fc5.weight.device.type != 'cpu':
+            raise ValueError('int8 quantized inference runs on the cpu')
+        if quantize == 'static' and calibration_data is None:
+            raise ValueError('static quantization needs calibration_data')
+        self.thawed_training = self.training
+        self.eval()
+        for layer, bn in self.folded_layers:
+            self.thawed[layer] = getattr(self, layer)
+            self.thawed[bn] = getattr(self, bn)
+            if isinstance(getattr(self, layer), nn.Linear):
+                setattr(self, layer, fuse_linear_bn_eval(getattr(self, layer), getattr(self, bn)))
+            else:
+                setattr(self, layer, fuse_conv_bn_eval(getattr(self, layer), getattr(self, bn), transpose=isinstance(getattr(self, layer), nn.ConvTranspose2d)))
+            setattr(self, bn, nn.Identity())
+        for parameter in self.parameters():
+            parameter.requires_grad = False
+        if channels_last is None:
+            channels_last = self.fc5.weight.device.type == 'cuda'
+        if channels_last and quantize == None:
+            self.to(memory_format=torch.channels_last)
+
+        if quantize == 'static':
+            # every conv runs in int8 between a quantize and a dequantize, the observers record activation ranges on calibration_data
+            for layer in self.quantized_convs:
+                self.thawed.setdefault(layer, getattr(self, layer))
+                setattr(self, layer, QuantWrapper(copy.deepcopy(getattr(self, layer)))) # copies, prepare hooks the modules it observes
+                getattr(self, layer).qconfig = default_qconfig # per tensor weights, the only kind the transposed convs support
+            prepare(self, inplace=True)
+            with torch.no_grad():
+                self.decode(self.encode(calibration_data), ['cropped', 'retinal', 'skip_cropped', 'color', 'shape'])
+            convert(self, inplace=True)
+        if quantize != None:
+            layers = [layer for layer in self.quantized_linears if hasattr(self, layer)]
+            for layer in layers:
+                self.thawed.setdefault(layer, getattr(self, layer))
+                setattr(self, layer, copy.deepcopy(getattr(self, layer))) # quantize_dynamic tags the modules it swaps
+            quantize_dynamic(self, set(layers), dtype=torch.qint8, inplace=True)
+        self.quantized = quantize
+        self.frozen = True
+        return self
+
+    def thaw(self):
+        # undoes freeze_for_inference, the model is back in the train or eval mode it had, with its original layers
+        for layer, module in self.thawed.items():
+            setattr(self, layer, module)
+        self.thawed = {}
+        for parameter in self.parameters():
+            parameter.requires_grad = True
+        self.to(memory_format=torch.contiguous_format)
+        self.quantized = None
+        self.frozen = False
+        return self.train(self.thawed_training)
+
+    def fold_batchnorms(self, state_dict):
+        # a checkpoint state dict as the frozen (not quantized) model holds it, each batchnorm folded into its layer as
+        # freeze_for_inference does, so it can be copied into a frozen model with load_state_dict
+        state_dict = dict(state_dict)
+        modules = self.thawed if self.frozen else dict(self.named_children())
+        for layer, bn in self.folded_layers:
+            if f'{bn}.running_mean' not in state_dict:
+                continue
+            running_mean, running_var, bn_weight, bn_bias = [state_dict.pop(f'{bn}.{name}') for name in ['running_mean', 'running_var', 'weight', 'bias']]
+            del state_dict[f'{bn}.num_batches_tracked']
+            weight, bias, eps = state_dict[f'{layer}.weight'], state_dict.get(f'{layer}.bias'), modules[bn].eps
+            if isinstance(modules[layer], nn.Linear):
+                weight, bias = fuse_linear_bn_weights(weight, bias, running_mean, running_var, eps, bn_weight, bn_bias)
+            else:
+                weight, bias = fuse_conv_bn_weights(weight, bias, running_mean, running_var, eps, bn_weight, bn_bias,
+                                                    transpose=isinstance(modules[layer], nn.ConvTranspose2d))
+            state_dict[f'{layer}.weight'], state_dict[f'{layer}.bias'] = weight.detach(), bias.detach()
+        return state_dict
+
+    def encoder(self, x, l, keepgrad = None, skip = True):
+        # l: the location one-hots, None for crop only inputs: the location latents are then the fc35/fc36 biases, what an all
+        # zero l gives, without the matmuls
+        # keepgrad: None records autograd for every output, a list only for the latents it names (and for the conv trunk when
+        # one of them reads it), the rest runs under no_grad (see encode)
+        # skip: compute hskip (fc8), 0 otherwise
+        grad = lambda names: torch.set_grad_enabled(torch.is_grad_enabled() and (keepgrad is None or any([name in keepgrad for name in names])))
+        with grad(['shape', 'color', 'skip']):
+            h = self.relu(self.bn1(self.conv1(x)))
+            h = self.relu(self.bn2(self.conv2(h)))
+            h = self.relu(self.bn3(self.conv3(h)))
+            h = self.relu(self.bn4(self.conv4(h)))
+            h = h.reshape(-1, int(imgsize / 4) * int(imgsize / 4) * 16)
+            h = self.relu(self.fc_bn2(self.fc2(h)))
+        with grad(['skip']):
+            hskip = self.fc8(h) if skip == True else 0 # skip con fc2 to fc5
+        with grad(['shape']):
+            mu_shape, log_var_shape = self.fc31(h), self.fc32(h)
+        with grad(['color']):
+            mu_color, log_var_color = self.fc33(h), self.fc34(h)
+        with grad(['location']):
+            if l is None and torch.is_grad_enabled() == False:
+                mu_location, log_var_location = self.fc35.bias.repeat(x.size(0), 1), self.fc36.bias.repeat(x.size(0), 1)
+            else:
+                if l is None: # the weights still get their (zero) gradient
+                    l = torch.zeros(x.size(0), self.l_dim, device=x.device, dtype=x.dtype)
+                l = l.view(-1,self.l_dim)
+                mu_location, log_var_location = self.fc35(l), self.fc36(l)
 
-        return self.fc31(h), self.fc32(h), self.fc33(h), self.fc34(h), self.fc35(l), self.fc36(l), 0, 0, hskip # mu, log_var
+        return mu_shape, log_var_shape, mu_color, log_var_color, mu_location, log_var_location, 0, 0, hskip # mu, log_var
 
     def location_encoder(self, l):
         return self.sampling_location(self.fc35(l), self.fc36(l))
@@ -213,99 +544,126 @@ class VAE_CNN(nn.Module):
 
     def decoder_location(self, z_shape, z_color, z_location):
         h = self.fc4l(z_location)
-        return torch.sigmoid(h).view(-1,2,retina_size)
+        return torch.sigmoid(h).view(-1,2,self.retina_size)
 
     def decoder_scale(self, z_shape, z_color, z_scale):
         h = self.fc4sc(z_scale)
         return torch.sigmoid(h).view(-1,10)
 
-    def decoder_retinal(self, z_shape, z_color, z_location, z_scale, hskip = None, whichdecode = None):
-        # digit recon
-        b_dim = z_shape.size(0)
-        if whichdecode == 'shape':
-            h = (F.relu(self.fc4s(z_shape)) * self.shape_scale)
-        elif whichdecode == 'color':
-            h = (F.relu(self.fc4c(z_color)) * self.color_scale)
-        else:
-            h = (F.relu(self.fc4c(z_color)) * self.color_scale) + (F.relu(self.fc4s(z_shape)) * self.shape_scale)
+    def decoder_trunk(self, h):
+        # conv decoder shared by the cropped, shape, color, skip and retinal heads, returns the [B, 3, imgsize, imgsize] logits
         h = F.relu(self.fc5(h)).view(-1, 16, int(imgsize/4), int(imgsize/4))
         h = self.relu(self.bn5(self.conv5(h)))
         h = self.relu(self.bn6(self.conv6(h)))
         h = self.relu(self.bn7(self.conv7(h)))
-        h = self.conv8(h).detach().view(-1, 3, imgsize, imgsize) #detach conv
-        h = torch.sigmoid(h)
-        crop_out = h.clone()
-        # location vector recon
+        return self.conv8(h).view(-1, 3, imgsize, imgsize).contiguous()
+
+    def head_input(self, whichdecode, z_shape, z_color, hskip):
+        # input of the decoder trunk for each head
+        if whichdecode == 'shape':
+            return F.relu(self.fc4s(z_shape)) * self.shape_scale
+        elif whichdecode == 'color':
+            return F.relu(self.fc4c(z_color)) * self.color_scale
+        elif whichdecode == 'skip_cropped':
+            return F.relu(hskip)
+        else:
+            return (F.relu(self.fc4c(z_color)) * self.color_scale) + (F.relu(self.fc4s(z_shape)) * self.shape_scale)
+
+    def retina_from_crop(self, crop_out, z_location):
+        # combine a reconstructed crop and the location latent into the retina
         l = z_location.detach() #cont. repr of location
-        #l = l.view(-1,1,1,self.z_dim)
         l = torch.sigmoid(l)
-        #l = l.expand(-1, 3, imgsize, self.z_dim) # reshape to concat
-        # shape vector
-        #sc = z_scale.detach() #cont. repr of scale
-        #sc = sc.view(-1,1,1,self.z_dim)
-        #sc = torch.sigmoid(sc)
-        #sc = sc.expand(-1, 3, imgsize, self.z_dim) # reshape to concat
-        # combine into retina
-        h = h.view(b_dim,-1)
+        hidden = self.retinal_hidden(crop_out, l)
+        if self.checkpoint_retinal and torch.is_grad_enabled():
+            h = checkpoint(self.retinal_rows, crop_out, hidden, 0, self.retina_size, use_reentrant=False)
+        else:
+            h = self.retinal_rows(crop_out, hidden, 0, self.retina_size)
+        return torch.sigmoid(h)
+
+    def retinal_hidden(self, crop_out, l):
+        # per sample state of the retinal head: the fc recurrence output for 'fc', the crop paddings for 'stn'
+        if self.retinal_decoder == 'stn':
+            # left (x) and bottom paddings of the crop predicted from the location latent
+            return torch.sigmoid(self.fc_place2(F.relu(self.fc_place1(l)))) * (self.retina_size - imgsize)
+
+        h = crop_out.reshape(crop_out.size(0),-1)
         h = torch.cat([h,l], dim = 1)
         h = self.relu(self.fc6(h))
-        #print(h.size())
         h = self.relu(self.fc65(h))
 
         h = self.relu(self.fc65(h))
-        
-        h = self.fc7(h)
-        #print(h.size())
-        #print(h.size())
-        h = h.view(-1, 3, retina_size, retina_size)
+        return h
+
+    def retinal_rows(self, crop_out, hidden, r0, r1):
+        # retina logits of the rows r0:r1, [B, 3, r1 - r0, retina_size]
+        if self.retinal_decoder == 'stn':
+            return self.place_crop_stn(crop_out, hidden, r0, r1)
+
+        if r0 == 0 and r1 == self.retina_size: # whole retina, fc7 may be a quantized layer
+            return self.fc7(hidden).view(-1, 3, self.retina_size, self.retina_size)
+        weight = self.fc7.weight.view(3, self.retina_size, self.retina_size, -1)[:, r0:r1].reshape(-1, self.fc7.in_features)
+        bias = self.fc7.bias.view(3, self.retina_size, self.retina_size)[:, r0:r1].reshape(-1)
+        return F.linear(hidden, weight, bias).view(-1, 3, r1 - r0, self.retina_size)
+
+    def place_crop_stn(self, crop_out, pad, r0, r1):
+        # spatial transformer placement: every retina pixel (i, j) samples the crop at (i - top, j - x), the layout compose_retina
+        # writes for integer paddings; the rows are sampled with a one row halo so the 3x3 refinement sees its neighbours
+        x, top = pad[:, 0], (self.retina_size - imgsize) - pad[:, 1]
+        h0, h1 = max(r0 - 1, 0), min(r1 + 1, self.retina_size)
+        cols = torch.arange(self.retina_size, device=pad.device, dtype=pad.dtype)
+        rows = torch.arange(h0, h1, device=pad.device, dtype=pad.dtype)
+        gx = (2 * (cols.view(1, 1, -1) - x.view(-1, 1, 1)) + 1) / imgsize - 1 # normalized crop coordinates, align_corners=False
+        gy = (2 * (rows.view(1, -1, 1) - top.view(-1, 1, 1)) + 1) / imgsize - 1
+        grid = torch.stack(torch.broadcast_tensors(gx, gy), 3)
+        h = F.grid_sample(crop_out, grid, mode='bilinear', padding_mode='zeros', align_corners=False)
+        h = F.pad(h, (0, 0, 1 - (r0 - h0), 1 - (h1 - r1))) # zero rows past the retina edges, as the conv padding would
+        return F.conv2d(h, self.retina_refine.weight, self.retina_refine.bias, padding=(0, 1))
+
+    def retinal_bce(self, crop_out, z_location, target, tile = None):
+        # summed bce of the retina decoded from crop_out and z_location against target [B, 3, retina_size, retina_size],
+        # computed tile (default retina_tile) rows at a time; each tile is checkpointed, so backward only ever holds one tile
+        l = torch.sigmoid(z_location.detach())
+        hidden = self.retinal_hidden(crop_out, l)
+        tile = tile or self.retina_tile or self.retina_size
+        bce = 0
+        for r0 in range(0, self.retina_size, tile):
+            r1 = min(r0 + tile, self.retina_size)
+            bce = bce + checkpoint(self.retinal_tile_bce, crop_out, hidden, target[:, :, r0:r1], r0, r1, use_reentrant=False)
+        return bce
+
+    def retinal_tile_bce(self, crop_out, hidden, target, r0, r1):
+        recon = torch.sigmoid(self.retinal_rows(crop_out, hidden, r0, r1))
+        return F.binary_cross_entropy(recon, target, reduction='sum')
 
-        return {'recon':torch.sigmoid(h), 'crop':crop_out}
+    def decoder_retinal(self, z_shape, z_color, z_location, z_scale, hskip = None, whichdecode = None):
+        # digit recon
+        with torch.no_grad(): #detach conv, its activations are not kept
+            h = self.head_input(whichdecode, z_shape, z_color, hskip)
+            crop_out = torch.sigmoid(self.decoder_trunk(h))
+        return {'recon':self.retina_from_crop(crop_out, z_location), 'crop':crop_out}
 
     def decoder_color(self, z_shape, z_color, hskip):
-        h = F.relu(self.fc4c(z_color)) * self.color_scale
-        h = F.relu(self.fc5(h)).view(-1, 16, int(imgsize / 4), int(imgsize / 4))
-        h = self.relu(self.bn5(self.conv5(h)))
-        h = self.relu(self.bn6(self.conv6(h)))
-        h = self.relu(self.bn7(self.conv7(h)))
-        h = self.conv8(h).view(-1, 3, imgsize, imgsize)
-        return torch.sigmoid(h)
+        return torch.sigmoid(self.decoder_trunk(self.head_input('color', z_shape, z_color, hskip)))
 
     def decoder_shape(self, z_shape, z_color, hskip):
-        h = F.relu(self.fc4s(z_shape)) * self.shape_scale
-        h = F.relu(self.fc5(h)).view(-1, 16, int(imgsize / 4), int(imgsize / 4))
-        h = self.relu(self.bn5(self.conv5(h)))
-        h = self.relu(self.bn6(self.conv6(h)))
-        h = self.relu(self.bn7(self.conv7(h)))
-        h = self.conv8(h).view(-1, 3, imgsize, imgsize)
-        return torch.sigmoid(h)
+        return torch.sigmoid(self.decoder_trunk(self.head_input('shape', z_shape, z_color, hskip)))
 
     def decoder_cropped(self, z_shape, z_color, z_location, hskip=0):
-        h = (F.relu(self.fc4c(z_color)) * self.color_scale) + (F.relu(self.fc4s(z_shape)) * self.shape_scale)
-        h = F.relu(self.fc5(h)).view(-1, 16, int(imgsize / 4), int(imgsize / 4))
-        h = self.relu(self.bn5(self.conv5(h)))
-        h = self.relu(self.bn6(self.conv6(h)))
-        h = self.relu(self.bn7(self.conv7(h)))
-        h = self.conv8(h).view(-1, 3, imgsize, imgsize)
-        return torch.sigmoid(h)
+        return torch.sigmoid(self.decoder_trunk(self.head_input('cropped', z_shape, z_color, hskip)))
 
     def decoder_skip_cropped(self, z_shape, z_color, z_location, hskip):
-        h = F.relu(hskip)
-        h = F.relu(self.fc5(h)).view(-1, 16, int(imgsize/4), int(imgsize/4))
-        h = self.relu(self.bn5(self.conv5(h)))
-        h = self.relu(self.bn6(self.conv6(h)))
-        h = self.relu(self.bn7(self.conv7(h)))
-        h = self.conv8(h).view(-1, 3, imgsize, imgsize)
-        return torch.sigmoid(h)
+        return torch.sigmoid(self.decoder_trunk(self.head_input('skip_cropped', z_shape, z_color, hskip)))
 
     def decoder_skip_retinal(self, z_shape, z_color, z_location, hskip):
         # digit recon
-        h = F.relu(hskip)
-        h = F.relu(self.fc5(h)).view(-1, 16, int(imgsize/4), int(imgsize/4))
-        h = self.relu(self.bn5(self.conv5(h)))
-        h = self.relu(self.bn6(self.conv6(h)))
-        h = self.relu(self.bn7(self.conv7(h)))
-        h = self.conv8(h).view(-1, 3, imgsize, imgsize).detach()
-        h = torch.sigmoid(h)
+        with torch.no_grad(): # detached, its activations are not kept
+            h = F.relu(hskip)
+            h = F.relu(self.fc5(h)).view(-1, 16, int(imgsize/4), int(imgsize/4))
+            h = self.relu(self.bn5(self.conv5(h)))
+            h = self.relu(self.bn6(self.conv6(h)))
+            h = self.relu(self.bn7(self.conv7(h)))
+            h = self.conv8(h).view(-1, 3, imgsize, imgsize)
+            h = torch.sigmoid(h)
         # location vector recon
         l = z_location.detach() #cont. repr of location
         l = l.view(-1,1,1,8)
@@ -316,7 +674,7 @@ class VAE_CNN(nn.Module):
         b_dim = h.size()[0]*h.size()[2]
         h = h.view(b_dim,-1)
         h = self.relu(self.fc6(h))
-        h = self.fc7(h).view(-1,3,imgsize,retina_size)
+        h = self.fc7(h).view(-1,3,imgsize,self.retina_size)
         return torch.sigmoid(h)
 
     def activations(self, z_shape, z_color, z_location):
@@ -332,7 +690,7 @@ class VAE_CNN(nn.Module):
             h = F.relu(self.bn2(self.conv2(l1)))
             h = self.relu(self.bn3(self.conv3(h)))
             h = self.relu(self.bn4(self.conv4(h)))
-            h = h.view(-1, int(imgsize / 4) * int(imgsize / 4) * 16)
+            h = h.reshape(-1, int(imgsize / 4) * int(imgsize / 4) * 16)
             h = self.relu(self.fc_bn2(self.fc2(h)))
             hskip = self.fc8(h)
             mu_shape = self.fc31(h)
@@ -345,7 +703,7 @@ class VAE_CNN(nn.Module):
         elif layernum == 2:
             h = self.relu(self.bn3(self.conv3(l2)))
             h = self.relu(self.bn4(self.conv4(h)))
-            h = h.view(-1, int(imgsize / 4) * int(imgsize / 4) * 16)
+            h = h.reshape(-1, int(imgsize / 4) * int(imgsize / 4) * 16)
             h = self.relu(self.fc_bn2(self.fc2(h)))
             hskip = self.fc8(h)
             mu_shape = self.fc31(h)
@@ -371,38 +729,85 @@ class VAE_CNN(nn.Module):
 
         return output, mu_color, log_var_color, mu_shape, log_var_shape
 
-    def forward(self, x, whichdecode='noskip', keepgrad=[]):
+    def encode(self, x, keepgrad=[], modes = None):
+        # runs the encoder once, the returned latent bundle holds mu, log_var and z of shape, color and location, and hskip
+        # modes: the decoders the bundle is for, all by default; hskip (fc8) is only computed when one of them reads it
+        # in training (train mode with gradients on) only the encoder parts feeding the latents in keepgrad record autograd, the
+        # others would be detached anyway and run under no_grad, so their activations are not kept for backward; the mu and
+        # log_var of the latents not in keepgrad carry no gradient either, the training losses only use those of keepgrad
+        pruned = keepgrad if self.training and self.frozen == False else None
+        skip = modes is None or 'skip_cropped' in modes or 'skip_retinal' in modes
         if type(x) == list or type(x) == tuple:    #passing in a cropped+ location as input
-            l = x[2].cuda()
-            #sc = x[3].cuda()
-            x = x[1].cuda()
-            mu_shape, log_var_shape, mu_color, log_var_color, mu_location, log_var_location, mu_scale, log_var_scale, hskip = self.encoder(x, l)
+            l = to_device(x[2])
+            #sc = to_device(x[3])
+            x = to_device(x[1])
+            mu_shape, log_var_shape, mu_color, log_var_color, mu_location, log_var_location, mu_scale, log_var_scale, hskip = self.encoder(x, l, pruned, skip)
         else:  #passing in just cropped image
-            x = x.cuda()
-            #sc = torch.zeros(x.size()[0], sc_dim).cuda()
-            l = torch.zeros(x.size()[0], self.l_dim).cuda()
-            mu_shape, log_var_shape, mu_color, log_var_color, mu_location, log_var_location, mu_scale, log_var_scale, hskip = self.encoder(x, l)
+            x = to_device(x)
+            #sc = torch.zeros(x.size()[0], sc_dim, device=device)
+            mu_shape, log_var_shape, mu_color, log_var_color, mu_location, log_var_location, mu_scale, log_var_scale, hskip = self.encoder(x, None, pruned, skip)
 
-        #what maps are used in the training process.. the others are detached to zero out those gradients
-        if ('shape' in keepgrad):
-            z_shape = self.sampling(mu_shape, log_var_shape)
-        else:
-            z_shape = self.sampling(mu_shape, log_var_shape).detach()
+        z_shape = self.sampling(mu_shape, log_var_shape)
+        z_color = self.sampling(mu_color, log_var_color)
+        z_location = self.sampling_location(mu_location, log_var_location)
 
-        if ('color' in keepgrad):
-            z_color = self.sampling(mu_color, log_var_color)
-        else:
-            z_color = self.sampling(mu_color, log_var_color).detach()
-
-        if ('location' in keepgrad):
-            z_location = self.sampling_location(mu_location, log_var_location)
+        #what maps are used in the training process.. the others are detached to zero out those gradients
+        #a frozen model tracks no gradients, so there is nothing to detach
+        if self.frozen == False:
+            if ('shape' not in keepgrad):
+                z_shape = z_shape.detach()
+
+            if ('color' not in keepgrad):
+                z_color = z_color.detach()
+
+            if ('location' not in keepgrad):
+                z_location = z_location.detach()
+
+            if ('skip' not in keepgrad) and skip == True:
+                hskip = hskip.detach()
+
+        return {'mu_shape': mu_shape, 'log_var_shape': log_var_shape, 'z_shape': z_shape,
+                'mu_color': mu_color, 'log_var_color': log_var_color, 'z_color': z_color,
+                'mu_location': mu_location, 'log_var_location': log_var_location, 'z_location': z_location,
+                'mu_scale': mu_scale, 'log_var_scale': log_var_scale, 'hskip': hskip}
+
+    def decode(self, bundle, modes):
+        # runs any set of decoders on one encode() bundle, returns {mode: output} with the outputs forward gives for each mode
+        # the heads ending in the decoder trunk (cropped, shape, color, skip_cropped and the crop of retinal) are stacked along
+        # the batch and decoded in one pass; in training mode they run one by one so each keeps its own batchnorm statistics
+        for mode in modes:
+            if mode not in ['cropped', 'retinal', 'skip_cropped', 'color', 'shape', 'location']:
+                raise ValueError(f'{mode} is not a valid decoder')
+        heads = []
+        for mode in modes:
+            head = 'cropped' if mode == 'retinal' else mode # the retinal crop is the cropped reconstruction
+            if head != 'location' and head not in heads:
+                heads += [head]
+
+        inputs = [self.head_input(head, bundle['z_shape'], bundle['z_color'], bundle['hskip']) for head in heads]
+        if self.training or len(inputs) < 2:
+            logits = [self.decoder_trunk(h) for h in inputs]
         else:
-            z_location = self.sampling_location(mu_location, log_var_location).detach()
+            logits = self.decoder_trunk(torch.cat(inputs, 0)).split([len(h) for h in inputs])
+        logits = dict(zip(heads, logits))
+
+        output = {}
+        for mode in modes:
+            if mode == 'location':
+                output[mode] = self.decoder_location(0, 0, bundle['z_location'])
+            elif mode == 'retinal':
+                crop_out = torch.sigmoid(logits['cropped'].detach())
+                output[mode] = {'recon':self.retina_from_crop(crop_out, bundle['z_location']), 'crop':crop_out}
+            else:
+                output[mode] = torch.sigmoid(logits[mode])
+        return output
 
-        if ('skip' in keepgrad):
-            hskip = hskip
-        else:
-            hskip = hskip.detach()
+    def forward(self, x, whichdecode='noskip', keepgrad=[]):
+        bundle = self.encode(x, keepgrad, [whichdecode])
+        mu_shape, log_var_shape, z_shape = bundle['mu_shape'], bundle['log_var_shape'], bundle['z_shape']
+        mu_color, log_var_color, z_color = bundle['mu_color'], bundle['log_var_color'], bundle['z_color']
+        mu_location, log_var_location, z_location = bundle['mu_location'], bundle['log_var_location'], bundle['z_location']
+        mu_scale, log_var_scale, hskip = bundle['mu_scale'], bundle['log_var_scale'], bundle['hskip']
 
         if(whichdecode == 'cropped'):
             output = self.decoder_cropped(z_shape,z_color, z_location, hskip)
@@ -422,26 +827,148 @@ class VAE_CNN(nn.Module):
             output = self.decoder_scale(0, 0, 0, z_scale=0)
         return output, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location, mu_scale, log_var_scale
 
+class VAEInference(nn.Module):
+    # one decode mode of a VAE_CNN as a tensor in, tensor out module, with no string, list or type dispatch at call time,
+    # for torch.compile (compile_inference) and torch.export. x: the crop batch, l: the location one-hots, zeros when None
+    # returns forward(x, whichdecode)[0], for 'retinal' only the retina; compiled graphs draw their own latent noise, with
+    # torch._inductor.config.fallback_random = True they match eager for the same random state
+    def __init__(self, vae, whichdecode):
+        super(VAEInference, self).__init__()
+        if whichdecode not in ['cropped', 'retinal', 'skip_cropped', 'color', 'shape', 'location']:
+            raise ValueError(f'{whichdecode} is not a valid decoder')
+        self.vae = vae
+        self.whichdecode = whichdecode
+
+    def forward(self, x, l = None):
+        if l is None:
+            l = torch.zeros(x.size(0), self.vae.l_dim, device=x.device, dtype=x.dtype)
+        mu_shape, log_var_shape, mu_color, log_var_color, mu_location, log_var_location, mu_scale, log_var_scale, hskip = self.vae.encoder(x, l)
+        z_shape = self.vae.sampling(mu_shape, log_var_shape) # sampled in the order encode samples them
+        z_color = self.vae.sampling(mu_color, log_var_color)
+        z_location = self.vae.sampling_location(mu_location, log_var_location)
+        if self.whichdecode == 'location':
+            return self.vae.decoder_location(0, 0, z_location)
+
+        head = 'cropped' if self.whichdecode == 'retinal' else self.whichdecode
+        crop_out = torch.sigmoid(self.vae.decoder_trunk(self.vae.head_input(head, z_shape, z_color, hskip)))
+        if self.whichdecode == 'retinal':
+            return self.vae.retina_from_crop(crop_out, z_location)
+        return crop_out
+
+class VAEEncoder(nn.Module):
+    # the encoder of a VAE_CNN with tensor inputs and outputs only, for torch.export and onnx
+    # returns mu, log_var of shape, color and location, and hskip
+    def __init__(self, vae):
+        super(VAEEncoder, self).__init__()
+        self.vae = vae
+
+    def forward(self, x, l):
+        mu_shape, log_var_shape, mu_color, log_var_color, mu_location, log_var_location, mu_scale, log_var_scale, hskip = self.vae.encoder(x, l)
+        return mu_shape, log_var_shape, mu_color, log_var_color, mu_location, log_var_location, hskip
+
+def compile_inference(model, whichdecode):
+    # a compiled inference entry for one decode mode, called as f(x) or f(x, l); one graph per mode (fullgraph) with static
+    # shapes, a new batch size compiles again. Freeze the model first (VAE_CNN.freeze_for_inference) to fold the batchnorms
+    return torch.compile(VAEInference(model, whichdecode), fullgraph=True, dynamic=False)
+
+def export_encoder(model, batch_size):
+    # the encoder as a torch.export ExportedProgram for crops [batch_size, 3, imgsize, imgsize] and locations [batch_size, l_dim]
+    x = torch.zeros(batch_size, 3, imgsize, imgsize, device=device, dtype=dtype)
+    l = torch.zeros(batch_size, model.l_dim, device=device, dtype=dtype)
+    return torch.export.export(VAEEncoder(model).eval(), (x, l))
+
+class VAEMember(nn.Module):
+    # calls function(vae, *inputs), so torch.func.functional_call can run any VAE_CNN method with the weights of one ensemble model
+    def __init__(self, vae):
+        super(VAEMember, self).__init__()
+        self.vae = vae
+
+    def forward(self, function, *inputs):
+        return function(self.vae, *inputs)
+
+class VAEEnsemble:
+    # several trained models (the 10 models of the plots_novel tables) with their weights stacked along a new first dimension,
+    # evaluated together: each method runs every model in one batched pass (torch.func.vmap over functional_call) and returns
+    # the per model outputs stacked, [n_models, B, ...]. For eval only, the batchnorms use their running statistics
+    # checkpoints: checkpoint files or sharded folders, all of the same architecture; components: the checkpoint_components to
+    # load, all by default, only the methods using them can run. The stacked weights take n_models times the memory of one model
+    def __init__(self, checkpoints, components = None, retinal_decoder = 'fc', retina_size = retina_size):
+        if components is None:
+            components = list(checkpoint_components)
+        if len(checkpoints) == 0:
+            raise ValueError('an ensemble needs at least one checkpoint')
+        with torch.device('meta'): # only the layout, the weights are the stacked ones
+            vae = VAE_CNN(x_dim, h_dim1, h_dim2, z_dim, 2 * retina_size, sc_dim, retinal_decoder, retina_size)
+        # the models run frozen, their batchnorms folded into the layers before them: batchnorm has no batched rule under vmap
+        # and runs several times slower than the folded layers
+        self.member = VAEMember(vae.freeze_for_inference())
+        keys = [key for key in vae.state_dict() if checkpoint_component(key) in components]
+        states = []
+        for filepath in checkpoints:
+            state_dict = vae.fold_batchnorms(read_checkpoint(filepath, components))
+            missing = [key for key in keys if key not in state_dict]
+            unexpected = [key for key in state_dict if key not in keys]
+            if len(missing) != 0 or len(unexpected) != 0:
+                raise RuntimeError(f'{filepath} does not match the model, missing {missing}, unexpected {unexpected}')
+            states += [state_dict]
+        self.state = {'vae.' + key: to_device(torch.stack([state_dict[key] for state_dict in states])) for key in keys}
+        self.n_models = len(checkpoints)
+
+    def run(self, function, *inputs, per_model = []):
+        # function(vae, *inputs) for every model; inputs are shared by the models except the positions in per_model, which
+        # hold one input per model along their first dimension. Every model draws its own latent noise
+        in_dims = tuple([0 if i in per_model else None for i in range(len(inputs))])
+        call = lambda state, *inputs: torch.func.functional_call(self.member, state, (function,) + inputs)
+        return torch.func.vmap(call, in_dims=(0,) + in_dims, randomness='different')(self.state, *inputs)
+
+    def encoder(self, x, l = None):
+        # VAEEncoder of every model: mu, log_var of shape, color and location, and hskip
+        if l is None:
+            l = torch.zeros(x.size(0), self.member.vae.l_dim, device=device, dtype=dtype)
+        return self.run(lambda vae, x, l: VAEEncoder(vae)(x, l), to_device(x), to_device(l))
+
+    def encode(self, x):
+        # VAE_CNN.encode of every model, the latent bundle without the unused scale latents
+        return self.run(lambda vae, x: {key: value for key, value in vae.encode(x).items() if key not in ['mu_scale', 'log_var_scale']}, x)
+
+    def decode(self, bundle, modes):
+        # VAE_CNN.decode of every model on its own latents, a bundle from encode
+        return self.run(lambda vae, bundle: vae.decode(bundle, modes), bundle, per_model=[0])
+
+    def __call__(self, x, whichdecode, l = None):
+        # VAEInference of every model, the whichdecode reconstructions of the crops x
+        return self.run(lambda vae, x, l: VAEInference(vae, whichdecode)(x, l), to_device(x), l if l is None else to_device(l))
+
+    def model_stats(self, values, unbiased = True):
+        # mean and standard error across the models of per model values [n_models, ...]: the std of all the values over the
+        # square root of the number of models. unbiased: the torch .std() of Table 1, False for the np.std of the Table 2 and
+        # latents_cross sections
+        values = values.detach().double().cpu()
+        return values.mean().item(), values.std(unbiased=unbiased).item() / self.n_models ** 0.5
+
 # function to build an  actual model instance
 # function to build a model instance
-def vae_builder(vae_type = vae_type_flag, x_dim = x_dim, h_dim1 = h_dim1, h_dim2 = h_dim2, z_dim = z_dim, l_dim = l_dim, sc_dim = sc_dim):
-    vae = VAE_CNN(x_dim, h_dim1, h_dim2, z_dim, l_dim, sc_dim)
-
-    folder_path = f'sample_{vae_type}_{data_set_flag}'
-
-    if not os.path.exists(folder_path):
-        os.mkdir(folder_path)
-
+def vae_builder(vae_type = vae_type_flag, x_dim = x_dim, h_dim1 = h_dim1, h_dim2 = h_dim2, z_dim = z_dim, l_dim = None, sc_dim = sc_dim, retinal_decoder = 'fc', retina_size = retina_size, checkpoint_retinal = False, retina_tile = None):
+    if l_dim is None:
+        l_dim = 2 * retina_size
+    vae = VAE_CNN(x_dim, h_dim1, h_dim2, z_dim, l_dim, sc_dim, retinal_decoder, retina_size, checkpoint_retinal, retina_tile).to(device, dtype)
     return vae, z_dim
 
-########Actually build it
-vae, z_dim = vae_builder()
+########Actually build it, on first use
+def get_vae():
+    global vae
+    if 'vae' not in globals():
+        vae = vae_builder()[0]
+    return vae
 
 #######what optimier to use:
 # learning rate = 0.0001
 #optimizer = torch.optim.SGD(vae.parameters(), lr=0.0001, momentum = 0.9)
-optimizer = optim.Adam(vae.parameters(), lr=0.0001)
-#device = torch.device('cuda:3')
+def get_optimizer():
+    global optimizer
+    if 'optimizer' not in globals():
+        optimizer = optim.Adam(get_vae().parameters(), lr=0.0001)
+    return optimizer
 
 
 ######the loss functions
@@ -451,21 +978,21 @@ def loss_function(recon_x, x, crop_x, mu, log_var, mu_c, log_var_c):
         x = place_crop(crop_x,x[2].clone())
     else:
         x=x[0].clone()
-    x = x.cuda()
-    BCE = F.binary_cross_entropy(recon_x.view(-1, 3, retina_size, retina_size), x.view(-1, 3, retina_size, retina_size), reduction='sum')
+    x = to_device(x)
+    BCE = F.binary_cross_entropy(recon_x.view(-1, 3, recon_x.size(-1), recon_x.size(-1)), x.view(-1, 3, recon_x.size(-1), recon_x.size(-1)), reduction='sum')
     return BCE
 
 #pixelwise loss for just the cropped image
 def loss_function_crop(recon_x, x, mu, log_var, mu_c, log_var_c):
     x = x.clone()
-    x = x.cuda()
+    x = to_device(x)
     BCE = F.binary_cross_entropy(recon_x.view(-1, imgsize * imgsize * 3), x.view(-1, imgsize * imgsize * 3), reduction='sum')
     return BCE
 
 
 # loss for shape in a cropped image
 def loss_function_shape(recon_x, x, mu, log_var):
-    x = x[1].clone().cuda()
+    x = to_device(x[1].clone())
     # make grayscale reconstruction
     gray_x = x.view(-1, 3, imgsize, imgsize).mean(1)
     gray_x = torch.stack([gray_x, gray_x, gray_x], dim=1)
@@ -476,7 +1003,7 @@ def loss_function_shape(recon_x, x, mu, log_var):
 
 #loss for just color in a cropped image
 def loss_function_color(recon_x, x, mu, log_var):
-    x = x[1].clone().cuda()
+    x = to_device(x[1].clone())
     # make color-only (no shape) reconstruction and use that as the loss function
     recon = recon_x.clone().view(-1, 3 * imgsize * imgsize)
     # compute the maximum color for the r,g and b channels for each digit separately
@@ -494,24 +1021,28 @@ def loss_function_color(recon_x, x, mu, log_var):
 
 #loss for just location
 def loss_function_location(recon_x, x, mu, log_var):
-    x = x[2].clone().cuda()
-    BCE = F.binary_cross_entropy(recon_x.view(-1,2,retina_size), x.view(-1,2,retina_size), reduction='sum')
+    x = to_device(x[2].clone())
+    BCE = F.binary_cross_entropy(recon_x.view(-1,2,recon_x.size(-1)), x.view(-1,2,recon_x.size(-1)), reduction='sum')
     KLD = -0.5 * torch.sum(1 + log_var - mu.pow(2) - log_var.exp())
     return BCE + KLD
 
 #loss for just scale
 def loss_function_scale(recon_x, x, mu, log_var):
-    x = x[3].clone().cuda()
+    x = to_device(x[3].clone())
     BCE = F.binary_cross_entropy(recon_x.view(-1,retina_size,retina_size), x.view(-1,retina_size,retina_size), reduction='sum')
     KLD = -0.5 * torch.sum(1 + log_var - mu.pow(2) - log_var.exp())
     return BCE + KLD
 
 # test recreate img with different features
 def progress_out(data, epoch, count, skip = False, filename = None):
+    from torchvision import utils
     sample_size = 25
+    vae = get_vae()
     vae.eval()
     #make a filename if none is provided
     if filename == None:
+        if not os.path.exists(f'sample_{vae_type_flag}_{data_set_flag}'):
+            os.mkdir(f'sample_{vae_type_flag}_{data_set_flag}')
         filename = f'sample_{vae_type_flag}_{data_set_flag}/{str(epoch + 1).zfill(5)}_{str(count).zfill(5)}.png'
         filename1 = f'sample_{vae_type_flag}_{data_set_flag}/{str(epoch + 1).zfill(5)}_crop_{str(count).zfill(5)}.png'
 
@@ -519,13 +1050,14 @@ def progress_out(data, epoch, count, skip = False, filename = None):
         sample = data[:sample_size]
         with torch.no_grad():
             shape_color_dim = imgsize
-            reconds, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location = vae(sample, 'skip_cropped') #digit from skip
-            recond, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location = vae(sample, 'cropped') #digit
-            reconc, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location = vae(sample, 'color') #color
-            recons, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location = vae(sample, 'shape') #shape
+            recon = vae.decode(vae.encode(sample), ['skip_cropped', 'cropped', 'color', 'shape']) # encoded once for every decoder
+            reconds = recon['skip_cropped'] #digit from skip
+            recond = recon['cropped'] #digit
+            reconc = recon['color'] #color
+            recons = recon['shape'] #shape
             utils.save_image(
-            torch.cat([sample.view(sample_size, 3, imgsize, shape_color_dim).cuda(), reconds.view(sample_size, 3, imgsize, shape_color_dim).cuda(), recond.view(sample_size, 3, imgsize, shape_color_dim).cuda(),
-                    reconc.view(sample_size, 3, imgsize, shape_color_dim).cuda(), recons.view(sample_size, 3, imgsize, shape_color_dim).cuda()], 0),
+            torch.cat([sample.view(sample_size, 3, imgsize, shape_color_dim).to(device), reconds.view(sample_size, 3, imgsize, shape_color_dim).to(device), recond.view(sample_size, 3, imgsize, shape_color_dim).to(device),
+                    reconc.view(sample_size, 3, imgsize, shape_color_dim).to(device), recons.view(sample_size, 3, imgsize, shape_color_dim).to(device)], 0),
             filename,
             nrow=sample_size, normalize=False, range=(-1, 1),)
 
@@ -533,35 +1065,37 @@ def progress_out(data, epoch, count, skip = False, filename = None):
         sample = data
         #print('\n',len(sample))
         with torch.no_grad():
-            reconl, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location,mu_scale,log_var_scale = vae(sample, 'location') #location
-            reconb, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location,mu_scale,log_var_scale = vae(sample, 'retinal') #retina
-            recond, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location,mu_scale,log_var_scale = vae(sample, 'cropped') #digit
-            reconc, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location,mu_scale,log_var_scale = vae(sample, 'color') #color
-            recons, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location,mu_scale,log_var_scale = vae(sample, 'shape') #shape
-
-        crop_retina = place_crop(reconb['crop'].cuda(), sample[2].cuda())
-        reconb = reconb['recon'].cuda()
-        loc_background = torch.zeros(sample_size,3,retina_size-2,retina_size).cuda()
+            recon = vae.decode(vae.encode(sample), ['location', 'retinal', 'cropped', 'color', 'shape']) # encoded once for every decoder
+            reconl = recon['location'] #location
+            reconb = recon['retinal'] #retina
+            recond = recon['cropped'] #digit
+            reconc = recon['color'] #color
+            recons = recon['shape'] #shape
+
+        retina_size = vae.retina_size
+        crop_retina = place_crop(reconb['crop'].to(device), sample[2].to(device))
+        reconb = reconb['recon'].to(device)
+        loc_background = torch.zeros(sample_size,3,retina_size-2,retina_size, device=device)
         line1 = torch.ones((1,2)) * 0.5
         line1 = line1.view(1,1,1,2)
         line2 = line1.view(1,1,1,2)
-        #line3 = line1.expand(sample_size, 3, 2, 2).cuda()
-        line1 = line1.expand(sample_size, 3, imgsize, 2).cuda()
-        line2 = line2.expand(sample_size, 3, retina_size, 2).cuda()
+        #line3 = line1.expand(sample_size, 3, 2, 2).to(device)
+        line1 = line1.expand(sample_size, 3, imgsize, 2).to(device)
+        line2 = line2.expand(sample_size, 3, retina_size, 2).to(device)
         
 
         reconl = reconl.view(sample_size,1,2,retina_size)
         reconl = reconl.expand(sample_size,3,2,retina_size)
-        n_reconc = torch.cat((reconc,line1),dim = 3).cuda()
-        n_recons = torch.cat((recons,line1),dim = 3).cuda()
-        n_reconl = torch.cat((reconl,loc_background),dim = 2).cuda()
-        n_reconl = torch.cat((n_reconl,line2),dim = 3).cuda()
-        n_recond = torch.cat((recond,line1),dim = 3).cuda()
-        crop_retina = torch.cat((crop_retina.cuda(),line2.cuda()),dim = 3).cuda()
+        n_reconc = torch.cat((reconc,line1),dim = 3).to(device)
+        n_recons = torch.cat((recons,line1),dim = 3).to(device)
+        n_reconl = torch.cat((reconl,loc_background),dim = 2).to(device)
+        n_reconl = torch.cat((n_reconl,line2),dim = 3).to(device)
+        n_recond = torch.cat((recond,line1),dim = 3).to(device)
+        crop_retina = torch.cat((crop_retina.to(device),line2.to(device)),dim = 3).to(device)
         shape_color_dim = retina_size + 2
         shape_color_dim1 = imgsize + 2
-        sample = torch.cat((sample[0].cuda(),line2),dim = 3).cuda()
-        reconb = torch.cat((reconb,line2.cuda()),dim = 3).cuda()
+        sample = torch.cat((sample[0].to(device),line2),dim = 3).to(device)
+        reconb = torch.cat((reconb,line2.to(device)),dim = 3).to(device)
 
         utils.save_image(
             torch.cat([sample.view(sample_size, 3, retina_size, shape_color_dim)[:25], crop_retina.view(sample_size, 3, retina_size, shape_color_dim)[:25], reconb.view(sample_size, 3, retina_size, shape_color_dim)[:25], n_reconl.view(sample_size, 3, retina_size, shape_color_dim)[:25]], 0),
@@ -575,9 +1109,13 @@ def progress_out(data, epoch, count, skip = False, filename = None):
 
 def test_loss(test_data, whichdecode = []):
     loss_dict = {}
+    vae = get_vae()
+    bundle = vae.encode(test_data) # encoded once for every decoder
+    recon = vae.decode(bundle, whichdecode)
+    mu_shape, log_var_shape, mu_color, log_var_color = bundle['mu_shape'], bundle['log_var_shape'], bundle['mu_color'], bundle['log_var_color']
 
     for decoder in whichdecode:
-        recon_batch, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location, mu_scale, log_var_scale = vae(test_data, decoder)
+        recon_batch = recon[decoder]
         
         if decoder == 'retinal':
             loss = loss_function(recon_batch['recon'], test_data, None, mu_shape, log_var_shape, mu_color, log_var_color)
@@ -590,57 +1128,46 @@ def test_loss(test_data, whichdecode = []):
     return loss_dict
 
 def update_seen_labels(batch_labels, current_labels):
-    new_label_lst = []
-    for i in range(len(batch_labels)):
-        s = batch_labels[0][i].item() # shape label
-        c = batch_labels[1][i].item() # color label
-        r = batch_labels[2][i].item() # retina location label
-        new_label_lst += [(s, c, r)]
-    seen_labels = set(new_label_lst) | set(current_labels) # creates a new set 
+    # batch_labels: [B, 4] label tensor, adds its distinct (shape, color, retina location) triples
+    from dataset_builder import label_fields
+    fields = [label_fields.index(field) for field in ['shape', 'color', 'location']]
+    new_label_lst = torch.unique(batch_labels[:, fields], dim=0).tolist()
+    seen_labels = set(map(tuple, new_label_lst)) | set(current_labels) # creates a new set 
     return seen_labels
 
-def place_crop(crop_data,loc): # retina placement on GPU for training
-    #print(loc.size())
-    b_dim = crop_data.size(0)
-    out_retina = torch.zeros(b_dim,3,retina_size,retina_size).cuda()
-    for i in range(len(out_retina)):
-        j,x = torch.max(loc[i][0],dim=0)
-        z,y = torch.max(loc[i][1],dim=0)
-        #print(x,y)
-        out_retina[i,:,(retina_size-y)-imgsize:retina_size-y,x:x+imgsize] = crop_data[i]
-    #print(out_retina.size())
+def place_crop(crop_data,loc): # retina placement for training, one scatter for the whole batch
+    from dataset_builder import compose_retina
+    x, y = loc.to(crop_data.device).argmax(2).unbind(1) # location one-hots [B, 2, retina_size] to x, y indices
+    out_retina, position = compose_retina(crop_data, x, y, loc.size(2))
     return out_retina
 
+def extract_crop(retina_data,loc): # inverse of place_crop, pulls the imgsize crops out of the retinas at the given locations
+    from dataset_builder import extract_crops
+    x, y = loc.to(retina_data.device).argmax(2).unbind(1)
+    return extract_crops(retina_data, x, y, imgsize)
+
 
-def train(epoch, train_loader_noSkip, emnist_skip, fmnist_skip, test_loader, sample_loader, return_loss = False, seen_labels = {}):
+def train(epoch, train_stream_noSkip, emnist_skip, fmnist_skip, test_stream, sample_stream, return_loss = False, seen_labels = {}):
+    # the data arguments are dataset_builder.Stream objects, endless and kept across epochs, the skip stream is only pulled on skip steps
+    from tqdm import tqdm
+    vae, optimizer = get_vae(), get_optimizer()
     vae.train()
     train_loss = 0
-    dataiter_noSkip = iter(train_loader_noSkip) # the latent space is trained on EMNIST, MNIST, and f-MNIST
     m = 5 # number of seperate training decoders used
     if fmnist_skip != None:
         m=7
-        #dataiter_emnist_skip= iter(emnist_skip) # The skip connection is trained on pairs from EMNIST, MNIST, and f-MNIST composed on top of each other
-        dataiter_fmnist_skip= iter(fmnist_skip)
-    test_iter = iter(test_loader)
-    sample_iter = iter(sample_loader)
     count = 0
     max_iter = 300
-    loader=tqdm(train_loader_noSkip, total = max_iter)
+    loader=tqdm(range(max_iter), total = max_iter)
 
     retinal_loss_train, cropped_loss_train = 0, 0 # loss metrics returned to training.py
     
     if epoch > 201: # increase the number of times retinal/location is trained
         m = 6
 
-    for i,j in enumerate(loader):
+    for i in loader:
         count += 1
-        data_noSkip, batch_labels = next(dataiter_noSkip)
-        if count % m == 4:
-            #r = random.randint(0,1)
-            #if r == 1:
-             #   data_skip = dataiter_emnist_skip.next()
-            #else:
-            data_skip = next(dataiter_fmnist_skip)
+        data_noSkip, batch_labels = next(train_stream_noSkip) # the latent space is trained on EMNIST, MNIST, and f-MNIST
     
         data = data_noSkip
         
@@ -701,13 +1228,19 @@ def train(epoch, train_loader_noSkip, emnist_skip, fmnist_skip, test_loader, sam
         else:
             r = random.randint(0,1)
             if r == 1:
-                data = data_skip[0]
+                data = next(fmnist_skip)[0] # the skip connection is trained on MNIST, pulled only when used
             else:
                 data = data[1]
             whichdecode_use = 'skip_cropped'
             keepgrad = ['skip']
         
-        recon_batch, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location, mu_scale, log_var_scale = vae(data, whichdecode_use, keepgrad)
+        if whichdecode_use == 'retinal' and vae.retina_tile is not None:
+            # memory bounded retinal step, only the crop is decoded here and retinal_bce scores the retina tile by tile
+            bundle = vae.encode(data, keepgrad, ['retinal'])
+            with torch.no_grad(): # the crop is detached
+                recon_batch = {'crop': vae.decode(bundle, ['cropped'])['cropped'], 'z_location': bundle['z_location']}
+        else:
+            recon_batch, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location, mu_scale, log_var_scale = vae(data, whichdecode_use, keepgrad)
             
         if whichdecode_use == 'shape':  # shape
             loss = loss_function_shape(recon_batch, data, mu_shape, log_var_shape)
@@ -722,7 +1255,10 @@ def train(epoch, train_loader_noSkip, emnist_skip, fmnist_skip, test_loader, sam
             loss.backward()
 
         elif whichdecode_use == 'retinal': # retinal
-            loss = loss_function(recon_batch['recon'], data, recon_batch['crop'], mu_shape, log_var_shape, mu_color, log_var_color)
+            if 'recon' in recon_batch:
+                loss = loss_function(recon_batch['recon'], data, recon_batch['crop'], mu_shape, log_var_shape, mu_color, log_var_color)
+            else:
+                loss = vae.retinal_bce(recon_batch['crop'], recon_batch['z_location'], place_crop(recon_batch['crop'], data[2]))
             loss.backward()
             retinal_loss_train = loss.item()
 
@@ -744,20 +1280,17 @@ def train(epoch, train_loader_noSkip, emnist_skip, fmnist_skip, test_loader, sam
         loader.set_description((f'epoch: {epoch}; mse: {loss.item():.5f};'))
         seen_labels = update_seen_labels(batch_labels,seen_labels)
         if count % (0.8*max_iter) == 0:
-            data, labels = next(sample_iter)
+            data, labels = next(sample_stream)
             progress_out(data, epoch, count)
         #elif count % 500 == 0: not for RED GREEN
          #   data = data_noSkip[0][1] + data_skip[0]
           #  progress_out(data, epoch, count, skip= True)
-        
-        if i == max_iter +1:
-            break
 
-    print('====> Epoch: {} Average loss: {:.4f}'.format(epoch, train_loss / len(train_loader_noSkip.dataset)))
+    print('====> Epoch: {} Average loss: {:.4f}'.format(epoch, train_loss / len(train_stream_noSkip.dataset)))
     
     if return_loss is True:
         # get test losses for cropped and retinal
-        test_data = next(test_iter)
+        test_data = next(test_stream)
         test_data = test_data[0]
 
         test_loss_dict = test_loss(test_data, ['retinal', 'cropped'])
@@ -766,6 +1299,8 @@ def train(epoch, train_loader_noSkip, emnist_skip, fmnist_skip, test_loader, sam
 
 #compute avg loss of retinal recon w/ skip, w/o skip, increase fc?
 def test(whichdecode, test_loader_noSkip, test_loader_skip, bs):
+    from torchvision.utils import save_image
+    vae = get_vae()
     vae.eval()
     global numcolors
     test_loss = 0
@@ -785,10 +1320,10 @@ def test(whichdecode, test_loader_noSkip, test_loader_skip, bs):
             test_loss += loss_function(recon, data, mu_shape, log_var_shape, mu_color, log_var_color).item()
 
     print('Example reconstruction')
-    datac = data[0].cuda()
+    datac = to_device(data[0])
     datac=datac.view(bs, 3, imgsize, retina_size)
     save_image(datac[0:8], f'{args.dir}/orig.png')
-    pos = torch.zeros((64,100)).cuda()
+    pos = torch.zeros((64,100), device=device)
     for i in range(len(pos)):
         pos[i][random.randint(0,99)] = 1
     pos_mu = vae.fc35(pos)
@@ -798,73 +1333,155 @@ def test(whichdecode, test_loader_noSkip, test_loader_skip, bs):
     # generate a
     print('Imagining a shape')
     with torch.no_grad():  # shots off the gradient for everything here
-        zc = torch.randn(64, z_dim).cuda() * 0
-        zs = torch.randn(64, z_dim).cuda() * 1
+        zc = torch.randn(64, z_dim, device=device) * 0
+        zs = torch.randn(64, z_dim, device=device) * 1
         zl = vae.sampling(pos_mu, pos_logvar)
-        sample = vae.decoder_retinal(zs, zc, zl, 0).cuda()
+        sample = vae.decoder_retinal(zs, zc, zl, 0).to(device)
         sample=sample.view(64, 3, imgsize, retina_size)
         save_image(sample[0:8], f'{args.dir}/sampleshape.png')
 
 
     print('Imagining a color')
     with torch.no_grad():  # shots off the gradient for everything here
-        zc = torch.randn(64, z_dim).cuda() * 1
-        zs = torch.randn(64, z_dim).cuda() * 0
+        zc = torch.randn(64, z_dim, device=device) * 1
+        zs = torch.randn(64, z_dim, device=device) * 0
         zl = vae.sampling(pos_mu, pos_logvar)
-        sample = vae.decoder_retinal(zs, zc, zl, 0).cuda()
+        sample = vae.decoder_retinal(zs, zc, zl, 0).to(device)
         sample=sample.view(64, 3, imgsize, retina_size)
         save_image(sample[0:8], f'{args.dir}/samplecolor.png')
 
     test_loss /= len(test_loader_noSkip.dataset)
     print('====> Test set loss: {:.4f}'.format(test_loss))
 
+tap_layers = ['conv1', 'conv2', 'conv3', 'conv4', 'fc2', 'hskip', 'mu_shape', 'log_var_shape', 'mu_color', 'log_var_color',
+              'mu_location', 'log_var_location', 'shape', 'color', 'location']
+
+@torch.no_grad()
+def tap_activations(image, layers, l = None, buffers = None):
+    # runs the encoder once and returns {layer: activation} in the order of layers, heads that are not requested are skipped
+    # layers: names from tap_layers, fc2 is the L1 activation and shape, color, location are the sampled latents
+    # buffers: optional dict kept by the caller across calls, the activations are written into its tensors instead of new ones
+    for layer in layers:
+        if layer not in tap_layers:
+            raise ValueError(f'{layer} is not a tapped layer')
+    vae = get_vae()
+    image = to_device(image).view(-1, 3, imgsize, imgsize)
+    fc_layers = ['fc2', 'hskip', 'mu_shape', 'log_var_shape', 'mu_color', 'log_var_color', 'shape', 'color']
+    needs_fc = len(set(layers) & set(fc_layers)) != 0
+    if needs_fc:
+        depth = 4
+    else:
+        depth = max([0] + [int(layer[-1]) for layer in layers if layer.startswith('conv')])
+
+    acts = {}
+    h = image
+    convs = [(vae.conv1, vae.bn1), (vae.conv2, vae.bn2), (vae.conv3, vae.bn3), (vae.conv4, vae.bn4)]
+    for i in range(depth):
+        conv, bn = convs[i]
+        h = vae.relu(bn(conv(h)))
+        acts[f'conv{i + 1}'] = h.contiguous() # a frozen model on cuda runs channels_last
+
+    if needs_fc:
+        h = h.reshape(-1, int(imgsize / 4) * int(imgsize / 4) * 16)
+        h = vae.relu(vae.fc_bn2(vae.fc2(h))) # fc after conv, drives skip connection
+        acts['fc2'] = h
+        if 'hskip' in layers:
+            acts['hskip'] = vae.fc8(h)
+        for latent, fc_mu, fc_log_var in [('shape', vae.fc31, vae.fc32), ('color', vae.fc33, vae.fc34)]:
+            if len(set(layers) & set([f'mu_{latent}', f'log_var_{latent}', latent])) != 0:
+                acts[f'mu_{latent}'] = fc_mu(h)
+                acts[f'log_var_{latent}'] = fc_log_var(h)
+                if latent in layers:
+                    acts[latent] = vae.sampling(acts[f'mu_{latent}'], acts[f'log_var_{latent}'])
+
+    if len(set(layers) & set(['mu_location', 'log_var_location', 'location'])) != 0:
+        if l is None:
+            l = torch.zeros(image.size()[0], vae.l_dim, device=device)
+        l = to_device(l).view(-1, vae.l_dim)
+        acts['mu_location'] = vae.fc35(l)
+        acts['log_var_location'] = vae.fc36(l)
+        if 'location' in layers:
+            acts['location'] = vae.sampling_location(acts['mu_location'], acts['log_var_location'])
+
+    out = {}
+    for layer in layers:
+        if buffers is None:
+            out[layer] = acts[layer]
+        else:
+            if layer not in buffers or buffers[layer].size() != acts[layer].size():
+                buffers[layer] = torch.empty_like(acts[layer])
+            out[layer] = buffers[layer].copy_(acts[layer])
+    return out
+
 def activations(image, l= None):
-    if l is None:
-        l = torch.zeros(image.size()[0], vae.l_dim).cuda()
-
-    h = vae.relu(vae.bn1(vae.conv1(image)))
-    h = vae.relu(vae.bn2(vae.conv2(h)))
-    h = vae.relu(vae.bn3(vae.conv3(h)))
-    h = vae.relu(vae.bn4(vae.conv4(h)))
-    h = h.view(-1, int(imgsize / 4) * int(imgsize / 4) * 16)
-    l1_act = vae.relu(vae.fc_bn2(vae.fc2(h))) # fc after conv, drives skip connection
-    l1_actf = F.relu(vae.bn1(vae.conv1(image))) # input layer
-    l2_act = F.relu(vae.bn2(vae.conv2(l1_actf)))
-
-    mu_shape, log_var_shape, mu_color, log_var_color, mu_location, log_var_location,j,j, hskip = vae.encoder(image, l)
-    shape_act = vae.sampling(mu_shape, log_var_shape)
-    color_act = vae.sampling(mu_color, log_var_color)
-    location_act = vae.sampling_location(mu_location, log_var_location)
-    return l1_act, l2_act, shape_act, color_act, location_act
+    acts = tap_activations(image, ['fc2', 'conv2', 'shape', 'color', 'location'], l)
+    return acts['fc2'], acts['conv2'], acts['shape'], acts['color'], acts['location'] # l1, l2, shape, color, location
 
 def image_activations(image, l = None):
-    if l is None:
-        l = torch.zeros(image.size()[0], vae.l_dim).cuda()
-    mu_shape, log_var_shape, mu_color, log_var_color, mu_location, log_var_location, hskip = vae.encoder(image, l)
-    shape_act = vae.sampling(mu_shape, log_var_shape)
-    color_act = vae.sampling(mu_color, log_var_color)
-    location_act = vae.sampling_location(mu_location, log_var_location)
-    return shape_act, color_act, location_act
-
-
-# defining the classifiers
-clf_ss = svm.SVC(C=10, gamma='scale', kernel='rbf')  # define the classifier for shape
-clf_sc = svm.SVC(C=10, gamma='scale', kernel='rbf')  #classify shape map against color labels
-clf_cc = svm.SVC(C=10, gamma='scale', kernel='rbf')  # define the classifier for color
-clf_cs = svm.SVC(C=10, gamma='scale', kernel='rbf')#classify color map against shape labels
-
+    acts = tap_activations(image, ['shape', 'color', 'location'], l)
+    return acts['shape'], acts['color'], acts['location']
+
+
+# defining the classifiers, on first use
+def get_classifiers():
+    # returns clf_ss, clf_sc, clf_cc, clf_cs
+    global clf_ss, clf_sc, clf_cc, clf_cs
+    if 'clf_ss' not in globals():
+        from sklearn import svm
+        clf_ss = svm.SVC(C=10, gamma='scale', kernel='rbf')  # define the classifier for shape
+        clf_sc = svm.SVC(C=10, gamma='scale', kernel='rbf')  #classify shape map against color labels
+        clf_cc = svm.SVC(C=10, gamma='scale', kernel='rbf')  # define the classifier for color
+        clf_cs = svm.SVC(C=10, gamma='scale', kernel='rbf')#classify color map against shape labels
+    return clf_ss, clf_sc, clf_cc, clf_cs
+
+
+def quantization_report(test_data, labels, clf_ss, clf_cc, quantize = 'dynamic', calibration_data = None):
+    # float vs int8 (VAE_CNN.freeze_for_inference quantize) inference of vae on one batch: per sample bce of the retinal and
+    # cropped reconstructions, accuracy of the shape (clf_ss) and color (clf_cc) classifiers on the latents, and the model size
+    # returns {'float': {...}, quantize: {...}}, vae is left frozen and quantized
+    from sklearn.metrics import accuracy_score
+    from dataset_builder import label_column
+    vae = get_vae()
+    report = {}
+    for quantized in [None, quantize]:
+        if vae.frozen:
+            vae.thaw()
+        vae.freeze_for_inference(quantize=quantized, calibration_data=calibration_data)
+        torch.manual_seed(0) # the same latent samples for both models
+        start = time.perf_counter()
+        with torch.no_grad():
+            bundle = vae.encode(test_data)
+            recon = vae.decode(bundle, ['retinal', 'cropped'])
+        latency = time.perf_counter() - start
+        n = len(labels)
+        size = io.BytesIO()
+        torch.save(vae.state_dict(), size)
+        report['float' if quantized == None else quantized] = {
+            'retinal_bce': loss_function(recon['retinal']['recon'], test_data, None, None, None, None, None).item() / n,
+            'cropped_bce': loss_function_crop(recon['cropped'], test_data[1], None, None, None, None).item() / n,
+            'clf_ss': accuracy_score(label_column(labels, 'shape').numpy(), clf_ss.predict(bundle['z_shape'].cpu().numpy())),
+            'clf_cc': accuracy_score(label_column(labels, 'color').numpy(), clf_cc.predict(bundle['z_color'].cpu().numpy())),
+            'size_mb': size.getbuffer().nbytes / 2**20, 'latency_ms': latency * 1000}
+
+    print(f'int8 {quantize} quantization vs float, {n} samples:')
+    for key in report['float']:
+        print(f'  {key:>12}: {report["float"][key]:10.4f} -> {report[quantize][key]:10.4f} ({report[quantize][key] - report["float"][key]:+.4f})')
+    return report
 
 #training the shape map on shape labels and color labels
 def classifier_shape_train(whichdecode_use, train_dataset):
+    from dataset_builder import label_column
+    vae = get_vae()
+    clf_ss, clf_sc, clf_cc, clf_cs = get_classifiers()
     vae.eval()
     with torch.no_grad():
         data, labels  =next(iter(train_dataset))
-        train_shapelabels=labels[0].clone()
-        train_colorlabels=labels[1].clone()
+        train_shapelabels=label_column(labels, 'shape')
+        train_colorlabels=label_column(labels, 'color')
 
-        data = data.cuda()
+        data = to_device(data)
         recon_batch, mu_color, log_var_color, mu_shape, log_var_shape = vae(data, whichdecode_use)
-        z_shape = vae.sampling(mu_shape, log_var_shape).cuda()
+        z_shape = vae.sampling(mu_shape, log_var_shape).to(device)
         print('training shape bottleneck against color labels sc')
         clf_sc.fit(z_shape.cpu().numpy(), train_colorlabels)
 
@@ -873,15 +1490,18 @@ def classifier_shape_train(whichdecode_use, train_dataset):
 
 #testing the shape classifier (one image at a time)
 def classifier_shape_test(whichdecode_use, clf_ss, clf_sc, test_dataset, verbose=0):
+    from sklearn.metrics import classification_report, confusion_matrix
+    from dataset_builder import label_column
+    vae = get_vae()
     vae.eval()
     with torch.no_grad():
         data, labels  =next(iter(test_dataset))
-        test_shapelabels=labels[0].clone()
-        test_colorlabels=labels[1].clone()
+        test_shapelabels=label_column(labels, 'shape')
+        test_colorlabels=label_column(labels, 'color')
 
-        data = data.cuda()
+        data = to_device(data)
         recon_batch, mu_color, log_var_color, mu_shape, log_var_shape = vae(data, whichdecode_use)
-        z_shape = vae.sampling(mu_shape, log_var_shape).cuda()
+        z_shape = vae.sampling(mu_shape, log_var_shape).to(device)
         pred_ss = torch.tensor(clf_ss.predict(z_shape.cpu()))
         pred_sc = torch.tensor(clf_sc.predict(z_shape.cpu()))
 
@@ -900,14 +1520,17 @@ def classifier_shape_test(whichdecode_use, clf_ss, clf_sc, test_dataset, verbose
 
 #training the color map on shape and color labels
 def classifier_color_train(whichdecode_use, train_dataset):
+    from dataset_builder import label_column
+    vae = get_vae()
+    clf_ss, clf_sc, clf_cc, clf_cs = get_classifiers()
     vae.eval()
     with torch.no_grad():
         data, labels  =next(iter(train_dataset))
-        train_shapelabels=labels[0].clone()
-        train_colorlabels=labels[1].clone()
-        data = data.cuda()
+        train_shapelabels=label_column(labels, 'shape')
+        train_colorlabels=label_column(labels, 'color')
+        data = to_device(data)
         recon_batch, mu_color, log_var_color, mu_shape, log_var_shape = vae(data, whichdecode_use)
-        z_color = vae.sampling(mu_color, log_var_color).cuda()
+        z_color = vae.sampling(mu_color, log_var_color).to(device)
         print('training color bottleneck against color labels cc')
         clf_cc.fit(z_color.cpu().numpy(), train_colorlabels)
 
@@ -916,15 +1539,18 @@ def classifier_color_train(whichdecode_use, train_dataset):
 
 #testing the color classifier (one image at a time)
 def classifier_color_test(whichdecode_use, clf_cc, clf_cs, test_dataset, verbose=0):
+    from sklearn.metrics import classification_report, confusion_matrix
+    from dataset_builder import label_column
+    vae = get_vae()
     vae.eval()
     with torch.no_grad():
         data, labels  =next(iter(test_dataset))
-        train_shapelabels=labels[0].clone()
-        train_colorlabels=labels[1].clone()
-        data = data.cuda()
+        train_shapelabels=label_column(labels, 'shape')
+        train_colorlabels=label_column(labels, 'color')
+        data = to_device(data)
         recon_batch, mu_color, log_var_color, mu_shape, log_var_shape = vae(data, whichdecode_use)
 
-        z_color = vae.sampling(mu_color, log_var_color).cuda()
+        z_color = vae.sampling(mu_color, log_var_color).to(device)
         pred_cc = torch.tensor(clf_cc.predict(z_color.cpu()))
         pred_cs = torch.tensor(clf_cs.predict(z_color.cpu()))
 
@@ -947,6 +1573,7 @@ def classifier_color_test(whichdecode_use, clf_cc, clf_cs, test_dataset, verbose
 #testing on shape for multiple images stored in memory
 
 def classifier_shapemap_test_imgs(shape, shapelabels, colorlabels,numImg, clf_shapeS, clf_shapeC, test_dataset, verbose = 0):
+    from sklearn.metrics import classification_report, confusion_matrix
 
     global numcolors
 
@@ -955,7 +1582,7 @@ def classifier_shapemap_test_imgs(shape, shapelabels, colorlabels,numImg, clf_sh
     with torch.no_grad():
         predicted_labels=torch.zeros(1,numImg)
         shape = torch.squeeze(shape, dim=1)
-        shape = shape.cuda()
+        shape = shape.to(device)
         test_colorlabels = thecolorlabels(test_dataset)
         pred_ssimg = torch.tensor(clf_shapeS.predict(shape.cpu()))
 
@@ -976,6 +1603,7 @@ def classifier_shapemap_test_imgs(shape, shapelabels, colorlabels,numImg, clf_sh
 
 #testing on color for multiple images stored in memory
 def classifier_colormap_test_imgs(color, shapelabels, colorlabels,numImg, clf_colorC, clf_colorS, test_dataset, verbose = 0):
+    from sklearn.metrics import classification_report, confusion_matrix
 
 
     numImg = int(numImg)
@@ -984,7 +1612,7 @@ def classifier_colormap_test_imgs(color, shapelabels, colorlabels,numImg, clf_co
     with torch.no_grad():
 
         color = torch.squeeze(color, dim=1)
-        color = color.cuda()
+        color = color.to(device)
         test_colorlabels = thecolorlabels(test_dataset)
 
 
@@ -1072,3 +1700,17 @@ class VAElocationlabels(nn.Module):
         log_var_shape_label=self.fc22label(h)
         z_shape_label = self.sampling_labels(mu_shape_label, log_var_shape_label)
         return  z_shape_label
+
+# the lazily made module attributes: mVAE.vae, from mVAE import vae, ... make them on first access
+lazy_attributes = {'vae': get_vae, 'optimizer': get_optimizer, 'colorlabels': get_colorlabels,
+                   'clf_ss': lambda: get_classifiers()[0], 'clf_sc': lambda: get_classifiers()[1],
+                   'clf_cc': lambda: get_classifiers()[2], 'clf_cs': lambda: get_classifiers()[3]}
+
+def __getattr__(name):
+    if name in lazy_attributes:
+        return lazy_attributes[name]()
+    raise AttributeError(f"module 'mVAE' has no attribute '{name}'")
+
+# from mVAE import * exports everything but the lazy attributes, so it builds nothing either; star importing scripts call
+# get_vae, get_optimizer, get_colorlabels or get_classifiers for them
+__all__ = [name for name in list(globals()) if not name.startswith('_')]
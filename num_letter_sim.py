@@ -1,6 +1,5 @@
-from label_network import load_checkpoint_colorlabels, load_checkpoint_shapelabels, s_classes, vae_shape_labels
+import os
 import torch
-from mVAE import vae, load_checkpoint, image_activations, activations
 from torch.utils.data import DataLoader, ConcatDataset
 from dataset_builder import dataset_builder
 import matplotlib.pyplot as plt
@@ -9,9 +8,17 @@ from torchvision import utils
 import torch.nn.functional as F
 
 v = '' # which model version to use, set to '' for the most recent
-load_checkpoint(f'output_emnist_recurr{v}/checkpoint_300.pth')
-load_checkpoint_shapelabels(f'output_label_net{v}/checkpoint_shapelabels5.pth')
-#load_checkpoint_colorlabels(f'output_label_net{v}/checkpoint_colorlabels10.pth')
+if 'MLR_ONNX' in os.environ: # the graphs written by onnx_backend.export_onnx, on onnxruntime without the training stack
+    from onnx_backend import ONNXBackend
+    vae = ONNXBackend(os.environ['MLR_ONNX'])
+    vae_shape_labels, s_classes = vae.shape_labels, vae.shape_classes
+    image_activations, activations, device = vae.image_activations, vae.activations, 'cpu'
+else:
+    from label_network import load_checkpoint_colorlabels, load_checkpoint_shapelabels, s_classes, vae_shape_labels
+    from mVAE import vae, load_checkpoint, image_activations, activations, device
+    load_checkpoint(f'output_emnist_recurr{v}/checkpoint_300.pth', frozen=True)
+    load_checkpoint_shapelabels(f'output_label_net{v}/checkpoint_labels5')
+#load_checkpoint_colorlabels(f'output_label_net{v}/checkpoint_labels10')
 clf_shapeS=load(f'classifier_output{v}/ss.joblib')
 
 vals = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z']
@@ -26,10 +33,10 @@ with torch.no_grad():
     #colors = torch.randint(low=0, high=10, size=(2,))
 
     # build one hot vectors to be passed to the label networks
-    num_labels = F.one_hot(torch.tensor([num1, num2]).cuda(), num_classes=s_classes).float().cuda() # shape
-    loc_labels = torch.zeros((2,100)).cuda()
+    num_labels = F.one_hot(torch.tensor([num1, num2], device=device), num_classes=s_classes).float() # shape
+    loc_labels = torch.zeros((2,100), device=device)
     loc_labels[0][x1], loc_labels[1][x2] = 1, 1 # location
-    #col_labels = F.one_hot(torch.tensor([num1, num2]).cuda(), num_classes=10).float().cuda()
+    #col_labels = F.one_hot(torch.tensor([num1, num2], device=device), num_classes=10).float()
 
     # generate shape latents from the labels n = noise
     z_shape_labels = vae_shape_labels(num_labels, n = 10)
@@ -0,0 +1,186 @@
+# ONNX export of the inference parts of a trained MLR model, and an onnxruntime backend that runs them on the cpu
+# behind the VAE_CNN / label network methods the simulation scripts call, without importing mVAE (the training stack)
+# export, from a training environment:
+#   from mVAE import vae, load_checkpoint; from label_network import vae_shape_labels, vae_color_labels
+#   export_onnx('onnx_model', vae, vae_shape_labels, vae_color_labels)
+# run: vae = ONNXBackend('onnx_model'); the simulation scripts switch to it when MLR_ONNX names the folder
+import os
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+def encoder_outputs(vae, x, l):
+    outputs = vae.encoder(x, l)
+    return outputs[:6] + outputs[8:] # without the unused scale latent
+
+# the exported graphs: name -> (function of the model and the inputs, input names, output names)
+# latent sampling stays outside the graphs, the backend samples like VAE_CNN and the label networks do
+vae_graphs = {
+    'encoder': (encoder_outputs, ['x', 'l'],
+                ['mu_shape', 'log_var_shape', 'mu_color', 'log_var_color', 'mu_location', 'log_var_location', 'hskip']),
+    'location_encoder': (lambda vae, l: (vae.fc35(l), vae.fc36(l)), ['l'], ['mu_location', 'log_var_location']),
+    'decoder_cropped': (lambda vae, z_shape, z_color: vae.decoder_cropped(z_shape, z_color, 0, 0), ['z_shape', 'z_color'], ['crop']),
+    'decoder_shape': (lambda vae, z_shape: vae.decoder_shape(z_shape, 0, 0), ['z_shape'], ['crop']),
+    'decoder_color': (lambda vae, z_color: vae.decoder_color(0, z_color, 0), ['z_color'], ['crop']),
+    'decoder_location': (lambda vae, z_location: vae.decoder_location(0, 0, z_location), ['z_location'], ['location']),
+    'retinal_head': (lambda vae, crop_out, z_location: vae.retina_from_crop(crop_out, z_location), ['crop', 'z_location'], ['retina']),
+}
+label_graph = (lambda net, x_labels: (net.fc21label(F.relu(net.fc1label(x_labels))), net.fc22label(F.relu(net.fc1label(x_labels)))),
+               ['x_labels'], ['mu', 'log_var'])
+
+class Graph(nn.Module):
+    # one exported graph: forward(*inputs) = function(model, *inputs)
+    def __init__(self, model, function):
+        super(Graph, self).__init__()
+        self.model = model
+        self.function = function
+
+    def forward(self, *inputs):
+        return self.function(self.model, *inputs)
+
+def export_graph(path, model, graph, example_inputs):
+    function, input_names, output_names = graph
+    batch = torch.export.Dim('batch', min=1)
+    torch.onnx.export(Graph(model, function).eval(), tuple(example_inputs), path, dynamo=True, input_names=input_names,
+                      output_names=output_names, dynamic_shapes=(tuple([{0: batch} for x in example_inputs]),)) # forward takes *inputs
+
+def export_onnx(folder, vae, shape_labels = None, color_labels = None):
+    # writes every graph of vae_graphs, and the label networks when given, as folder/<name>.onnx with a dynamic batch size
+    # vae: a float VAE_CNN (frozen or not, quantized models do not export), it is left in eval mode
+    from mVAE import imgsize
+    if not os.path.exists(folder):
+        os.mkdir(folder)
+    vae.eval()
+    parameter = next(vae.parameters())
+    example = lambda *size: torch.rand(2, *size, device=parameter.device, dtype=parameter.dtype)
+    z_dim, crop = vae.z_dim, (3, imgsize, imgsize)
+    examples = {'encoder': [example(*crop), example(vae.l_dim)], 'location_encoder': [example(vae.l_dim)],
+                'decoder_cropped': [example(z_dim), example(z_dim)], 'decoder_shape': [example(z_dim)],
+                'decoder_color': [example(z_dim)], 'decoder_location': [example(z_dim)],
+                'retinal_head': [example(*crop), example(z_dim)]}
+    with torch.no_grad():
+        for name, graph in vae_graphs.items():
+            export_graph(f'{folder}/{name}.onnx', vae, graph, examples[name])
+        for name, net in [('shape_labels', shape_labels), ('color_labels', color_labels)]:
+            if net is not None:
+                export_graph(f'{folder}/{name}.onnx', net.eval(), label_graph, [example(net.fc1label.in_features)])
+
+class ONNXBackend:
+    # the graphs written by export_onnx on onnxruntime (cpu), with the VAE_CNN methods the simulation scripts use
+    # takes and returns cpu torch tensors; activations gives None for the layer 1 and 2 activations, which are not exported
+    def __init__(self, folder, providers = ['CPUExecutionProvider']):
+        import onnxruntime
+        self.sessions = {}
+        for file in sorted(os.listdir(folder)):
+            if file.endswith('.onnx'):
+                self.sessions[file[:-len('.onnx')]] = onnxruntime.InferenceSession(f'{folder}/{file}', providers=providers)
+        for name in vae_graphs:
+            if name not in self.sessions:
+                raise ValueError(f'{folder} has no {name}.onnx, write it with export_onnx')
+        self.l_dim = self.sessions['location_encoder'].get_inputs()[0].shape[1]
+        self.imgsize = self.sessions['encoder'].get_inputs()[0].shape[2]
+        self.shape_classes = self.label_classes('shape_labels')
+        self.color_classes = self.label_classes('color_labels')
+
+    def label_classes(self, name):
+        if name in self.sessions:
+            return self.sessions[name].get_inputs()[0].shape[1]
+        return None
+
+    def run(self, name, *inputs):
+        session = self.sessions[name]
+        feeds = {}
+        for node, x in zip(session.get_inputs(), inputs):
+            feeds[node.name] = np.ascontiguousarray(torch.as_tensor(x).detach().cpu().numpy(), dtype=np.float32)
+        return [torch.from_numpy(output) for output in session.run(None, feeds)]
+
+    def eval(self):
+        return self
+
+    # VAE_CNN
+    def sampling(self, mu, log_var):
+        std = torch.exp(0.5 * log_var)
+        eps = torch.randn_like(std)
+        return mu + eps * std
+
+    def sampling_location(self, mu, log_var):
+        std = (0.5 * log_var)
+        eps = torch.randn_like(std)
+        return mu + eps * std
+
+    def encoder(self, x, l):
+        mu_shape, log_var_shape, mu_color, log_var_color, mu_location, log_var_location, hskip = self.run('encoder', x, l.reshape(-1, self.l_dim))
+        return mu_shape, log_var_shape, mu_color, log_var_color, mu_location, log_var_location, 0, 0, hskip
+
+    def location_encoder(self, l):
+        return self.sampling_location(*self.run('location_encoder', l))
+
+    def decoder_cropped(self, z_shape, z_color, z_location, hskip=0):
+        return self.run('decoder_cropped', z_shape, z_color)[0]
+
+    def decoder_shape(self, z_shape, z_color, hskip):
+        return self.run('decoder_shape', z_shape)[0]
+
+    def decoder_color(self, z_shape, z_color, hskip):
+        return self.run('decoder_color', z_color)[0]
+
+    def decoder_location(self, z_shape, z_color, z_location):
+        return self.run('decoder_location', z_location)[0]
+
+    def decoder_retinal(self, z_shape, z_color, z_location, z_scale, hskip = None, whichdecode = None):
+        if whichdecode == 'shape':
+            crop_out = self.decoder_shape(z_shape, 0, 0)
+        elif whichdecode == 'color':
+            crop_out = self.decoder_color(0, z_color, 0)
+        elif whichdecode in [None, 'cropped']:
+            crop_out = self.decoder_cropped(z_shape, z_color, 0)
+        else:
+            raise ValueError(f'{whichdecode} is not exported for the retinal decoder')
+        return {'recon': self.run('retinal_head', crop_out, z_location)[0], 'crop': crop_out}
+
+    def __call__(self, x, whichdecode = 'noskip', keepgrad = []):
+        # VAE_CNN.forward for the exported decoders
+        if type(x) == list or type(x) == tuple:
+            l, x = x[2], x[1]
+        else:
+            l = torch.zeros(x.size(0), self.l_dim)
+        mu_shape, log_var_shape, mu_color, log_var_color, mu_location, log_var_location, mu_scale, log_var_scale, hskip = self.encoder(x, l)
+        z_shape = self.sampling(mu_shape, log_var_shape)
+        z_color = self.sampling(mu_color, log_var_color)
+        z_location = self.sampling_location(mu_location, log_var_location)
+        if whichdecode == 'cropped':
+            output = self.decoder_cropped(z_shape, z_color, z_location)
+        elif whichdecode == 'retinal':
+            output = self.decoder_retinal(z_shape, z_color, z_location, 0)
+        elif whichdecode == 'color':
+            output = self.decoder_color(0, z_color, 0)
+        elif whichdecode == 'shape':
+            output = self.decoder_shape(z_shape, 0, 0)
+        elif whichdecode == 'location':
+            output = self.decoder_location(0, 0, z_location)
+        else:
+            raise ValueError(f'{whichdecode} is not exported')
+        return output, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location, mu_scale, log_var_scale
+
+    def activations(self, image, l = None):
+        # mVAE.activations: l1, l2, shape, color, location (l1 and l2 are None)
+        image = image.reshape(-1, 3, self.imgsize, self.imgsize)
+        if l is None:
+            l = torch.zeros(image.size(0), self.l_dim)
+        mu_shape, log_var_shape, mu_color, log_var_color, mu_location, log_var_location, mu_scale, log_var_scale, hskip = self.encoder(image, l)
+        return None, None, self.sampling(mu_shape, log_var_shape), self.sampling(mu_color, log_var_color), self.sampling_location(mu_location, log_var_location)
+
+    def image_activations(self, image, l = None):
+        return self.activations(image, l)[2:]
+
+    # label networks
+    def shape_labels(self, x_labels, n = 1):
+        mu, log_var = self.run('shape_labels', x_labels)
+        std = torch.exp(0.5 * log_var)
+        eps = torch.randn_like(std) * n
+        return mu + eps * std
+
+    def color_labels(self, x_labels):
+        mu, log_var = self.run('color_labels', x_labels)
+        return self.sampling(mu, log_var)
@@ -21,7 +21,7 @@ import torch.optim as optim
 from PIL import Image, ImageDraw, ImageFont
 import matplotlib.pyplot as plt
 import matplotlib.image as mpimg
-from torchvision import datasets, transforms
+from torchvision import datasets, transforms, utils
 from torch.autograd import Variable
 from torchvision.utils import save_image
 from sklearn import svm
@@ -47,11 +47,7 @@ from PIL import Image, ImageOps, ImageEnhance, __version__ as PILLOW_VERSION
 convert_tensor = transforms.ToTensor()
 convert_image = transforms.ToPILImage()
 
-if torch.cuda.is_available():
-    device = 'cuda'
-    print('CUDA')
-else:
-    device = 'cpu'
+print(f'Device: {device}') # configured in mVAE
 
 modelNumber= 1 #which model should be run, this can be 1 through 10
 
@@ -61,7 +57,8 @@ if not os.path.exists(folder_path):
     os.mkdir(folder_path)
 
 #load_checkpoint('output/checkpoint_threeloss_singlegrad200_smfc.pth'.format(modelNumber=modelNumber))
-load_checkpoint('output_emnist_recurr/checkpoint_150.pth') # MLR2.0 trained on emnist letters, digits, and fashion mnist
+load_checkpoint('output_emnist_recurr/checkpoint_150.pth', frozen=True) # MLR2.0 trained on emnist letters, digits, and fashion mnist
+vae = get_vae()
 
 #print('Loading the classifiers')
 clf_shapeS=load('classifier_output/ss.joblib')
@@ -123,12 +120,12 @@ bs=100   # number of samples to extract from the dataset
 
 #### generate some random samples (currently commented out due to cuda errors)  #NOT WORKING
 if (sampleflag):
-    zc=torch.randn(64,16).cuda()*1
-    zs=torch.randn(64,16).cuda()*1
+    zc=torch.randn(64,16, device=device)*1
+    zs=torch.randn(64,16, device=device)*1
     with torch.no_grad():
-        sample = vae.decoder_cropped(zs,zc,0).cuda()
-        sample_c= vae.decoder_cropped(zs*0,zc,0).cuda()
-        sample_s = vae.decoder_cropped(zs, zc*0, 0).cuda()
+        sample = vae.decoder_cropped(zs,zc,0).to(device)
+        sample_c= vae.decoder_cropped(zs*0,zc,0).to(device)
+        sample_s = vae.decoder_cropped(zs, zc*0, 0).to(device)
         sample=sample.view(64, 3, 28, 28)
         sample_c=sample_c.view(64, 3, 28, 28)
         sample_s=sample_s.view(64, 3, 28, 28)
@@ -156,8 +153,8 @@ if Fig2aFlag==1:
 
     test_loader_smaller = test_loader_noSkip
     images, shapelabels = next(iter(test_loader_smaller))#peel off a large number of images
-    #orig_imgs = images.view(-1, 3 * 28 * 28).cuda()
-    imgs = images.clone().cuda()
+    #orig_imgs = images.view(-1, 3 * 28 * 28).to(device)
+    imgs = images.clone().to(device)
 
     #run them all through the encoder
     l1_act, l2_act, shape_act, color_act, location_act = activations(imgs)  #get activations from this small set of images
@@ -172,9 +169,9 @@ if Fig2aFlag==1:
 
     
     #memory retrievals from Bottleneck storage
-    bothRet = vae.decoder_cropped(shape_out_all, color_out_all,0, 0).cuda()  # memory retrieval from the bottleneck
-    #shapeRet = vae.decoder_shape(shape_out_BP_shapeonly, color_out_BP_shapeonly , 0).cuda()  #memory retrieval from the shape map
-    #colorRet = vae.decoder_color(shape_out_BP_coloronly, color_out_BP_coloronly, 0).cuda()  #memory retrieval from the color map
+    bothRet = vae.decoder_cropped(shape_out_all, color_out_all,0, 0).to(device)  # memory retrieval from the bottleneck
+    #shapeRet = vae.decoder_shape(shape_out_BP_shapeonly, color_out_BP_shapeonly , 0).to(device)  #memory retrieval from the shape map
+    #colorRet = vae.decoder_color(shape_out_BP_coloronly, color_out_BP_coloronly, 0).to(device)  #memory retrieval from the color map
     shapeRet = bothRet
     colorRet = bothRet
     save_image(
@@ -215,7 +212,7 @@ if fig_new_loc == 1:
 
     dataiter_noSkip = iter(test_loader_noSkip)
     data = dataiter_noSkip.next()
-    data = data[0] #.cuda()
+    data = data[0] #.to(device)
     
     sample_data = data
     sample_size = 15
@@ -263,14 +260,14 @@ if fig_new_loc == 1:
     line1 = line1.view(1,1,1,2)
     line1 = line1.expand(sample_size, 3, imgsize, 2)
     
-    n_reconc = torch.cat((n_reconc,line1),dim = 3).cuda()
-    n_recons = torch.cat((n_recons,line1),dim = 3).cuda()
-    n_reconl = torch.cat((n_reconl,line1),dim = 3).cuda()
-    n_recond = torch.cat((n_recond,line1),dim = 3).cuda()
+    n_reconc = torch.cat((n_reconc,line1),dim = 3).to(device)
+    n_recons = torch.cat((n_recons,line1),dim = 3).to(device)
+    n_reconl = torch.cat((n_reconl,line1),dim = 3).to(device)
+    n_recond = torch.cat((n_recond,line1),dim = 3).to(device)
     shape_color_dim = retina_size + 2
-    sample = torch.cat((sample[0],line1),dim = 3).cuda()
+    sample = torch.cat((sample[0],line1),dim = 3).to(device)
     
-    reconb = torch.cat((reconb,line1.cuda()),dim = 3).cuda()
+    reconb = torch.cat((reconb,line1.to(device)),dim = 3).to(device)
     utils.save_image(
         torch.cat([sample.view(sample_size, 3, imgsize, retina_size+2), reconb.view(sample_size, 3, imgsize, retina_size+2), n_recond.view(sample_size, 3, imgsize, retina_size+2),
                     n_reconl.view(sample_size, 3, imgsize, retina_size+2), n_reconc.view(sample_size, 3, imgsize, shape_color_dim), n_recons.view(sample_size, 3, imgsize, shape_color_dim)], 0),
@@ -300,7 +297,7 @@ if fig_loc_compare == 1:
 
     data = data_train[0].copy()
     #print(data.size())
-    data[0] = torch.cat((data_test[0][0], data_train[0][0]),dim=0) #.cuda()
+    data[0] = torch.cat((data_test[0][0], data_train[0][0]),dim=0) #.to(device)
     data[1] = torch.cat((data_test[0][1], data_train[0][1]),dim=0)
     data[2] = torch.cat((data_test[0][2], data_train[0][2]),dim=0)
 
@@ -344,14 +341,14 @@ if fig_loc_compare == 1:
     line2 = line1.expand(sample_size, 3, imgsize, 2)
     line1 = line1.expand(2*sample_size, 3, imgsize, 2)
     
-    n_reconc = torch.cat((n_reconc,line1),dim = 3).cuda()
-    n_recons = torch.cat((n_recons,line1),dim = 3).cuda()
-    n_reconl = torch.cat((n_reconl,line1),dim = 3).cuda()
-    n_recond = torch.cat((n_recond,line1),dim = 3).cuda()
+    n_reconc = torch.cat((n_reconc,line1),dim = 3).to(device)
+    n_recons = torch.cat((n_recons,line1),dim = 3).to(device)
+    n_reconl = torch.cat((n_reconl,line1),dim = 3).to(device)
+    n_recond = torch.cat((n_recond,line1),dim = 3).to(device)
     shape_color_dim = retina_size + 2
-    sample_test = torch.cat((sample[0][:sample_size],line2),dim = 3).cuda()
-    sample_train = torch.cat((sample[0][sample_size:(2*sample_size)],line2),dim = 3).cuda()
-    reconb = torch.cat((reconb,line1.cuda()),dim = 3).cuda()
+    sample_test = torch.cat((sample[0][:sample_size],line2),dim = 3).to(device)
+    sample_train = torch.cat((sample[0][sample_size:(2*sample_size)],line2),dim = 3).to(device)
+    reconb = torch.cat((reconb,line1.to(device)),dim = 3).to(device)
     utils.save_image(
         torch.cat((
         torch.cat([sample_train.view(sample_size, 3, imgsize, retina_size+2), reconb[sample_size:(2*sample_size)].view(sample_size, 3, imgsize, retina_size+2), n_reconl[sample_size:(2*sample_size)].view(sample_size, 3, imgsize, retina_size+2),
@@ -396,7 +393,7 @@ if Fig2nFlag==1:
         #img_new = Colorize_func(img)   # Currently broken, but would add a color to each
         all_imgs.append(img_new)
     all_imgs = torch.stack(all_imgs)
-    imgs = all_imgs.view(-1, 3, imgsize, imgsize).cuda()
+    imgs = all_imgs.view(-1, 3, imgsize, imgsize).to(device)
     output, mu_color, log_var_color, mu_shape, log_var_shape, mu_location, log_var_location = vae(all_imgs,whichdecode='skip_cropped')
     z_img = vae.sampling(mu_shape,log_var_shape)
     recon_sample = vae.decoder_shape(z_img, 0, 0)
@@ -416,15 +413,15 @@ if Fig2bFlag==1:
         #img_new = Colorize_func(img)   # Currently broken, but would add a color to each
         all_imgs.append(img_new)
     all_imgs = torch.stack(all_imgs)
-    imgs = all_imgs.view(-1, 3 * imgsize * imgsize).cuda()
-    location = torch.zeros(imgs.size()[0], vae.l_dim).cuda()
+    imgs = all_imgs.view(-1, 3 * imgsize * imgsize).to(device)
+    location = torch.zeros(imgs.size()[0], vae.l_dim, device=device)
     location[0] = 1
     #push the images through the encoder
     l1_act, l2_act, shape_act, color_act, location_act = activations(imgs.view(-1,3,28,28), location)
     
-    imgmatrixL1skip  = torch.empty((0,3,28,28)).cuda()
-    imgmatrixL1noskip  = torch.empty((0,3,28,28)).cuda()
-    imgmatrixMap  = torch.empty((0,3,28,28)).cuda()
+    imgmatrixL1skip  = torch.empty((0,3,28,28)).to(device)
+    imgmatrixL1noskip  = torch.empty((0,3,28,28)).to(device)
+    imgmatrixMap  = torch.empty((0,3,28,28)).to(device)
     
     #now run them through the binding pool!
     #store the items and then retrive them, and do it separately for shape+color maps, then L1, then L2. 
@@ -448,7 +445,7 @@ if Fig2bFlag==1:
         shape_out_BP, color_out_BP, location_out_all, l2_out_all, l1_out_all = BPTokens_retrieveByToken( bpsize, bpPortion, BPOut, Tokenbindings,l1_act.view(numimg,-1), l2_act.view(numimg,-1), shape_act,color_act,location_act,1,normalize_fact_novel)
       
         #reconstruct from BP version of the shape and color maps
-        retrievals = vae.decoder_cropped(shape_out_BP, color_out_BP,0,0).cuda()
+        retrievals = vae.decoder_cropped(shape_out_BP, color_out_BP,0,0).to(device)
 
         imgmatrixL1skip = torch.cat([imgmatrixL1skip,BP_layer1_skip])
         imgmatrixL1noskip = torch.cat([imgmatrixL1noskip,BP_layer1_noskip])
@@ -473,12 +470,12 @@ if Fig2btFlag==1:
 
     #all_imgs is a list of length 3, each of which is a 3x28x28
     all_imgs = torch.stack(all_imgs)
-    imgs = all_imgs.view(-1, 3 * imgsize * imgsize).cuda()   #dimensions are R+G+B + # pixels
+    imgs = all_imgs.view(-1, 3 * imgsize * imgsize).to(device)   #dimensions are R+G+B + # pixels
 
     imgmatrix = imgs.view(numimg,3,28,28)
     #push the images through the model
     l1_act, l2_act, shape_act, color_act, location_act = activations(imgs.view(-1,3,28,28))
-    emptyshape = torch.empty((1,3,28,28)).cuda()
+    emptyshape = torch.empty((1,3,28,28)).to(device)
     # store 1 -> numimg items
     for n in range(1,numimg+1):
         BPOut, Tokenbindings = BPTokens_storage(bpsize, bpPortion, l1_act.view(numimg,-1), l2_act.view(numimg,-1), shape_act,color_act,location_act,0, 0,0,1,0,n,normalize_fact_novel)
@@ -514,7 +511,7 @@ if Fig2cFlag==1:
 
     dataiter_noSkip = iter(test_loader_noSkip)
     data = dataiter_noSkip.next()
-    data = data[0] #.cuda()
+    data = data[0] #.to(device)
     
     sample_data = data
     sample_size = numimg
@@ -524,17 +521,17 @@ if Fig2cFlag==1:
     
     
     #push the images through the model
-    l1_act, l2_act, shape_act, color_act, location_act = activations(sample[1].view(-1,3,28,28).cuda())
-    emptyshape = torch.empty((1,3,28,28)).cuda()
-    imgmatrixMap = sample[1].view(numimg,3,28,28).cuda()
-    imgmatrixL1 = sample[1].view(numimg,3,28,28).cuda()
+    l1_act, l2_act, shape_act, color_act, location_act = activations(sample[1].view(-1,3,28,28).to(device))
+    emptyshape = torch.empty((1,3,28,28)).to(device)
+    imgmatrixMap = sample[1].view(numimg,3,28,28).to(device)
+    imgmatrixL1 = sample[1].view(numimg,3,28,28).to(device)
 
     # store 1 -> numimg items
     for n in range(1,numimg+1):
         #Store and retrieve the map versions
         BPOut, Tokenbindings = BPTokens_storage(bpsize, bpPortion, l1_act.view(numimg,-1), l2_act.view(numimg,-1), shape_act,color_act,location_act,1, 1,0,0,0,n,normalize_fact_novel)
         shape_out_all, color_out_all, location_out_all, l2_out_all, l1_out_all = BPTokens_retrieveByToken( bpsize, bpPortion, BPOut, Tokenbindings,l1_act.view(numimg,-1), l2_act.view(numimg,-1), shape_act,color_act,location_act,n,normalize_fact_novel)
-        retrievals = vae.decoder_cropped(shape_out_all, color_out_all,0,0).cuda()
+        retrievals = vae.decoder_cropped(shape_out_all, color_out_all,0,0).to(device)
 
         #Store and retrieve the L1 version
         BPOut, Tokenbindings = BPTokens_storage(bpsize, bpPortion, l1_act.view(numimg,-1), l2_act.view(numimg,-1), shape_act,color_act,location_act,0, 0,0,1,0,n,normalize_fact_novel)
@@ -589,8 +586,7 @@ if Tab2Flag ==1:
 
         for modelNumber in range(1, numModels + 1):  # which model should be run, this can be 1 through 10
 
-            load_checkpoint(
-                'output{modelNumber}/checkpoint_threeloss_singlegrad50.pth'.format(modelNumber=modelNumber))
+            load_model(modelNumber, 'checkpoint_threeloss_singlegrad50.pth', []) # cached, read once per run
 
             # reset the data set for each set size
             test_loader_smaller = torch.utils.data.DataLoader(dataset=test_dataset, batch_size=numItems, shuffle=True,
@@ -730,8 +726,7 @@ if latents_crossFlag ==1:
 
         for modelNumber in range(1, numModels + 1):  # which model should be run, this can be 1 through 10
 
-            load_checkpoint(
-                'output{modelNumber}/checkpoint_threeloss_singlegrad200.pth'.format(modelNumber=modelNumber))
+            load_model(modelNumber, 'checkpoint_threeloss_singlegrad200.pth', []) # cached, read once per run
 
             # reset the data set for each set size
             test_loader_smaller = torch.utils.data.DataLoader(dataset=test_dataset, batch_size=numItems, shuffle=True,
@@ -923,13 +918,8 @@ if Tab1Flag_noencoding == 1:
     for temp in range(1,numModels +1):  # which model should be run, this can be 1 through 10
 
         modelNumber = 5
-        load_checkpoint('output{modelNumber}/checkpoint_threeloss_singlegrad200.pth'.format(modelNumber=modelNumber))
-
         print('doing model {0} for Table 1'.format(modelNumber))
-        clf_shapeS = load('output{num}/ss{num}.joblib'.format(num=modelNumber))
-        clf_shapeC = load('output{num}/sc{num}.joblib'.format(num=modelNumber))
-        clf_colorC = load('output{num}/cc{num}.joblib'.format(num=modelNumber))
-        clf_colorS = load('output{num}/cs{num}.joblib'.format(num=modelNumber))
+        clf_shapeS, clf_shapeC, clf_colorC, clf_colorS = load_model(modelNumber)
 
         for rep in range(0,perms):
 
@@ -979,14 +969,8 @@ if Tab1Flag == 1:
 
 
     for modelNumber in range(1, numModels + 1):  # which model should be run, this can be 1 through 10
-        load_checkpoint(
-            'output{modelNumber}/checkpoint_threeloss_singlegrad200.pth'.format(modelNumber=modelNumber))
-
         print('doing model {0} for Table 1'.format(modelNumber))
-        clf_shapeS = load('output{num}/ss{num}.joblib'.format(num=modelNumber))
-        clf_shapeC = load('output{num}/sc{num}.joblib'.format(num=modelNumber))
-        clf_colorC = load('output{num}/cc{num}.joblib'.format(num=modelNumber))
-        clf_colorS = load('output{num}/cs{num}.joblib'.format(num=modelNumber))
+        clf_shapeS, clf_shapeC, clf_colorC, clf_colorS = load_model(modelNumber)
 
 
         print('Doing Table 1')
@@ -1002,11 +986,11 @@ if Tab1Flag == 1:
             colorlabels = colorlabels[0:bs_testing]
 
             images, shapelabels = next(iter(test_loader_smaller))  # peel off a large number of images
-            orig_imgs = images.view(-1, 3 * 28 * 28).cuda()
+            orig_imgs = images.view(-1, 3 * 28 * 28).to(device)
             imgs = orig_imgs.clone()
 
             # run them all through the encoder
-            l1_act, l2_act, shape_act, color_act = activations(imgs)  # get activations from this small set of images
+            l1_act, l2_act, shape_act, color_act = tap_activations(imgs, ['fc2', 'conv2', 'shape', 'color']).values()  # get activations from this small set of images
 
             # now store and retrieve them from the BP
             BP_in, shape_out_BP_both, color_out_BP_both, BP_layerI_junk, BP_layer2_junk = BP(bpPortion, l1_act, l2_act,
@@ -1069,8 +1053,8 @@ if Tab1Flag == 1:
             BP_layer1_noskip, mu_color, log_var_color, mu_shape, log_var_shape = vae.forward_layers(BP_layerI_out,
                                                                                                 BP_layer2_out, 1,
                                                                                                 'noskip')  # bp retrievals from layer 1
-            z_color = vae.sampling(mu_color, log_var_color).cuda()
-            z_shape = vae.sampling(mu_shape, log_var_shape).cuda()
+            z_color = vae.sampling(mu_color, log_var_color).to(device)
+            z_shape = vae.sampling(mu_shape, log_var_shape).to(device)
             # Table 1 (memory retrievals from L1)
             print('classifiers accuracy for L1 ')
             pred_ss, pred_sc, SSreport_l1[rep,modelNumber - 1], SCreport_l1[rep,modelNumber - 1] = classifier_shapemap_test_imgs(z_shape, shapelabels, colorlabels,
@@ -1081,8 +1065,8 @@ if Tab1Flag == 1:
 
             BP_layer2_noskip, mu_color, log_var_color, mu_shape, log_var_shape = vae.forward_layers(BP_layerI_out,
                                                                                                 BP_layer2_out, 2,                                                                                            'noskip')  # bp retrievals from layer 2
-            z_color = vae.sampling(mu_color, log_var_color).cuda()
-            z_shape = vae.sampling(mu_shape, log_var_shape).cuda()
+            z_color = vae.sampling(mu_color, log_var_color).to(device)
+            z_shape = vae.sampling(mu_shape, log_var_shape).to(device)
 
             # Table 1 (memory retrievals from L2)
             print('classifiers accuracy for L2 ')
@@ -1261,14 +1245,8 @@ if Tab1SuppFlag ==1:
                 accuracyColor_cat = list()
 
 
-                load_checkpoint(
-                    'output{modelNumber}/checkpoint_threeloss_singlegrad200.pth'.format(modelNumber=modelNumber))
-
                 print('doing model {0} for Table 1S'.format(modelNumber))
-                clf_shapeS = load('output{num}/ss{num}.joblib'.format(num=modelNumber))
-                clf_shapeC = load('output{num}/sc{num}.joblib'.format(num=modelNumber))
-                clf_colorC = load('output{num}/cc{num}.joblib'.format(num=modelNumber))
-                clf_colorS = load('output{num}/cs{num}.joblib'.format(num=modelNumber))
+                clf_shapeS, clf_shapeC, clf_colorC, clf_colorS = load_model(modelNumber)
 
 
                 #the ratio of visual information encoded into memory
@@ -1279,15 +1257,16 @@ if Tab1SuppFlag ==1:
                 shape_coeff_cat = 0
                 color_coeff_cat = 0
 
+                act_buffers = {} # activations of every permutation are written into the same tensors
                 for i in range(perms):
                     # print('iterstart')
                     images, shapelabels = next(iter(test_loader_smaller))  # load up a set of digits
 
-                    imgs = images.view(-1, 3 * 28 * 28).cuda()
+                    imgs = images.view(-1, 3 * 28 * 28).to(device)
                     colorlabels = torch.round(
                         imgs[:, 0] * 255)
 
-                    l1_act, l2_act, shape_act, color_act = activations(imgs)
+                    l1_act, l2_act, shape_act, color_act = tap_activations(imgs, ['fc2', 'conv2', 'shape', 'color'], buffers=act_buffers).values()
 
                     shapepred, x, y, z = classifier_shapemap_test_imgs(shape_act, shapelabels, colorlabels, numItems,
                                                                        clf_shapeS, clf_shapeC)
@@ -1295,9 +1274,9 @@ if Tab1SuppFlag ==1:
                                                                        clf_colorC, clf_colorS)
                     # one hot coding of labels before storing into the BP
                     shape_onehot = F.one_hot(shapepred, num_classes=20)
-                    shape_onehot = shape_onehot.float().cuda()
+                    shape_onehot = shape_onehot.float().to(device)
                     color_onehot = F.one_hot(colorpred, num_classes=10)
-                    color_onehot = color_onehot.float().cuda()
+                    color_onehot = color_onehot.float().to(device)
                     #binding output when only maps are stored;  storeLabels=0
                     shape_out, color_out, L2_out, L1_out, shapelabel_junk, colorlabel_junk=BPTokens_with_labels(
                         bpsize, bpPortion, 0,shape_coeff, color_coeff, shape_act, color_act, l1_act, l2_act, shape_onehot,
@@ -1537,7 +1516,7 @@ if TabTwoColorFlag1 == 1:
 
     imgs_all.append(img_new)
     imgs_all = torch.stack(imgs_all)
-    imgs = imgs_all.view(-1, 3 * 28 * 28).cuda()
+    imgs = imgs_all.view(-1, 3 * 28 * 28).to(device)
     img_new = convert_image(img_new)
     save_image(
             torch.cat([trans2(img_new).view(1, 3, 28, 28)], 0),
@@ -1548,7 +1527,7 @@ if TabTwoColorFlag1 == 1:
         )
 
             # run them all through the encoder
-    l1_act, l2_act, shape_act, color_act = activations(imgs)  # get activations from this small set of images
+    l1_act, l2_act, shape_act, color_act = tap_activations(imgs, ['fc2', 'conv2', 'shape', 'color']).values()  # get activations from this small set of images
 
     # now store and retrieve them from the BP
     BP_in, shape_out_BP_both, color_out_BP_both, BP_layerI_junk, BP_layer2_junk = BP(bpPortion, l1_act, l2_act,
@@ -1630,7 +1609,7 @@ if TabTwoColorFlag == 1:
 
         imgs_all.append(img_new)
     imgs_all = torch.stack(imgs_all)
-    imgs = imgs_all.view(-1, 3 * 28 * 28).cuda()
+    imgs = imgs_all.view(-1, 3 * 28 * 28).to(device)
     img_new = convert_image(img_new)
     save_image(
             torch.cat([trans2(img_new).view(1, 3, 28, 28)], 0),
@@ -1645,7 +1624,7 @@ if TabTwoColorFlag == 1:
     print(colorlabels)
     print(shapelabels)
             # run them all through the encoder
-    l1_act, l2_act, shape_act, color_act = activations(imgs)  # get activations from this small set of images
+    l1_act, l2_act, shape_act, color_act = tap_activations(imgs, ['fc2', 'conv2', 'shape', 'color']).values()  # get activations from this small set of images
 
     # now store and retrieve them from the BP
     BP_in, shape_out_BP_both, color_out_BP_both, BP_layerI_junk, BP_layer2_junk = BP(bpPortion, l1_act, l2_act,
@@ -1708,8 +1687,8 @@ if TabTwoColorFlag == 1:
     BP_layer1_noskip, mu_color, log_var_color, mu_shape, log_var_shape = vae.forward_layers(BP_layerI_out,
                                                                                         BP_layer2_out, 1,
                                                                                         'noskip')  # bp retrievals from layer 1
-    z_color = vae.sampling(mu_color, log_var_color).cuda()
-    z_shape = vae.sampling(mu_shape, log_var_shape).cuda()
+    z_color = vae.sampling(mu_color, log_var_color).to(device)
+    z_shape = vae.sampling(mu_shape, log_var_shape).to(device)
     # Table 1 (memory retrievals from L1)
     print('classifiers accuracy for L1 ')
     
@@ -1721,8 +1700,8 @@ if TabTwoColorFlag == 1:
 
     BP_layer2_noskip, mu_color, log_var_color, mu_shape, log_var_shape = vae.forward_layers(BP_layerI_out,
                                                                                         BP_layer2_out, 2,                                                                                            'noskip')  # bp retrievals from layer 2
-    z_color = vae.sampling(mu_color, log_var_color).cuda()
-    z_shape = vae.sampling(mu_shape, log_var_shape).cuda()
+    z_color = vae.sampling(mu_color, log_var_color).to(device)
+    z_shape = vae.sampling(mu_shape, log_var_shape).to(device)
 
     # Table 1 (memory retrievals from L2)
     print('classifiers accuracy for L2 ')
@@ -1843,6 +1822,7 @@ if noveltyDetectionFlag==1:
     outputFile.write(
             '\naccuracy of detecting the novel shapes : mean is {0:.4g} and SE is {1:.4g} '.format(mean_nov, nov_SE))
 
+print('checkpoint cache:', checkpoint_cache.info())
 outputFile.close()
 
 def plotbpvals(set1,set2,set3,set4,set5,label):
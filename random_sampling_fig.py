@@ -1,5 +1,5 @@
+import os
 import torch
-from mVAE import vae, load_checkpoint
 from torchvision import utils
 import numpy as np
 from sklearn.manifold import TSNE
@@ -8,7 +8,13 @@ from dataset_builder import dataset_builder
 from random import random
 
 v = '' # which model version to use, set to '' for the most recent
-load_checkpoint(f'output_emnist_recurr{v}/checkpoint_300.pth')
+if 'MLR_ONNX' in os.environ: # the graphs written by onnx_backend.export_onnx, on onnxruntime without the training stack
+    from onnx_backend import ONNXBackend
+    vae = ONNXBackend(os.environ['MLR_ONNX'])
+    device = 'cpu'
+else:
+    from mVAE import vae, load_checkpoint, device
+    load_checkpoint(f'output_emnist_recurr{v}/checkpoint_300.pth', frozen=True)
 
 
 vae.eval()
@@ -16,14 +22,14 @@ b = 100
 grid_size = int(b**(1/2))
 with torch.no_grad():
     # generate latent shape samples:
-    #sample = torch.rand(b,128).cuda()
-    mu_shape = torch.cat([torch.rand(b//2,16).cuda(),torch.rand(b//2,16).cuda()],dim=0) *10 + (torch.randn(b,16).cuda()) #* 1.2# + 0.1 #((torch.rand(b,16).cuda()*0.6) + (torch.randn(b,16).cuda()*0.4)) * 2 #+ 0.1#vae.fc31(sample) * 1.2 #)
+    #sample = torch.rand(b,128, device=device)
+    mu_shape = torch.cat([torch.rand(b//2,16, device=device),torch.rand(b//2,16, device=device)],dim=0) *10 + (torch.randn(b,16, device=device)) #* 1.2# + 0.1 #((torch.rand(b,16, device=device)*0.6) + (torch.randn(b,16, device=device)*0.4)) * 2 #+ 0.1#vae.fc31(sample) * 1.2 #)
     
     #print(mu_shape[0])
-    log_var_shape = torch.rand(b,16).cuda()* 0.8 -4 #4# ((torch.rand(b,16).cuda()*0.2)+4) #vae.fc32(sample) #()+ (torch.randn(b,16).cuda()*0.4)
+    log_var_shape = torch.rand(b,16, device=device)* 0.8 -4 #4# ((torch.rand(b,16, device=device)*0.2)+4) #vae.fc32(sample) #()+ (torch.randn(b,16, device=device)*0.4)
     #print(log_var_shape[0])
     z_img = vae.sampling(mu_shape,log_var_shape)
-    #z_img  = torch.randn(b,16).cuda()
+    #z_img  = torch.randn(b,16, device=device)
 
     # run tsne on sampling:
     tensors = [item.cpu().detach().numpy() for item in z_img]
@@ -45,7 +51,7 @@ with torch.no_grad():
         sorted_by_y = sorted_by_y[grid_size:]
     
     l_values = [item[2] for sublist in row_list for item in sublist]
-    sorted_z = torch.zeros(b,16).cuda()
+    sorted_z = torch.zeros(b,16, device=device)
     for i in range(b):
         j = l_values[i]
         sorted_z[i]  = z_img[j]
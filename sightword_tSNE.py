@@ -1,4 +1,4 @@
-from mVAE import vae, image_activations
+from mVAE import load_checkpoint, image_activations, device
 from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
 import torch
@@ -12,15 +12,10 @@ from mpl_toolkits.mplot3d import Axes3D
 
 vals = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z']
 
-device ='cuda'
-def load_checkpoint(filepath):
-    checkpoint = torch.load(filepath,device)
-    vae.load_state_dict(checkpoint['state_dict'])
-    return vae
 modelNumber = 1
 v = '' #'_v1'
 cur_dataset = 'emnist'
-'''load_checkpoint(f'output_emnist_recurr{v}/checkpoint_300.pth') # MLR2.0 trained on emnist letters, digits, and fashion mnist
+'''vae = load_checkpoint(f'output_emnist_recurr{v}/checkpoint_300.pth', components=['encoder']) # MLR2.0 trained on emnist letters, digits, and fashion mnist
 
 vae.eval()
 
@@ -39,7 +34,7 @@ torch.save([], f'{cur_dataset}rep.pt')
 reps = []
 c = 0
 for data_tup in tqdm(train_loader):
-    z_shape, z_color, z_location = image_activations(data_tup[0].view(-1,3,28,28).cuda())
+    z_shape, z_color, z_location = image_activations(data_tup[0].view(-1,3,28,28).to(device))
     reps += [(z_shape,data_tup[1][0].item())]
     #print(data_tup[1][0].item())
     if len(reps)==1200:
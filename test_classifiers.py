@@ -8,7 +8,7 @@ from mVAE import load_checkpoint
 v=''
 clf_ss = load(f'classifier_output{v}/ss.joblib')
 clf_sc = load(f'classifier_output{v}/sc.joblib')
-load_checkpoint(f'output_emnist_recurr{v}/checkpoint_300.pth') # MLR2.0 trained on emnist letters, digits, and fashion mnist
+load_checkpoint(f'output_emnist_recurr{v}/checkpoint_300.pth', frozen=True, components=['encoder', 'decoder']) # MLR2.0 trained on emnist letters, digits, and fashion mnist
 
 bs = 1001
 test_bs = 1000
@@ -1,10 +1,10 @@
 # prerequisites
-from dataset_builder import Dataset
+from dataset_builder import Dataset, label_column
 #from dataset_builder_old import dataset_builder
 from torchvision import utils
 import time
 import torch
-from mVAE import place_crop
+from mVAE import place_crop, device
 
 transform = {'retina':True, 'colorize':True, 'scale':False, 'location_targets':{'left':[0,1,2,3], 'right':[4,5,6,7]}, 'color_targets':{4:[4,3,7], 1:[8,1], 2:[5,6]}}
 train_data = Dataset('mnist', transform)
@@ -15,14 +15,11 @@ data,labels = next(iter(train_loader))
 
 #print(labels[0][0:100])
 data1 = place_crop(data[1],data[2])
-out = torch.cat([data[0][0:1].cuda(),data1[0:1].cuda()],dim=0)
+out = torch.cat([data[0][0:1].to(device),data1[0:1].to(device)],dim=0)
 utils.save_image(out,'datasettest.png')
 #utils.save_image(data1[0][0:1],'datasettest1.png')
 s = 0
-for i in range(len(labels[0])):
-    shape = labels[0][i].item()
-    color = labels[1][i].item()
-    retina = labels[2][i].item()
+for i, (shape, color, retina) in enumerate(zip(label_column(labels, 'shape').tolist(), label_column(labels, 'color').tolist(), label_column(labels, 'location').tolist())):
 
     x = data_ranges[shape] #[ [a,b], [c,d] ]
 
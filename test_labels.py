@@ -1,13 +1,13 @@
 from label_network import *
 import torch
-from mVAE import vae, load_checkpoint
+from mVAE import load_checkpoint
 from torch.utils.data import DataLoader, ConcatDataset
 from dataset_builder import dataset_builder
 
-load_checkpoint('output_emnist_recurr/checkpoint_300.pth')
+load_checkpoint('output_emnist_recurr/checkpoint_300.pth', frozen=True, components=['encoder', 'decoder'])
 bs = 50
-load_checkpoint_shapelabels('output_label_net/checkpoint_shapelabels10.pth')
-load_checkpoint_colorlabels('output_label_net/checkpoint_colorlabels10.pth')
+load_checkpoint_shapelabels('output_label_net/checkpoint_labels10')
+load_checkpoint_colorlabels('output_label_net/checkpoint_labels10')
 
 
 # trainging datasets, the return loaders flag is False so the datasets can be concated in the dataloader
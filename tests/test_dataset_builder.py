@@ -0,0 +1,32 @@
+import pytest
+import torch
+from dataset_builder import Dataset, compose_retina, extract_crops
+
+@pytest.mark.parametrize('colorize', [True, False])
+def test_batched_retina_matches_per_item(colorize):
+    # the same (seed, epoch, index) key gives the same stimulus with and without batched_retina
+    transforms = {'retina':True, 'colorize':colorize, 'scale':False}
+    per_item = Dataset('mnist', transforms, seed=1234)
+    batched = Dataset('mnist', dict(transforms, batched_retina=True), seed=1234)
+    keys = [(epoch, index) for epoch in range(2) for index in range(8)]
+
+    out, labels = batched.collate_fn()([batched[key] for key in keys])
+    for i, key in enumerate(keys):
+        (retinal, crop, position), label = per_item[key]
+        assert torch.equal(label, labels[i])
+        assert torch.equal(crop, out[1][i])
+        assert torch.equal(retinal, out[0][i])
+        assert torch.equal(position, out[2][i])
+
+def test_compose_retina_matches_loop():
+    # against placing every crop with a python loop, and extract_crops as its inverse
+    crops = torch.rand(6, 3, 28, 28)
+    x, y = torch.tensor([0, 3, 10, 17, 30, 36]), torch.tensor([36, 0, 5, 20, 11, 2])
+    retinal, position = compose_retina(crops, x, y, 64)
+    for i in range(len(crops)):
+        expected = torch.zeros(3, 64, 64)
+        top = 64 - 28 - y[i]
+        expected[:, top:top + 28, x[i]:x[i] + 28] = crops[i]
+        assert torch.equal(retinal[i], expected)
+        assert position[i, 0].argmax() == x[i] and position[i, 1].argmax() == y[i]
+    assert torch.equal(extract_crops(retinal, x, y, 28), crops)
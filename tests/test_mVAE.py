@@ -0,0 +1,141 @@
+import copy
+import pytest
+import torch
+from mVAE import VAE_CNN, place_crop, extract_crop, imgsize, retina_size, x_dim, h_dim1, h_dim2, z_dim, l_dim, sc_dim
+from mVAE import checkpoint_components, checkpoint_component, read_checkpoint, save_checkpoint_shards
+from mVAE import loss_function, loss_function_crop, loss_function_shape, loss_function_color, loss_function_location
+
+def test_place_crop_matches_loop():
+    # against the per sample loop place_crop used to run, extract_crop pulls the same crops back out
+    crops = torch.rand(5, 3, imgsize, imgsize)
+    x, y = torch.tensor([0, 7, 19, 30, retina_size - imgsize]), torch.tensor([retina_size - imgsize, 0, 12, 25, 4])
+    loc = torch.zeros(5, 2, retina_size)
+    loc[torch.arange(5), 0, x] = 1
+    loc[torch.arange(5), 1, y] = 1
+    retinal = place_crop(crops, loc)
+    expected = torch.zeros(5, 3, retina_size, retina_size)
+    for i in range(len(expected)):
+        expected[i, :, (retina_size - y[i]) - imgsize:retina_size - y[i], x[i]:x[i] + imgsize] = crops[i]
+    assert torch.equal(retinal, expected)
+    assert torch.equal(extract_crop(retinal, loc), crops)
+
+def small_vae():
+    # the stn retinal head keeps the model small
+    torch.manual_seed(0)
+    return VAE_CNN(x_dim, h_dim1, h_dim2, z_dim, l_dim, sc_dim, 'stn')
+
+def batch(n = 4):
+    torch.manual_seed(1)
+    crop = torch.rand(n, 3, imgsize, imgsize)
+    loc = torch.zeros(n, 2, retina_size)
+    loc[:, 0, 10] = 1
+    loc[:, 1, 20] = 1
+    return [place_crop(crop, loc), crop, loc]
+
+@pytest.mark.parametrize('training', [True, False])
+def test_decode_matches_forward(training):
+    # one encode with every decoder on its bundle gives what forward gives for each mode, for the same latent noise
+    vae = small_vae().train(training)
+    x = batch()
+    modes = ['cropped', 'retinal', 'skip_cropped', 'color', 'shape', 'location']
+    torch.manual_seed(2)
+    bundle = vae.encode(x)
+    decoded = vae.decode(bundle, modes)
+    for mode in modes:
+        torch.manual_seed(2)
+        output, mu_color, log_var_color, mu_shape, log_var_shape = vae(x, mode)[:5]
+        assert torch.allclose(mu_shape, bundle['mu_shape']) and torch.allclose(mu_color, bundle['mu_color'])
+        if mode == 'retinal':
+            assert torch.allclose(output['recon'], decoded[mode]['recon'], atol=1e-6)
+            assert torch.allclose(output['crop'], decoded[mode]['crop'], atol=1e-6)
+        else:
+            assert torch.allclose(output, decoded[mode], atol=1e-6)
+
+def test_keepgrad_pruning_matches_full_autograd(monkeypatch):
+    # encode only records autograd in the encoder parts feeding the latents in keepgrad, the losses and gradients of the
+    # training steps must match running the whole encoder with autograd and detaching the latents afterwards
+    vae = small_vae().train()
+    x = batch(8)
+    losses = {'shape': lambda out: loss_function_shape(out[0], x, out[3], out[4]),
+              'color': lambda out: loss_function_color(out[0], x, out[1], out[2]),
+              'location': lambda out: loss_function_location(out[0], x, out[5], out[6]),
+              'cropped': lambda out: loss_function_crop(out[0], x[1], out[3], out[4], out[1], out[2]),
+              'retinal': lambda out: loss_function(out[0]['recon'], x, out[0]['crop'], out[3], out[4], out[1], out[2]),
+              'skip_cropped': lambda out: loss_function_crop(out[0], x[1], out[3], out[4], out[1], out[2])}
+    steps = [('shape', ['shape'], x), ('color', ['color'], x), ('location', ['location'], x), ('cropped', ['shape', 'color'], x),
+             ('retinal', [], x), ('skip_cropped', ['skip'], x[1])]
+
+    def run():
+        out = {}
+        for mode, keepgrad, data in steps:
+            vae.zero_grad(set_to_none=True)
+            torch.manual_seed(3)
+            loss = losses[mode](vae(data, mode, keepgrad))
+            loss.backward()
+            out[mode] = (loss.detach(), {name: parameter.grad for name, parameter in vae.named_parameters()})
+        return out
+
+    state = copy.deepcopy(vae.state_dict()) # the batchnorm running statistics move with every step
+    pruned = run()
+    vae.load_state_dict(state)
+    monkeypatch.setattr(vae, 'encoder', lambda x, l, keepgrad = None, skip = True: VAE_CNN.encoder(vae, x, l, None, skip))
+    full = run()
+    for mode, keepgrad, data in steps:
+        assert torch.equal(pruned[mode][0], full[mode][0])
+        for name, grad in full[mode][1].items():
+            if grad is None or pruned[mode][1][name] is None:
+                assert (grad is None or not grad.any()) and (pruned[mode][1][name] is None or not pruned[mode][1][name].any()), name
+            else:
+                assert torch.equal(grad, pruned[mode][1][name]), name
+
+@pytest.mark.parametrize('training', [True, False])
+def test_freeze_for_inference_matches_eval(training):
+    # the folded model gives the eval outputs, thaw puts the batchnorms back and the mode the model had
+    vae = small_vae().train(training)
+    for module in vae.modules():
+        if isinstance(module, torch.nn.modules.batchnorm._BatchNorm):
+            module.running_mean.normal_()
+            module.running_var.uniform_(0.5, 2)
+    x = batch()
+    modes = ['cropped', 'retinal', 'skip_cropped', 'color', 'shape', 'location']
+    state = copy.deepcopy(vae.state_dict())
+    vae.eval()
+    with torch.no_grad():
+        torch.manual_seed(2)
+        expected = vae.decode(vae.encode(x), modes)
+        vae.train(training)
+        vae.freeze_for_inference()
+        torch.manual_seed(2)
+        frozen = vae.decode(vae.encode(x), modes)
+    assert not vae.training and not any([parameter.requires_grad for parameter in vae.parameters()])
+    for mode in modes:
+        if mode == 'retinal':
+            assert torch.allclose(frozen[mode]['recon'], expected[mode]['recon'], atol=1e-5)
+            assert torch.allclose(frozen[mode]['crop'], expected[mode]['crop'], atol=1e-5)
+        else:
+            assert torch.allclose(frozen[mode], expected[mode], atol=1e-5)
+
+    vae.thaw()
+    assert vae.training == training and vae.frozen == False
+    assert all([parameter.requires_grad for parameter in vae.parameters()])
+    assert all([torch.equal(value, state[key]) for key, value in vae.state_dict().items()]) and vae.state_dict().keys() == state.keys()
+
+@pytest.mark.parametrize('layout', ['shards', 'file', 'legacy_file'])
+def test_read_checkpoint_components(tmp_path, layout):
+    # only the keys of the requested components come back, from a sharded folder, a checkpoint file and a pre 1.6 (not zip) file
+    vae = small_vae()
+    state = vae.state_dict()
+    filepath = str(tmp_path / 'checkpoint')
+    if layout == 'shards':
+        save_checkpoint_shards(filepath, vae)
+    else:
+        torch.save({'state_dict': state}, filepath, _use_new_zipfile_serialization=layout == 'file')
+    for components in [['encoder'], ['decoder', 'retinal_head'], list(checkpoint_components)]:
+        state_dict = read_checkpoint(filepath, components)
+        assert set(state_dict) == set([key for key in state if checkpoint_component(key) in components])
+        assert all([torch.equal(value, state[key]) for key, value in state_dict.items()])
+    with pytest.raises(ValueError):
+        read_checkpoint(filepath, ['classifier'])
+    if layout != 'shards':
+        with pytest.raises(ValueError):
+            read_checkpoint(filepath, ['encoder', 'optimizer'])
@@ -0,0 +1,20 @@
+import torch
+from torch.utils.data import Subset
+from dataset_builder import Dataset, ShardDataset, render_shards
+
+def test_render_shards_scale(tmp_path):
+    # a retinal dataset with scale writes a 1-d scale column, it has to read back as the one-hot batches the Dataset gives
+    transforms = {'retina':True, 'colorize':True, 'scale':True, 'scale_targets':{0:[0,1,2,3,4], 1:[5,6,7,8,9]}}
+    dataset = Dataset('mnist', transforms)
+    dataset.dataset = Subset(dataset.dataset, range(16))
+    render_shards(dataset, str(tmp_path / 'shards'), batch_size=8)
+
+    shards = ShardDataset(str(tmp_path / 'shards'))
+    assert len(shards) == 16
+    columns, labels = shards[3]
+    assert columns['scale'].dim() == 0
+
+    (retinal, crop, position, scale), labels = next(iter(shards.get_loader(8)))
+    assert scale.size() == (8, 10)
+    assert torch.equal(scale.sum(1), torch.ones(8))
+    assert retinal.size(0) == crop.size(0) == position.size(0) == 8
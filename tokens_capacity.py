@@ -76,18 +76,19 @@ def dataset_with_indices(cls):
     })
 
 
+def load_model(modelNumber, checkpoint = 'checkpoint_threeloss_singlegrad200.pth', classifiers = ['ss', 'sc', 'cc', 'cs']):
+    # swaps model modelNumber of the 10 model sweeps into vae (frozen) through mVAE.checkpoint_cache, so every model is read from
+    # disk once per run; returns its classifiers, by default clf_shapeS, clf_shapeC, clf_colorC, clf_colorS
+    return checkpoint_cache.load('output{num}/{checkpoint}'.format(num=modelNumber, checkpoint=checkpoint),
+                                 ['output{num}/{clf}{num}.joblib'.format(num=modelNumber, clf=clf) for clf in classifiers], frozen=True)[1]
+
 def binding_cue(bs_testing, perms,bpsize, bpPortion, shape_coeff, color_coeff,samediff, modelNumber ):
     #global numcolors
     #This function presents two colored digits to the model and binds them to two different tokens
     #then it tries to retrieve one token based on a shape cue, reporting the accuracy
 
 
-    load_checkpoint('output{modelNumber}/checkpoint_threeloss_singlegrad200.pth'.format(modelNumber=modelNumber))
-
-    clf_shapeS = load('output{num}/ss{num}.joblib'.format(num=modelNumber))
-    clf_shapeC = load('output{num}/sc{num}.joblib'.format(num=modelNumber))
-    clf_colorC = load('output{num}/cc{num}.joblib'.format(num=modelNumber))
-    clf_colorS = load('output{num}/cs{num}.joblib'.format(num=modelNumber))
+    clf_shapeS, clf_shapeC, clf_colorC, clf_colorS = load_model(modelNumber)
 
     #if samediff parameter is "diff" then it will use two different digits, otherwise they will be the same
 
@@ -117,6 +118,7 @@ def binding_cue(bs_testing, perms,bpsize, bpPortion, shape_coeff, color_coeff,sa
     shape_labels_all=torch.zeros(perms)
     
     
+    act_buffers, grey_buffers = {}, {} # activations of every permutation are written into the same tensors
     for rep in range(perms):
             image, shapelabel,idx = next(iter(test_loader_smaller))  # load up one digit
             colorlabel = torch.round(image[0,0,0,0] * 255)
@@ -138,13 +140,13 @@ def binding_cue(bs_testing, perms,bpsize, bpPortion, shape_coeff, color_coeff,sa
         
 
 
-            imgs = images.view(-1, 3 * 28 * 28).cuda()
-            imgs_grey = images_grey.view(-1, 3 * 28 * 28).cuda()
+            imgs = images.view(-1, 3 * 28 * 28).to(device)
+            imgs_grey = images_grey.view(-1, 3 * 28 * 28).to(device)
 
    
             # generating encoder and latent activations
-            l1_act, l2_act, shape_act, color_act = activations(imgs.float())
-            l1_act_grey, l2_act_grey, shape_act_grey, color_act_grey = activations(imgs_grey)
+            l1_act, l2_act, shape_act, color_act = tap_activations(imgs.float(), ['fc2', 'conv2', 'shape', 'color'], buffers=act_buffers).values()
+            shape_act_grey, color_act_grey = tap_activations(imgs_grey, ['shape', 'color'], buffers=grey_buffers).values()
 
             #now do the memory retrieval
             tokenactivation[:, rep], whichtoken[rep], shape_out, color_out, l1_out = BPTokens_binding_all(bpsize,
@@ -183,6 +185,7 @@ def storeretrieve_crosscorrelation_test(setSize, perms, bpsize, bpPortion, shape
     # it shows that performance is lower for the novels, and also drops off more quickly as set size increases
     # Moreover, if you try to encode the novels using the bottleneck, correlations are much worse.
 
+    vae = get_vae()
     #famnovel = "fam" = familiar items
     #layernum:  1 = layer 1, otherwise bottleneck (shape and color combined)
 
@@ -216,10 +219,10 @@ def storeretrieve_crosscorrelation_test(setSize, perms, bpsize, bpPortion, shape
                 # save_image(images,'novelTrans.png')
             images = torch.stack(images)
 
-        imgs = images.view(-1, 3 * 28 * 28).cuda()
+        imgs = images.view(-1, 3 * 28 * 28).to(device)
         # generating encoder and latent activations
 
-        l1_act, l2_act, shape_act, color_act = activations(imgs)
+        l1_act, l2_act, shape_act, color_act = tap_activations(imgs, ['fc2', 'conv2', 'shape', 'color']).values()
 
         if layernum==1:#staright recon from L1 using skip
             l1_act_tr = l1_act.clone()
@@ -247,14 +250,14 @@ def storeretrieve_crosscorrelation_test(setSize, perms, bpsize, bpPortion, shape
 
         else:
             if memory==0:
-                retrievals = vae.decoder_noskip(shape_act, color_act, 0).cuda()
+                retrievals = vae.decoder_noskip(shape_act, color_act, 0).to(device)
             else:
                 shape_out_all, color_out_all, l2_out_all, l1_out_all = BPTokens(bpsize, bpPortion, shape_coeff,
                                                                                 color_coeff,
                                                                                 0, 0,
                                                                                 shape_act, color_act, l1_act, l2_act,
                                                                                 setSize, 0, normalize_fact_familiar)
-                retrievals = vae.decoder_noskip(shape_out_all, color_out_all, 0).cuda()
+                retrievals = vae.decoder_noskip(shape_out_all, color_out_all, 0).to(device)
 
 
 
@@ -275,7 +278,7 @@ def storeretrieve_crosscorrelation_test(setSize, perms, bpsize, bpPortion, shape
 ###################################### detecting whether a stimulus novel or familiar
 def novelty_detect( perms, bpsize, bpPortion, shape_coeff, color_coeff, normalize_fact_familiar,
                   normalize_fact_novel, modelNumber, test_loader_smaller):
- 
+    vae = get_vae()
     trans2 = transforms.ToTensor()
     
     setSize=1
@@ -311,9 +314,9 @@ def novelty_detect( perms, bpsize, bpPortion, shape_coeff, color_coeff, normaliz
 
         
         #compute the cross-correlation for images reconstructed from the bottleneck   
-        imgs = images_all.view(-1, 3 * 28 * 28).cuda()        
-        l1_act, l2_act, shape_act, color_act = activations(imgs)   
-        retrievals = vae.decoder_noskip(shape_act, color_act, 0).cuda()
+        imgs = images_all.view(-1, 3 * 28 * 28).to(device)        
+        l1_act, l2_act, shape_act, color_act = tap_activations(imgs, ['fc2', 'conv2', 'shape', 'color']).values()   
+        retrievals = vae.decoder_noskip(shape_act, color_act, 0).to(device)
         
         
         corr= list()
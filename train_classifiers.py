@@ -13,7 +13,7 @@ folder_path = f'classifier_output{v}' # the output folder for the trained model
 if not os.path.exists(folder_path):
     os.mkdir(folder_path)
 
-load_checkpoint(f'output_emnist_recurr{v}/checkpoint_300.pth') # MLR2.0 trained on emnist letters, digits, and fashion mnist
+load_checkpoint(f'output_emnist_recurr{v}/checkpoint_300.pth', components=['encoder', 'decoder']) # MLR2.0 trained on emnist letters, digits, and fashion mnist
 
 bs = 20000
 test_bs = 10000
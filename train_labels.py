@@ -1,11 +1,11 @@
 from label_network import *
 import torch
-from mVAE import vae, load_checkpoint
+from mVAE import load_checkpoint, save_checkpoint_shards
 from torch.utils.data import DataLoader, ConcatDataset
 from dataset_builder import Dataset
-load_checkpoint('output_emnist_recurr/checkpoint_150.pth')
+load_checkpoint('output_emnist_recurr/checkpoint_150.pth', components=['encoder', 'decoder']) # the retinal head is not used
 bs = 50
-#load_checkpoint_shapelabels('output_label_net/checkpoint_shapelabels5.pth')
+#load_checkpoint_shapelabels('output_label_net/checkpoint_labels5')
 
 transforms = { 'colorize':True}
 
@@ -17,14 +17,7 @@ for epoch in range (1,21):
     train_labels(epoch, train_loader_noSkip)
         
     if epoch in [1,5,10,20]:
-        checkpoint =  {
-                 'state_dict_shape_labels': vae_shape_labels.state_dict(),
-                 'state_dict_color_labels': vae_color_labels.state_dict(),
-
-                 'optimizer_shape' : optimizer_shapelabels.state_dict(),
-                 'optimizer_color': optimizer_colorlabels.state_dict(),
-
-                      }
-        torch.save(checkpoint,f'output_label_net/checkpoint_shapelabels'+str(epoch)+'.pth')
-        torch.save(checkpoint, f'output_label_net/checkpoint_colorlabels' + str(epoch) + '.pth')
+        # one sharded checkpoint for both label networks, load_checkpoint_shapelabels and load_checkpoint_colorlabels take its folder
+        save_checkpoint_shards(f'output_label_net/checkpoint_labels{epoch}', shape_labels=vae_shape_labels.state_dict(), color_labels=vae_color_labels.state_dict(),
+                               optimizer_shape=optimizer_shapelabels.state_dict(), optimizer_color=optimizer_colorlabels.state_dict())
 
@@ -1,6 +1,6 @@
 from label_network import *
 import torch
-from mVAE import vae, load_checkpoint
+from mVAE import load_checkpoint
 from torch.utils.data import DataLoader, ConcatDataset
 from dataset_builder import dataset_builder
 